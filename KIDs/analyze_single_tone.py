@@ -5,10 +5,11 @@ from KIDs import calibrate
 from scipy import interpolate
 import pickle
 from scipy.stats import binned_statistic
+from KIDs import results_store
 
 
 
-def calibrate_single_tone(fine_f,fine_z,gain_f,gain_z,stream_f,stream_z,plot_period = 1,interp = "quadratic"):
+def calibrate_single_tone(fine_f,fine_z,gain_f,gain_z,stream_f,stream_z,plot_period = 1,interp = "quadratic",save_format = "h5"):
 
     fig = plt.figure(3,figsize = (16,10))
 
@@ -127,12 +128,12 @@ def calibrate_single_tone(fine_f,fine_z,gain_f,gain_z,stream_f,stream_z,plot_per
                         'fine_corr':fine_corr,
                         'stream_df_over_f':stream_df_over_f_all}
 
-    pickle.dump( cal_dict, open( "cal.p", "wb" ),2 )  
+    results_store.save_dict(cal_dict, "cal", save_format)
     return cal_dict
 
 
 
-def noise(cal_dict, sample_rate, title=None):
+def noise(cal_dict, sample_rate, title=None, save_format="h5"):
 
     fft_freqs,Sxx,S_per,S_par = calibrate.fft_noise(cal_dict['stream_corr'],cal_dict['stream_df_over_f'],sample_rate)
     plot_bins = np.logspace(-3,np.log10(250000),1000)
@@ -181,6 +182,6 @@ def noise(cal_dict, sample_rate, title=None):
                     'amp_subtracted':amp_subtracted}
 
     #save the psd dictionary
-    pickle.dump( psd_dict, open("psd.p", "wb" ),2 )
+    results_store.save_dict(psd_dict, "psd", save_format)
 
     return psd_dict
@@ -11,24 +11,97 @@ Joseph Redford 5/31/2021
 """
 
 import multiprocessing as mp
+import os
+from functools import lru_cache, partial
 
 import numpy as np
 from scipy.integrate import quad
 from scipy.optimize import root_scalar
 from scipy import interpolate
 
+from KIDs import quadrature
+
 #constants
 k_B = 1.380649e-23 #J/K
 h = 6.62607e-34 #J*s
 
 
+def _usadel_root_scalar(E, Delta, alpha):
+    """Single energy version of usadel_roots using np.roots"""
+    roots = np.roots([1.j * alpha, 2. * (Delta + E), 0., 2. * (Delta - E),
+            -1.j * alpha])
+    roots = roots[np.argsort(np.imag(roots))]
+    roots = roots[1:3]
+    delta = roots[1] - roots[0]
+    if np.imag(delta) > np.real(delta):
+        return roots[0]
+    else:
+        return roots[1]
+
+
+def usadel_roots(E, Delta, alpha):
+    """This solves the Usadel quartic
+    i alpha x^4 + 2 (Delta + E) x^3 + 2 (Delta - E) x - i alpha = 0
+    for arrays of E (Delta and alpha broadcast against E) in one batch by
+    taking the eigenvalues of the stacked companion matrices, the same matrices
+    np.roots builds one at a time, and selects the physical root.
+
+    alpha has to be non-zero, otherwise the quartic drops to a cubic
+    """
+    if np.ndim(E) == 0 and np.ndim(Delta) == 0 and np.ndim(alpha) == 0:
+        #single energies (the quad integrands) are faster through np.roots
+        #than through the batched eigenvalue setup
+        return _usadel_root_scalar(E, Delta, alpha)
+    E, Delta, alpha = np.broadcast_arrays(np.asarray(E, dtype=float),
+            np.asarray(Delta, dtype=float), np.asarray(alpha, dtype=float))
+    shape = E.shape
+    E = E.ravel()
+    Delta = Delta.ravel()
+    alpha = alpha.ravel()
+    lead = 1.j * alpha
+    companion = np.zeros((E.size, 4, 4), dtype=complex)
+    companion[:, 0, 0] = -2. * (Delta + E) / lead
+    companion[:, 0, 2] = -2. * (Delta - E) / lead
+    companion[:, 0, 3] = 1.j * alpha / lead
+    companion[:, 1, 0] = 1.
+    companion[:, 2, 1] = 1.
+    companion[:, 3, 2] = 1.
+    roots = np.linalg.eigvals(companion)
+    roots = np.take_along_axis(roots, np.argsort(np.imag(roots), axis=-1),
+            axis=-1)
+    #the two roots that remain purely imaginary and are not physical are
+    #maximum and minimum in the imaginary component for positive energy values
+    #once the real component is non-zero the two correct roots should only
+    #differ by sign of the real component, so taking positive real part to
+    #consistently be on the same branch
+    roots = roots[:, 1:3]
+    delta = roots[:, 1] - roots[:, 0]
+    x = np.where(np.imag(delta) > np.real(delta), roots[:, 0], roots[:, 1])
+    #the eigenvalues lose precision for E >> alpha where the unphysical roots
+    #are huge, so far above the gap start from the BCS (alpha = 0) root instead
+    #and polish with a few Newton steps, skipping steps that would jump away
+    #from the selected root (near degenerate roots at the gap edge)
+    far = E > 1e3 * (Delta + alpha)
+    x[far] = np.sqrt((E[far] - Delta[far]) / (E[far] + Delta[far]))
+    for i in range(3):
+        x2 = x * x
+        poly = (lead * x2 + 2. * (Delta + E) * x) * x2 + 2. * (Delta - E) * x \
+                - lead
+        deriv = (4. * lead * x + 6. * (Delta + E)) * x2 + 2. * (Delta - E)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = poly / deriv
+        x = np.where(np.abs(step) < 1e-4 * np.abs(x), x - step, x)
+
+    return x.reshape(shape)[()]
+
+
 def get_usadel_x(E, Delta, eta):
     """This calculates the value of e^(i \\theta) = x from the Usadel equation.
     I think this is better than fully backing out theta or cos/sin theta because
     this then becomes a problem of finding polynomial roots and all later
     quantities can be put into terms of x with algebra and the Euler identity
 
-    E is the energy level being calculated
+    E is the energy level being calculated, can be an array
     Delta is the average gap energy of the disordered superconductor
     eta is the depairing energy/gap broadening parameter
 
@@ -36,21 +109,8 @@ def get_usadel_x(E, Delta, eta):
     be put in any energy unit or even a temperature using a kT scaling
     eta is dimensionless
     """
-    poly_coeff = [0.5j * Delta * eta, Delta + E, 0., Delta - E,
-            -0.5j * Delta * eta]
-    roots = np.roots(poly_coeff)
-    roots = roots[np.argsort(np.imag(roots))]
-    #the two roots that remain purely imaginary and are not physical are
-    #maximum and minimum in the imaginary component for positive energy values
-    #once the real component is non-zero the two correct roots should only
-    #differ by sign of the real component, so taking positive real part to
-    #consistently be on the same branch
-    roots = roots[1:3]
-    delta = roots[1] - roots[0]
-    if np.imag(delta) > np.real(delta):
-        return roots[0]
-    else:
-        return roots[1]
+    #same quartic as get_usadel_x2 (times 2) with alpha = eta * Delta
+    return usadel_roots(E, Delta, eta * np.asarray(Delta))
 
 
 def get_usadel_x2(E, Delta, alpha):
@@ -59,7 +119,7 @@ def get_usadel_x2(E, Delta, alpha):
     this then becomes a problem of finding polynomial roots and all later
     quantities can be put into terms of x with algebra and the Euler identity
 
-    E is the energy level being calculated
+    E is the energy level being calculated, can be an array
     Delta is the average gap energy of the disordered superconductor
     alpha is the gap broadening parameter
 
@@ -67,21 +127,7 @@ def get_usadel_x2(E, Delta, alpha):
     be put in any energy unit or even a temperature using a kT scaling
     eta is dimensionless
     """
-    poly_coeff = [1.j * alpha, 2. * (Delta + E), 0., 2. * (Delta - E),
-            -1.j * alpha]
-    roots = np.roots(poly_coeff)
-    roots = roots[np.argsort(np.imag(roots))]
-    #the two roots that remain purely imaginary and are not physical are
-    #maximum and minimum in the imaginary component for positive energy values
-    #once the real component is non-zero the two correct roots should only
-    #differ by sign of the real component, so taking positive real part to
-    #consistently be on the same branch
-    roots = roots[1:3]
-    delta = roots[1] - roots[0]
-    if np.imag(delta) > np.real(delta):
-        return roots[0]
-    else:
-        return roots[1]
+    return usadel_roots(E, Delta, alpha)
 
 
 def g1(E1, E2, Delta, alpha):
@@ -168,6 +214,21 @@ def analytical_Eg(Delta, alpha):
         return (Delta**(2./3.) - alpha**(2./3.))**1.5 / Delta
 
 
+def gap_breakpoints(Delta, alpha, h_nu=0.):
+    """The energies where the Nam integrands have kinks or near singular peaks:
+    the spectral gap edge (analytical_Eg is the edge as a fraction of Delta),
+    Delta itself, their negatives, all of them shifted down by h_nu for the
+    E + h_nu terms, and 0. The fixed order quadrature is split at these points.
+    """
+    edge = analytical_Eg(Delta, alpha) * Delta
+    points = [0., -h_nu]
+    for level in (edge, Delta):
+        for sign in (1., -1.):
+            points.append(sign * level)
+            points.append(sign * level - h_nu)
+    return points
+
+
 def thermal_gap_suppression(T, Delta_0):
     Tc = Delta_0 / 1.76 #assuming delta is really k_B Delta, so as always, can
             #keep this unit agnostic
@@ -212,9 +273,10 @@ def calc_sigma1_thermal(T, Delta, h_nu, alpha):
             0.5 * beta * (E + h_nu))
     integrand2 = lambda E: g1(E, E + h_nu, Delta, alpha) * (
             np.tanh(0.5 * beta * (E + h_nu)) - np.tanh(0.5 * E * beta))
-    term1, _ = quad(integrand1, E_g - h_nu, -E_g) #fine tune integration
-            #parameters later
-    term2, _ = quad(integrand2, E_g, np.inf)
+    #the integrands are evaluated on the whole quadrature grid at once
+    points = gap_breakpoints(Delta, alpha, h_nu)
+    term1 = quadrature.integrate(integrand1, E_g - h_nu, -E_g, points)
+    term2 = quadrature.integrate(integrand2, E_g, np.inf, points)
 
     return (term1 + term2) / h_nu
 
@@ -245,13 +307,71 @@ def calc_sigma2_thermal(T, Delta, h_nu, alpha):
                 E))
     limit = np.max([E_g - h_nu, -E_g]) #for KIDS I don't think we will ever
         #end up with -E_g being the greater
-    term1, _ = quad(integrand1, limit, np.inf) #fine tune integration
-            #parameters later
-    term2, _ = quad(integrand2, E_g, np.inf)
+    points = gap_breakpoints(Delta, alpha, h_nu)
+    term1 = quadrature.integrate(integrand1, limit, np.inf, points)
+    term2 = quadrature.integrate(integrand2, E_g, np.inf, points)
 
     return (term1 + term2) / h_nu
 
 
+def _broadcast_points(*args):
+    args = np.broadcast_arrays(*[np.asarray(arg, dtype=float) for arg in args])
+    return args[0].shape, [arg.ravel() for arg in args]
+
+
+def calc_sigma1_grid(T, Delta, h_nu, alpha):
+    """Array version of calc_sigma1_thermal. T, Delta, h_nu and alpha are
+    broadcast against each other, so a whole temperature sweep (with its
+    gap at each temperature) and or frequency sweep is one call, and
+    $\\frac{\\sigma_1}{\\sigma_n}$ is returned with the broadcast shape.
+    The integrals of every point are done together on the same quadrature
+    rule (see quadrature.integrate_batch), so the Usadel roots of all of the
+    points are found in a few batched calls.
+    """
+    shape, (T, Delta, h_nu, alpha) = _broadcast_points(T, Delta, h_nu, alpha)
+    E_g = np.array([analytical_Eg(d, a) for d, a in zip(Delta, alpha)])
+    points = [gap_breakpoints(d, a, hn) for d, a, hn in zip(Delta, alpha,
+            h_nu)]
+    with np.errstate(divide='ignore'):
+        beta = 1. / T
+    def integrand1(E, i):
+        return g1(E, E + h_nu[i], Delta[i], alpha[i]) * np.tanh(
+                0.5 * beta[i] * (E + h_nu[i]))
+    def integrand2(E, i):
+        return g1(E, E + h_nu[i], Delta[i], alpha[i]) * (np.tanh(0.5 * beta[i]
+                * (E + h_nu[i])) - np.tanh(0.5 * E * beta[i]))
+    term1 = quadrature.integrate_batch(integrand1, E_g - h_nu, -E_g, points)
+    term2 = quadrature.integrate_batch(integrand2, E_g, np.inf, points)
+
+    return ((term1 + term2) / h_nu).reshape(shape)[()]
+
+
+def calc_sigma2_grid(T, Delta, h_nu, alpha):
+    """Array version of calc_sigma2_thermal, the arguments are broadcast like
+    calc_sigma1_grid and $\\frac{\\sigma_2}{\\sigma_n}$ is returned with the
+    broadcast shape
+    """
+    shape, (T, Delta, h_nu, alpha) = _broadcast_points(T, Delta, h_nu, alpha)
+    E_g = np.array([analytical_Eg(d, a) for d, a in zip(Delta, alpha)])
+    points = [gap_breakpoints(d, a, hn) for d, a, hn in zip(Delta, alpha,
+            h_nu)]
+    #1 - 2 f(E) = tanh(E / 2 kT), T <= 0 is a step the same as fermi_val = 0
+    #on the positive energies these are evaluated at
+    with np.errstate(divide='ignore'):
+        beta = np.where(T > 0., 1. / T, np.inf)
+    def integrand1(E, i):
+        return g2(E, E + h_nu[i], Delta[i], alpha[i]) * np.tanh(
+                0.5 * beta[i] * (E + h_nu[i]))
+    def integrand2(E, i):
+        return g2(E + h_nu[i], E, Delta[i], alpha[i]) * np.tanh(
+                0.5 * beta[i] * E)
+    limit = np.maximum(E_g - h_nu, -E_g)
+    term1 = quadrature.integrate_batch(integrand1, limit, np.inf, points)
+    term2 = quadrature.integrate_batch(integrand2, E_g, np.inf, points)
+
+    return ((term1 + term2) / h_nu).reshape(shape)[()]
+
+
 def iterative_gap(T, T_c, alpha):
     def f(series_cutoff, delta, alpha, T, T_c):
         series_diff = np.inf
@@ -358,7 +478,6 @@ def calc_eff_Tc(T_c0, alpha):
     high_delta = iterative_gap(high_Tc, T_c0, alpha)
     while (high_Tc - low_Tc) / high_Tc >= 1e-5:
         next_Tc = 0.5 * (high_Tc + low_Tc)
-        print(next_Tc)
         next_delta = iterative_gap(next_Tc, T_c0, alpha)
         if next_delta > zero_thres:
             low_Tc = next_Tc
@@ -367,31 +486,89 @@ def calc_eff_Tc(T_c0, alpha):
             high_Tc = next_Tc
             high_delta = next_delta
 
-    return new_Tc
+    return 0.5 * (high_Tc + low_Tc)
+
+
+def parallel_map(fn, args, processes=None, chunksize=None, progress=True):
+    """Evaluates fn on every element of args in a pool of worker processes and
+    returns the results in the same order as args. fn has to be a module level
+    function (or a functools.partial of one) so it can be pickled.
+
+    processes is the number of workers, None uses all the cores and 1 runs in
+    this process without a pool
+    chunksize is the number of args sent to a worker at a time, by default the
+    work is split into about 4 chunks per worker
+    progress prints how many of the args are done about every 10%
+    """
+    args = list(args)
+    N_args = len(args)
+    if processes is None:
+        processes = mp.cpu_count()
+    if chunksize is None:
+        chunksize = max(1, N_args // (4 * processes))
+    report_every = max(1, N_args // 10)
+    results = []
+    if processes == 1:
+        map_results = map(fn, args)
+        pool = None
+    else:
+        pool = mp.Pool(processes)
+        map_results = pool.imap(fn, args, chunksize)
+    try:
+        for i, result in enumerate(map_results):
+            results.append(result)
+            if progress and ((i + 1) % report_every == 0 or i + 1 == N_args):
+                print("{0}/{1} done".format(i + 1, N_args))
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    return results
+
 
+def cached_npz(filename, generate):
+    """Loads the arrays saved in filename if it exists, otherwise calls
+    generate(), which returns a dictionary of arrays, and saves them to
+    filename before returning them. filename None skips the cache.
+    """
+    if filename is not None and os.path.exists(filename):
+        with np.load(filename) as data:
+            return {key: data[key] for key in data.files}
+    arrays = generate()
+    if filename is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        np.savez(filename, **arrays)
+    return arrays
 
-def map_fn(vals):
-    ret_val = calc_eff_Tc(vals[0], vals[1])
-    print(vals[1])
 
-    return ret_val
+def _eff_Tc_task(vals):
+    return calc_eff_Tc(vals[0], vals[1])
 
 
-def calc_Tc_var(Tc, delta_alpha):
+def calc_Tc_var(Tc, delta_alpha, processes=None, chunksize=None,
+        progress=True, cache_dir=None):
+    """Effective T_c for alpha from 0.01 to Tc in steps of about delta_alpha,
+    one alpha per task spread over processes workers (see parallel_map).
+    If cache_dir is given the result is saved there and read back on the next
+    call with the same arguments.
+
+    returns eff_Tc, alpha_vals
+    """
     alpha_vals = np.linspace(0.01, Tc, int(np.ceil(Tc /delta_alpha)))
-    #eff_Tc = np.ndarray(alpha_vals.shape)
-    pool = mp.Pool()
-    vals = [(Tc, alpha) for alpha in alpha_vals]
-    eff_Tc = map(map_fn, vals)
-    eff_Tc = [val for val in eff_Tc]
-    print(eff_Tc)
-    eff_Tc = np.array(eff_Tc)
-    #for i, alpha in enumerate(alpha_vals):
-    #    print(i)
-    #    eff_Tc[i] = calc_eff_Tc(Tc, alpha)
+    def generate():
+        vals = [(Tc, alpha) for alpha in alpha_vals]
+        eff_Tc = parallel_map(_eff_Tc_task, vals, processes=processes,
+                chunksize=chunksize, progress=progress)
+        return {'eff_Tc': np.array(eff_Tc), 'alpha_vals': alpha_vals}
 
-    return eff_Tc, alpha_vals
+    filename = None
+    if cache_dir is not None:
+        filename = os.path.join(cache_dir, "Tc_var_Tc{0}_d{1}.npz".format(Tc,
+                delta_alpha))
+    arrays = cached_npz(filename, generate)
 
+    return arrays['eff_Tc'], arrays['alpha_vals']
 
 
 def calc_delta_temp(delta, T_c, alpha):
@@ -536,20 +713,37 @@ def calc_real_Tc(T_c_orig, alpha, res):
     return estimate
 
 
-def invert_eff_Tc(alpha_start, alpha_stop, delta):
+@lru_cache(maxsize=None)
+def invert_eff_Tc(alpha_start, alpha_stop, delta, cache_dir=None):
+    """The tabulated real T_c and delta_0 this is built from are saved to
+    cache_dir (default ~/.cache/submm_python_routines) like load_delta_table.
+    alpha_eff / T_c_eff outside of the tabulated range is clipped to its edge
+    like DeltaTable
+    """
     N_steps = int(np.ceil((alpha_stop - alpha_start) / delta))
     alpha_vals = np.linspace(alpha_start, alpha_stop, N_steps)
-    results = np.ndarray(alpha_vals.shape)
-    delta_0 = np.ndarray(alpha_vals.shape)
-    for i, a in enumerate(alpha_vals):
-        NV = calc_NV(1., a)
-        delta_0[i] = calc_delta_int(1., a, 0., NV)
-        results[i] = calc_real_Tc(1., a, 1e-5)
-    print(delta_0)
-    invert = interpolate.interp1d(alpha_vals / delta_0, results)
-    alpha_revert = interpolate.interp1d(alpha_vals / delta_0, alpha_vals)
+    def generate():
+        results = np.ndarray(alpha_vals.shape)
+        delta_0 = np.ndarray(alpha_vals.shape)
+        for i, a in enumerate(alpha_vals):
+            NV = calc_NV(1., a)
+            delta_0[i] = calc_delta_int(1., a, 0., NV)
+            results[i] = calc_real_Tc(1., a, 1e-5)
+        return {'results': results, 'delta_0': delta_0}
+
+    if cache_dir is None:
+        cache_dir = default_cache_dir
+    arrays = cached_npz(os.path.join(cache_dir,
+            "eff_Tc_inversion_a{0}-{1}_d{2}.npz".format(alpha_start,
+            alpha_stop, delta)), generate)
+    results = arrays['results']
+    delta_0 = arrays['delta_0']
+    ratio_vals = alpha_vals / delta_0
+    invert = interpolate.interp1d(ratio_vals, results)
+    alpha_revert = interpolate.interp1d(ratio_vals, alpha_vals)
+    ratio_range = (np.min(ratio_vals), np.max(ratio_vals))
     def inversion(T_c_eff, alpha_eff):
-        alpha_ratio = alpha_eff / T_c_eff
+        alpha_ratio = np.clip(alpha_eff / T_c_eff, *ratio_range)
         T_c = T_c_eff / invert(alpha_ratio)
         alpha = alpha_revert(alpha_ratio) * T_c
         return T_c, alpha
@@ -557,54 +751,145 @@ def invert_eff_Tc(alpha_start, alpha_stop, delta):
     return inversion
 
 
-def map_fn(args):
-    return args[0], args[1], calc_delta_int(1., args[2], args[3], args[4])
+def _delta_task(args):
+    alpha, T, NV = args
+    return calc_delta_int(1., alpha, T, NV)
+
 
+def precalc_temp_delta(T_start, T_stop, alpha_start, alpha_stop, step_size,
+        processes=None, chunksize=None, progress=True):
+    """Calculates the gap on a grid of T / T_c and alpha / T_c (the gap only
+    depends on the ratios so the table is in units of T_c) in parallel and
+    returns it as a DeltaTable, which is called like the interp2d this used to
+    return, delta_fn(T / T_c, alpha / T_c) = delta / T_c
 
-def precalc_temp_delta(T_start, T_stop, alpha_start, alpha_stop, step_size):
+    processes, chunksize and progress are passed to parallel_map, the N_V of
+    each alpha is calculated in parallel first and then the whole grid
+    """
     N_steps_a = int(np.ceil((alpha_stop -  alpha_start) / step_size))
     N_steps_T = int(np.ceil((T_stop - T_start) / step_size))
     T_vals = np.linspace(T_start, T_stop, N_steps_T)
     alpha_vals = np.linspace(alpha_start, alpha_stop, N_steps_a)
-    results = np.ndarray((N_steps_a, N_steps_T))
-    args = []
-    for i, alpha in enumerate(alpha_vals):
-        NV = calc_NV(1., alpha)
-        print(i)
-        for j, T in enumerate(T_vals):
-            args.append((i, j, alpha, T, NV))
-            #results[i][j] = calc_delta_int(1., alpha, T, NV)
-    pool = mp.Pool()
-    map_results = pool.map(map_fn, args)
-    for data in map_results:
-        results[data[0]][data[1]] = data[2]
-    return interpolate.interp2d(T_vals, alpha_vals, results)
+    NV_vals = parallel_map(partial(calc_NV, 1.), alpha_vals,
+            processes=processes, chunksize=chunksize, progress=progress)
+    args = [(alpha, T, NV) for alpha, NV in zip(alpha_vals, NV_vals)
+            for T in T_vals]
+    results = parallel_map(_delta_task, args, processes=processes,
+            chunksize=chunksize, progress=progress)
+    results = np.array(results).reshape((N_steps_a, N_steps_T))
+    return DeltaTable(T_vals, alpha_vals, results)
+
+
+class DeltaTable(object):
+    """Tabulated gap delta / T_c on a regular grid of T / T_c and alpha / T_c
+    evaluated with a RegularGridInterpolator. Points outside of the grid are
+    clipped to its edge.
+
+    T_vals and alpha_vals are the grid axes
+    delta_vals is the gap with shape (len(alpha_vals), len(T_vals))
+    """
+    def __init__(self, T_vals, alpha_vals, delta_vals, method='linear'):
+        self.T_vals = np.asarray(T_vals)
+        self.alpha_vals = np.asarray(alpha_vals)
+        self.delta_vals = np.asarray(delta_vals)
+        self.method = method
+        self.interp = interpolate.RegularGridInterpolator(
+                (self.T_vals, self.alpha_vals), self.delta_vals.T,
+                method=method)
+
+    def __call__(self, T_ratio, alpha_ratio):
+        T_ratio = np.clip(T_ratio, self.T_vals[0], self.T_vals[-1])
+        alpha_ratio = np.clip(alpha_ratio, self.alpha_vals[0],
+                self.alpha_vals[-1])
+        T_ratio, alpha_ratio = np.broadcast_arrays(T_ratio, alpha_ratio)
+        return self.interp(np.stack((T_ratio, alpha_ratio), axis=-1)).reshape(
+                T_ratio.shape)
+
+    def save(self, filename):
+        np.savez(filename, T_vals=self.T_vals, alpha_vals=self.alpha_vals,
+                delta_vals=self.delta_vals)
+
+    @classmethod
+    def load(cls, filename, method='linear'):
+        data = np.load(filename)
+        return cls(data['T_vals'], data['alpha_vals'], data['delta_vals'],
+                method=method)
+
+
+default_cache_dir = os.path.join(os.path.expanduser("~"), ".cache",
+        "submm_python_routines")
+
+
+@lru_cache(maxsize=None)
+def load_delta_table(T_start=0., T_stop=1., alpha_start=0.001, alpha_stop=0.9,
+        step_size=0.01, cache_dir=None, processes=None):
+    """Returns the DeltaTable for this grid. The table is saved to cache_dir
+    (default ~/.cache/submm_python_routines) the first time it is generated
+    and is read back from there after that, and it is kept in memory for the
+    rest of the session so repeated calls are free.
+    """
+    if cache_dir is None:
+        cache_dir = default_cache_dir
+    filename = os.path.join(cache_dir, "delta_table_T{0}-{1}_a{2}-{3}_s{4}.npz"
+            .format(T_start, T_stop, alpha_start, alpha_stop, step_size))
+    if os.path.exists(filename):
+        return DeltaTable.load(filename)
+    table = precalc_temp_delta(T_start, T_stop, alpha_start, alpha_stop,
+            step_size, processes=processes)
+    os.makedirs(cache_dir, exist_ok=True)
+    table.save(filename)
+    return table
 
 
 def generate_sigma2_fn(T_start, T_stop, alpha_start, alpha_stop, step_size):
     inverter = invert_eff_Tc(alpha_start, alpha_stop, step_size)
-    delta_fn = precalc_temp_delta(T_start, T_stop, alpha_start, alpha_stop,
+    delta_fn = load_delta_table(T_start, T_stop, alpha_start, alpha_stop,
             step_size)
     def ret_fn(T, T_c, h_nu, alpha):
+        #T can be an array, the whole curve is one calc_sigma2_grid call
         real_Tc, real_alpha = inverter(T_c, alpha)
-        delta = real_Tc * delta_fn(T / real_Tc, real_alpha / real_Tc)[0]
-        return calc_sigma2_thermal(T, delta, h_nu, real_alpha)
+        delta = real_Tc * delta_fn(np.asarray(T) / real_Tc,
+                real_alpha / real_Tc)
+        return calc_sigma2_grid(T, delta, h_nu, real_alpha)
 
     return ret_fn
 
 
-def calc_Qi(T_vals, T_c, alpha, h_nu):
+def calc_delta_curve(T_vals, T_c, alpha, delta_table=None):
+    """The gap at each of the temperatures T_vals from delta_table (see
+    calc_sigma_curve), T_c and alpha can be arrays broadcast against T_vals
+    """
+    if delta_table is None:
+        delta_table = load_delta_table()
     inverter = invert_eff_Tc(0.001, 0.9, 1e-2)
     real_Tc, real_alpha = inverter(T_c, alpha / T_c)
-    NV = calc_NV(real_Tc, real_alpha)
-    results = np.ndarray(len(T_vals))
-    for i, T in enumerate(T_vals):
-        delta = calc_delta_int(real_Tc, real_alpha, T, NV)
-        results[i] = np.abs(calc_sigma2_thermal(T, delta, h_nu, alpha
-                ) / calc_sigma1_thermal(T, delta, h_nu, alpha))
-        #results[i] = calc_sigma1_thermal(T, delta, h_nu, alpha)
+    return real_Tc * delta_table(np.asarray(T_vals) / real_Tc,
+            real_alpha / real_Tc)
 
-    return results
+
+def calc_sigma_curve(T_vals, T_c, alpha, h_nu, delta_table=None):
+    """sigma1 / sigma_n and sigma2 / sigma_n over a whole temperature sweep
+    T_vals (h_nu can also be an array broadcast against T_vals) with the
+    gap at each temperature from delta_table, a DeltaTable covering
+    T_vals / T_c and alpha / T_c, the default is the cached table from
+    load_delta_table()
+
+    returns sigma1, sigma2
+    """
+    deltas = calc_delta_curve(T_vals, T_c, alpha, delta_table)
+    sigma1 = calc_sigma1_grid(T_vals, deltas, h_nu, alpha)
+    sigma2 = calc_sigma2_grid(T_vals, deltas, h_nu, alpha)
+
+    return sigma1, sigma2
+
+
+def calc_Qi(T_vals, T_c, alpha, h_nu, delta_table=None):
+    """delta_table is a DeltaTable covering T_vals / T_c and alpha / T_c, the
+    default is the cached table from load_delta_table()
+    """
+    sigma1, sigma2 = calc_sigma_curve(T_vals, T_c, alpha, h_nu, delta_table)
+
+    return np.abs(sigma2 / sigma1)
 
 
 def N_qp(T, Delta, alpha, N_0):
@@ -616,7 +901,8 @@ def N_qp(T, Delta, alpha, N_0):
         return cos_val * pop_level
 
     E_g = analytical_Eg(Delta, alpha)
-    N_int, _ = quad(integrand, E_g, np.inf)
+    N_int = quadrature.integrate(integrand, E_g, np.inf,
+            gap_breakpoints(Delta, alpha))
 
     return N_0 * N_int
 
@@ -10,30 +10,113 @@ Joseph Redford 10/21/2021
 """
 
 import multiprocessing as mp
+from collections import OrderedDict
 
 import numpy as np
 from scipy.integrate import quad
 from scipy.optimize import root_scalar
 from scipy import interpolate
 
+from KIDs import quadrature
+
 #constants
 k_B = 1.380649e-23 #J/K
 h = 6.62607e-34 #J*s
 
-def calc_delta_int(Delta0, gamma, kT):
-    def integrand(E, Delta0, gamma, delta, kT):
-        term1 = np.real(np.power(E * E - (Delta0 - 1.j * gamma)**2, -0.5))
-        term2 = np.tanh(0.5 * E / kT) * np.real(np.power(E * E - (delta
-                - 1.j * gamma)**2, -0.5))
-        return term1 - term2
-
-    def prepare_integrand(delta):
-        int_fn = lambda E: integrand(E, Delta0, gamma, delta, kT)
-        return int_fn
-    root_fn = lambda delta: quad(prepare_integrand(delta), 0., np.inf)[0]
-    delta_sol = root_scalar(root_fn, x0=Delta0, x1 = 0.)
-
-    return delta_sol.root
+def _gap_eq(E, Delta0, gamma, delta, beta):
+    term1 = np.real(np.power(E * E - (Delta0 - 1.j * gamma)**2, -0.5))
+    term2 = np.tanh(0.5 * E * beta) * np.real(np.power(E * E - (delta
+            - 1.j * gamma)**2, -0.5))
+    return term1 - term2
+
+
+def _solve_delta(Delta0, gamma, kT, rtol=1e-10, max_iter=100):
+    """Solves the gap equation for arrays of Delta0, gamma and kT together.
+    The gap is between 0 (above T_c) and Delta0 (kT = 0) and the gap
+    equation increases with delta, so this is a bracketed secant search
+    (Illinois method), with every point's integral on the same quadrature
+    rule (split at Delta0 and its current delta) done in one batch per step.
+    """
+    beta = np.where(kT > 0., 1. / np.where(kT > 0., kT, 1.), np.inf)
+    def root_fn(delta, active):
+        Delta0_a = Delta0[active]
+        gamma_a = gamma[active]
+        delta_a = delta[active]
+        beta_a = beta[active]
+        integrand = lambda E, i: _gap_eq(E, Delta0_a[i], gamma_a[i],
+                delta_a[i], beta_a[i])
+        points = [(d0, d) for d0, d in zip(Delta0_a, delta_a)]
+        return quadrature.integrate_batch(integrand, 0., np.inf, points)
+
+    everything = np.ones(kT.shape, dtype=bool)
+    low = np.zeros(kT.shape)
+    high = Delta0.copy()
+    f_low = root_fn(low, everything)
+    f_high = np.zeros(kT.shape) #the gap equation is solved exactly at Delta0
+    high_T = kT > 0.
+    f_high[high_T] = root_fn(high, high_T)
+    #at or above T_c the gap closes and at kT = 0 it is Delta0
+    delta = np.where(f_low >= 0., 0., Delta0)
+    active = (f_low < 0.) & high_T
+    last_side = np.zeros(kT.shape, dtype=int)
+    i = 0
+    while np.any(active) and i < max_iter:
+        new = (high - f_high * (high - low) / (f_high - f_low))[active]
+        converged = np.abs(new - delta[active]) <= rtol * Delta0[active]
+        delta[active] = new
+        f_new = np.zeros(kT.shape)
+        f_new[active] = root_fn(delta, active)
+        above = active & (f_new > 0.)
+        below = active & (f_new <= 0.)
+        #Illinois step, halve the end point that is kept twice in a row
+        f_low[above & (last_side == 1)] *= 0.5
+        f_high[below & (last_side == -1)] *= 0.5
+        high[above] = delta[above]
+        f_high[above] = f_new[above]
+        low[below] = delta[below]
+        f_low[below] = f_new[below]
+        last_side[above] = 1
+        last_side[below] = -1
+        done = np.zeros(kT.shape, dtype=bool)
+        done[active] = converged
+        active &= ~done & (f_new != 0.)
+        i += 1
+
+    return delta
+
+
+_delta_cache = OrderedDict()
+
+
+def calc_delta_int(Delta0, gamma, kT, maxsize=2**16):
+    """The gap at temperature kT for the zero temperature gap Delta0 and
+    Dynes broadening gamma. Any of the arguments can be arrays, and all of the
+    points that are not already known are solved together in one vectorized
+    search. Solutions are memoized on (Delta0, gamma, kT), so refitting or
+    re-evaluating a temperature sweep does not solve the gap equation again.
+    """
+    Delta0, gamma, kT = np.broadcast_arrays(np.asarray(Delta0, dtype=float),
+            np.asarray(gamma, dtype=float), np.asarray(kT, dtype=float))
+    shape = kT.shape
+    keys = list(zip(Delta0.ravel().tolist(), gamma.ravel().tolist(),
+            kT.ravel().tolist()))
+    missing = sorted(set(key for key in keys if key not in _delta_cache))
+    if len(missing) > 0:
+        solved = _solve_delta(*[np.array(vals) for vals in zip(*missing)])
+        for key, delta in zip(missing, solved):
+            _delta_cache[key] = delta
+    deltas = np.empty(len(keys))
+    for i, key in enumerate(keys):
+        _delta_cache.move_to_end(key)
+        deltas[i] = _delta_cache[key]
+    while len(_delta_cache) > maxsize:
+        _delta_cache.popitem(last=False)
+
+    return deltas.reshape(shape)[()]
+
+
+def clear_delta_cache():
+    _delta_cache.clear()
 
 
 def propagator_n(E, delta, gamma):
@@ -86,17 +169,79 @@ def calc_sigma1_thermal(kT, delta, h_nu, gamma):
 
 
 
+def gap_breakpoints(delta, h_nu=0.):
+    """The energies where the propagators peak (the gap +-delta, the
+    broadened inverse square root singularities) for E and E + h_nu, and 0
+    where the occupation steps at kT = 0. The quadrature is split at these.
+    """
+    return [0., -h_nu, delta, -delta, delta - h_nu, -delta - h_nu]
+
+
+def _broadcast_points(*args):
+    args = np.broadcast_arrays(*[np.asarray(arg, dtype=float) for arg in args])
+    return args[0].shape, [arg.ravel() for arg in args]
+
+
+def _inverse_kT(kT):
+    with np.errstate(divide='ignore'):
+        return np.where(kT > 0., 1. / kT, np.inf)
+
+
+def calc_sigma2_grid(kT, delta, h_nu, gamma):
+    """Array version of calc_sigma2_thermal. kT, delta, h_nu and gamma are
+    broadcast against each other and the sigma2 ratio is returned with the
+    broadcast shape. Every point is integrated on the same double exponential
+    rule (quadrature.integrate_batch) so the whole temperature and or
+    frequency sweep is a few vectorized evaluations of the propagators.
+    """
+    shape, (kT, delta, h_nu, gamma) = _broadcast_points(kT, delta, h_nu,
+            gamma)
+    beta = _inverse_kT(kT)
+    def integrand(E, i):
+        occupation = np.tanh(0.5 * beta[i] * (E + h_nu[i]))
+        prop_term = np.imag(propagator_n(E, delta[i], gamma[i])) * np.real(
+                propagator_n(E + h_nu[i], delta[i], gamma[i])) + np.imag(
+                propagator_p(E, delta[i], gamma[i])) * np.real(
+                propagator_p(E + h_nu[i], delta[i], gamma[i]))
+        return occupation * prop_term
+
+    points = [gap_breakpoints(d, hn) for d, hn in zip(delta, h_nu)]
+    int_val = quadrature.integrate_batch(integrand, -np.inf, np.inf, points)
+    return (int_val / h_nu).reshape(shape)[()]
+
+
+def calc_sigma1_grid(kT, delta, h_nu, gamma):
+    """Array version of calc_sigma1_thermal, broadcast like calc_sigma2_grid
+    """
+    shape, (kT, delta, h_nu, gamma) = _broadcast_points(kT, delta, h_nu,
+            gamma)
+    beta = _inverse_kT(kT)
+    def integrand(E, i):
+        occupation = 0.5 * (np.tanh(0.5 * beta[i] * (E + h_nu[i]))
+                - np.tanh(0.5 * beta[i] * E))
+        prop_term = np.real(propagator_n(E, delta[i], gamma[i])) * np.real(
+                propagator_n(E + h_nu[i], delta[i], gamma[i])) + np.real(
+                propagator_p(E, delta[i], gamma[i])) * np.real(
+                propagator_p(E + h_nu[i], delta[i], gamma[i]))
+        return occupation * prop_term
+
+    points = [gap_breakpoints(d, hn) for d, hn in zip(delta, h_nu)]
+    int_val = quadrature.integrate_batch(integrand, -np.inf, np.inf, points)
+    return (int_val / h_nu).reshape(shape)[()]
+
+
 def sigma2_fit_fn(kT, Delta0, h_nu, gamma):
+    #kT can be an array, the sigma2 of the whole sweep is one call
     current_delta = calc_delta_int(Delta0, gamma, kT)
-    sigma2_ratio = calc_sigma2_thermal(kT, current_delta, h_nu, gamma)
+    sigma2_ratio = calc_sigma2_grid(kT, current_delta, h_nu, gamma)
 
     return sigma2_ratio
 
 
 def thermal_Qi(kT, Delta0, h_nu, gamma):
     current_delta = calc_delta_int(Delta0, gamma, kT)
-    sigma2_ratio = calc_sigma2_thermal(kT, current_delta, h_nu, gamma)
-    sigma1_ratio = calc_sigma1_thermal(kT, current_delta, h_nu, gamma)
+    sigma2_ratio = calc_sigma2_grid(kT, current_delta, h_nu, gamma)
+    sigma1_ratio = calc_sigma1_grid(kT, current_delta, h_nu, gamma)
     
     return sigma2_ratio / sigma1_ratio
 
@@ -2,13 +2,17 @@ import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 import os
-from scipy import signal, fftpack
+from scipy import signal, optimize
+import scipy.fft as sp_fft
+from functools import lru_cache
 import platform
 try:
     from submm_python_routines.KIDs import resonance_fitting as rf
 except:
     from KIDs import resonance_fitting as rf
 from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.figure import Figure
+import multiprocessing as mp
 from typing import NamedTuple
 
 
@@ -26,6 +30,12 @@ ip = find_vna_sweep(f,z)
 get the kid indexes out from ip.kid_idx
 get the frequencies out from f[ip.kid_idx]
 
+to do the same without any plots (i.e. in a pipeline) use
+result = find_resonances(f,z)
+with the kid indexes in result['kid_idx'] and the resonator windows in result['windows']
+and to follow the resonators to a new sweep without a plot use
+result = track_resonances(f_new, z_new, kid_idx, f_old=f, z_old=z)
+
 """
 
 
@@ -315,10 +325,10 @@ class InteractiveThresholdPlot(object):
             self.spacing_threshold_Q = np.mean(self.f_Hz)/self.spacing_threshold_Hz
             self.refresh_plot()
         if event.key == 't':
-            self.peak_threshold_dB = np.float(input("What threshold would you like in dB? "))
+            self.peak_threshold_dB = float(input("What threshold would you like in dB? "))
             self.refresh_plot()
         if event.key == 'y':
-            self.spacing_threshold_Hz = np.float(input("What Spacing threshold would you like in Hz? "))
+            self.spacing_threshold_Hz = float(input("What Spacing threshold would you like in Hz? "))
             self.refresh_plot()
 
     def refresh_plot(self):
@@ -330,192 +340,191 @@ class InteractiveThresholdPlot(object):
         plt.draw()
 
     def calc_regions(self):
-        bool_threshhold = self.s21_mag < -1.0 * self.peak_threshold_dB
-        # self.ilo = np.where(self.s21_mag < -1.0 * self.peak_threshold_dB)[0]
-        self.ilo = []
-        self.regions = []
-        self.local_minima = []
-        is_in_theshhold_last = False
-        sub_region = []
-        for test_index, is_in_theshhold in list(enumerate(bool_threshhold)):
-            if is_in_theshhold:
-                self.ilo.append(test_index)
-                sub_region.append(test_index)
-            else:
-                if is_in_theshhold_last:
-                    # when the last point was in, but not this point it is time to finish the old region
-                    self.regions.append(sub_region)
-                    sub_region = []
-            is_in_theshhold_last = is_in_theshhold
-        else:
-            if sub_region:
-                self.regions.append(sub_region)
-
-        window_calc_data = []
-        # calculate the local minima in a simple brute force method
-        for region in self.regions:
-            minima_this_region = []
-            minima_this_region_index = []
-            found_this_region = False
-            if len(region) > 2:
-                for region_index in range(len(region) - 2):
-                    middle_region_index = region_index + 1
-                    middle_data_index = region[middle_region_index]
-                    left = self.s21_mag[region[region_index]]
-                    middle = self.s21_mag[middle_data_index]
-                    right = self.s21_mag[region[region_index + 2]]
-                    if middle < left and middle <= right:
-                        found_this_region = True
-                        self.local_minima.append(middle_data_index)
-                        minima_this_region.append(middle_data_index)
-                        minima_this_region_index.append(middle_region_index)
-            if found_this_region:
-                window_calc_data.append((region, minima_this_region_index, minima_this_region))
-
-        # calculate the resonator windows
-        self.minima_as_windows = []
-        data_index_minima_left = None
-        single_window = None
-        right_window_not_found = False
-        data_index_bound = 0
-        for region, minima_this_region_index, minima_this_region in window_calc_data:
-            # deal with spacing conflicts in the same region
-            minima_this_region, minima_this_region_index = \
-                self.resolve_spacing_conflicts(minima_this_region=minima_this_region,
-                                               minima_this_region_index=minima_this_region_index)
-            data_index_region_bound_left = region[0]
-            data_index_region_bound_right = region[-1]
-            # combine minima in the same region with a spacing conflict
-            for region_index, data_index_minima in zip(minima_this_region_index, minima_this_region):
-                # halfway to the next resonator
-                if single_window is not None:
-                    data_index_bound = int(np.round((data_index_minima_left + data_index_minima) / 2))
-                    if right_window_not_found:
-                        single_window["right_max"] = single_window["right_pad"] = \
-                            single_window["right_fitter_pad"] = single_window["right_window"] = data_index_bound
-                    else:
-                        single_window["right_max"] = data_index_bound
-                        test_right_pad = single_window["minima"] \
-                                         + int(np.round((single_window["right_window"] - single_window["minima"]) \
-                                                        * self.window_pad_factor))
-                        if single_window["right_max"] < test_right_pad:
-                            single_window["right_pad"] = single_window["right_max"]
-                        else:
-                            single_window["right_pad"] = test_right_pad
-                        test_right_fitter_pad = single_window["minima"] \
-                                                + int(np.round((single_window["right_window"] - single_window["minima"]) \
-                                                               * self.fitter_pad_factor))
-                        if single_window["right_max"] < test_right_fitter_pad:
-                            single_window["right_fitter_pad"] = single_window["right_max"]
-                        else:
-                            single_window["right_fitter_pad"] = test_right_fitter_pad
-
-                    self.minima_as_windows.append(SingleWindow(**single_window))
-                # the window where resonator is located
-                if region_index == minima_this_region_index[0]:
-                    data_index_boundary_left = data_index_region_bound_left
-                else:
-                    data_index_boundary_left = data_index_bound
-                if region_index == minima_this_region_index[-1]:
-                    data_index_boundary_right = data_index_region_bound_right
-                    right_window_not_found = False
-                else:
-                    right_window_not_found = True
-                if right_window_not_found:
-                    single_window = {"left_max": data_index_bound, "left_window": data_index_boundary_left,
-                                     "minima": data_index_minima}
-                else:
-                    single_window = {"left_max": data_index_bound, "left_window": data_index_boundary_left,
-                                     "minima": data_index_minima, "right_window": data_index_boundary_right}
-                # window padding
-                test_left_pad = single_window["minima"] \
-                                - int(np.round((single_window["minima"] - single_window["left_window"])
-                                               * self.window_pad_factor))
-                if test_left_pad < single_window["left_max"]:
-                    single_window["left_pad"] = single_window["left_max"]
-                else:
-                    single_window["left_pad"] = test_left_pad
-                test_left_fitter_pad = single_window["minima"] \
-                                       - int(np.round((single_window["minima"] - single_window["left_window"])
-                                                      * self.fitter_pad_factor))
-                if test_left_fitter_pad < single_window["left_max"]:
-                    single_window["left_fitter_pad"] = single_window["left_max"]
-                else:
-                    single_window["left_fitter_pad"] = test_left_fitter_pad
-
-                data_index_minima_left = single_window["minima"]
-        else:
-            # finish the last step in the loop
-            data_index_bound = len(self.s21_mag)
-            if right_window_not_found:
-                single_window["right_max"] = single_window["right_window"] = data_index_bound
-            else:
-                single_window["right_max"] = data_index_bound
-                test_right_pad = single_window["minima"] + \
-                                 int(np.round((single_window["right_window"] - single_window["minima"])
-                                              * self.window_pad_factor))
-                if single_window["right_max"] < test_right_pad:
-                    single_window["right_pad"] = single_window["right_max"]
-                else:
-                    single_window["right_pad"] = test_right_pad
-                test_right_fitter_pad = single_window["minima"] \
-                                        + int(np.round((single_window["right_window"] - single_window["minima"])
-                                                       * self.fitter_pad_factor))
-                if single_window["right_max"] < test_right_fitter_pad:
-                    single_window["right_fitter_pad"] = single_window["right_max"]
-                else:
-                    single_window["right_fitter_pad"] = test_right_fitter_pad
-            self.minima_as_windows.append(SingleWindow(**single_window))
-        self.local_minima = [single_window.minima for single_window in self.minima_as_windows]
-        # spacing conflicts across all regions
-        self.local_minima, self.minima_as_windows = \
-            self.resolve_spacing_conflicts(minima_this_region=self.local_minima,
-                                           minima_this_region_index=self.minima_as_windows)
+        result = find_windows(self.f_Hz, self.s21_mag, self.peak_threshold_dB, self.spacing_threshold_Hz,
+                              window_pad_factor=self.window_pad_factor, fitter_pad_factor=self.fitter_pad_factor)
+        self.ilo = result['ilo']
+        self.regions = [np.arange(start, stop + 1) for start, stop in zip(result['region_starts'],
+                                                                          result['region_stops'])]
+        self.local_minima = list(result['kid_idx'])
+        self.minima_as_windows = [SingleWindow(*window) for window in result['windows'].tolist()]
+        if len(result['removed_idx']) > 0:
+            print(F"Removed {len(result['removed_idx'])} minima closer than "
+                  F"{'%3.3f' % (self.spacing_threshold_Hz * 1.0e-6)} MHz to a deeper minima")
 
     def resolve_spacing_conflicts(self, minima_this_region, minima_this_region_index):
-        found_spacing_conflict = True
-        while found_spacing_conflict:
-            found_spacing_conflict = False
-            number_of_minima_this_region = len(minima_this_region)
-            if number_of_minima_this_region > 1:
-                for counter in range(number_of_minima_this_region - 1):
-                    data_index_minima_left_test = minima_this_region[counter]
-                    data_index_minima_right_test = minima_this_region[counter + 1]
-                    minima_spacing_Hz = abs(
-                        self.f_Hz[data_index_minima_left_test] - self.f_Hz[data_index_minima_right_test])
-                    if minima_spacing_Hz < self.spacing_threshold_Hz:
-                        # minima are too close:
-                        print(F"Spacing Conflict in same threshold region.")
-                        print(F"   Allowed spacing (MHz): {'%3.3f' % (self.spacing_threshold_Hz * 1.0e-6)}")
-                        print(F"    Minima spacing (MHz): {'%3.3f' % (minima_spacing_Hz * 1.0e-6)}")
-                        # keep the lowest of the minima
-                        value_left_minima = self.s21_mag[data_index_minima_left_test]
-                        value_right_minima = self.s21_mag[data_index_minima_right_test]
-                        if value_left_minima < value_right_minima:
-                            index_location_to_remove = counter + 1
-                            index_location_to_keep = counter
-                        else:
-                            index_location_to_remove = counter
-                            index_location_to_keep = counter + 1
-                        # data for the print statement
-                        data_index_kept = minima_this_region[index_location_to_keep]
-                        data_index_removed = minima_this_region[index_location_to_remove]
-                        value_kept_minima = self.s21_mag[data_index_kept]
-                        f_MHz_kept_minima = self.f_GHz[data_index_kept] * 1.0e3
-                        value_removed_minima = self.s21_mag[data_index_removed]
-                        f_MHz_removed_minima = self.f_GHz[data_index_removed] * 1.0e3
-                        # where the data is removed
-                        minima_this_region_index.pop(index_location_to_remove)
-                        minima_this_region.pop(index_location_to_remove)
-                        # make the users see what decisions the code is making
-                        print(F"Minima Kept: {value_kept_minima} dbM at {'%3.3f' % f_MHz_kept_minima} MHz")
-                        print(F"Minima Removed: {value_removed_minima} dbM at {'%3.3f' % f_MHz_removed_minima} MHz\n")
-                        # stop the loop here and restart from scratch with one less minima
-                        found_spacing_conflict = True
-                        break
+        conflicts = resolve_spacing_conflicts(self.f_Hz, self.s21_mag, minima_this_region, self.spacing_threshold_Hz)
+        minima_this_region = [minima_this_region[i] for i in conflicts.kept]
+        minima_this_region_index = [minima_this_region_index[i] for i in conflicts.kept]
         return minima_this_region, minima_this_region_index
 
 
+def threshold_regions(s21_mag, peak_threshold_dB):
+    """
+    run length encoding of the points under -peak_threshold_dB
+    returns the first and last index of each run of points under the threshold
+    """
+    below = np.asarray(s21_mag) < -1.0 * peak_threshold_dB
+    edges = np.diff(np.concatenate(([0], below.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1) - 1
+    return starts, stops
+
+
+def threshold_minima(s21_mag, peak_threshold_dB):
+    """
+    three point minima with all three points under the threshold (so in the same threshold region)
+    the middle point has to be lower than the left point and no higher than the right point
+    """
+    s21_mag = np.asarray(s21_mag)
+    below = s21_mag < -1.0 * peak_threshold_dB
+    middle = s21_mag[1:-1]
+    is_minima = below[:-2] & below[1:-1] & below[2:] & (middle < s21_mag[:-2]) & (middle <= s21_mag[2:])
+    return np.flatnonzero(is_minima) + 1
+
+
+class SpacingConflicts(NamedTuple):
+    kept: np.ndarray  # position in minima of the kept minima
+    removed: np.ndarray  # position in minima of the removed minima
+    removed_by: np.ndarray  # position in minima of the deeper minima that removed each removed minima
+    spacing_Hz: np.ndarray  # spacing of each conflict
+
+
+def resolve_spacing_conflicts(f_Hz, s21_mag, minima, spacing_threshold_Hz, group=None):
+    """
+    non maximum suppression of minima closer than spacing_threshold_Hz
+    the minima are visited deepest first and each one that has not been removed yet is kept and removes every
+    minima within spacing_threshold_Hz of it (for equal depths the higher frequency one wins)
+    minima must be in increasing frequency order so the conflicts of each kept minima are a contiguous slice
+    found with a binary search
+    group (i.e. the threshold region of each minima, increasing) only lets minima in the same group conflict
+    returns SpacingConflicts, all of the arrays index into minima
+    """
+    minima = np.asarray(minima, dtype=int)
+    n_minima = len(minima)
+    f_minima = np.asarray(f_Hz)[minima]
+    depth = np.asarray(s21_mag)[minima]
+    if group is None:
+        group = np.zeros(n_minima, dtype=int)
+    group = np.asarray(group)
+    # slice of each minima's possible conflicts
+    low = np.maximum(np.searchsorted(f_minima, f_minima - spacing_threshold_Hz, side='right'),
+                     np.searchsorted(group, group, side='left'))
+    high = np.minimum(np.searchsorted(f_minima, f_minima + spacing_threshold_Hz, side='left'),
+                      np.searchsorted(group, group, side='right'))
+    order = np.lexsort((-np.arange(n_minima), depth))
+    undecided = np.ones(n_minima, dtype=bool)
+    kept = []
+    removed = []
+    removed_by = []
+    for i in order:
+        if not undecided[i]:
+            continue
+        undecided[i] = False
+        kept.append(i)
+        conflicts = low[i] + np.flatnonzero(undecided[low[i]:high[i]])
+        if len(conflicts) > 0:
+            undecided[conflicts] = False
+            removed.append(conflicts)
+            removed_by.append(np.full(len(conflicts), i))
+    removed = np.concatenate(removed) if removed else np.zeros(0, dtype=int)
+    removed_by = np.concatenate(removed_by) if removed_by else np.zeros(0, dtype=int)
+    return SpacingConflicts(kept=np.sort(np.asarray(kept, dtype=int)), removed=removed, removed_by=removed_by,
+                            spacing_Hz=np.abs(f_minima[removed] - f_minima[removed_by]))
+
+
+def calc_windows(minima, region_id, region_starts, region_stops, n_points, window_pad_factor=1.2,
+                 fitter_pad_factor=5.0):
+    """
+    the SingleWindow of every minima as an (n_minima, 9) array with the columns in SingleWindow._fields order
+    minima that share a threshold region are split halfway between them
+    """
+    minima = np.asarray(minima, dtype=int)
+    region_id = np.asarray(region_id, dtype=int)
+    if len(minima) == 0:
+        return np.zeros((0, 9), dtype=int)
+    # halfway to the next resonator
+    bounds = np.round((minima[:-1] + minima[1:]) / 2).astype(int)
+    left_max = np.concatenate(([0], bounds))
+    right_max = np.concatenate((bounds, [n_points]))
+    first_in_region = np.concatenate(([True], region_id[1:] != region_id[:-1]))
+    last_in_region = np.concatenate((region_id[1:] != region_id[:-1], [True]))
+    # the window where resonator is located
+    left_window = np.where(first_in_region, region_starts[region_id], left_max)
+    right_window = np.where(last_in_region, region_stops[region_id], right_max)
+    # window padding
+    left_pad = np.maximum(left_max, minima - np.round((minima - left_window) * window_pad_factor).astype(int))
+    left_fitter_pad = np.maximum(left_max, minima - np.round((minima - left_window) * fitter_pad_factor).astype(int))
+    right_pad = np.minimum(right_max, minima + np.round((right_window - minima) * window_pad_factor).astype(int))
+    right_fitter_pad = np.minimum(right_max,
+                                  minima + np.round((right_window - minima) * fitter_pad_factor).astype(int))
+    return np.stack((left_max, left_fitter_pad, left_pad, left_window, minima, right_window, right_pad,
+                     right_fitter_pad, right_max), axis=-1).reshape(-1, 9)
+
+
+def find_windows(f_Hz, s21_mag, peak_threshold_dB, spacing_threshold_Hz=1.0e5, window_pad_factor=1.2,
+                 fitter_pad_factor=5.0):
+    """
+    the threshold, minima and window finding of InteractiveThresholdPlot without the plot
+    s21_mag should be the highpass filtered magnitude in dB
+    returns a dictionary with
+        ilo: the indexes under the threshold
+        region_starts, region_stops: first and last index of each threshold region
+        kid_idx: the index of each resonator
+        windows: (n_resonators, 9) array of the SingleWindow of each resonator (columns in SingleWindow._fields order)
+        removed_idx, removed_by_idx: the log of spacing conflicts, each minima that was removed and the deeper
+                                     minima that removed it
+    """
+    s21_mag = np.asarray(s21_mag)
+    region_starts, region_stops = threshold_regions(s21_mag, peak_threshold_dB)
+    minima = threshold_minima(s21_mag, peak_threshold_dB)
+    region_id = np.searchsorted(region_starts, minima, side='right') - 1
+    # deal with spacing conflicts in the same region
+    conflicts = resolve_spacing_conflicts(f_Hz, s21_mag, minima, spacing_threshold_Hz, group=region_id)
+    removed_idx = [minima[conflicts.removed]]
+    removed_by_idx = [minima[conflicts.removed_by]]
+    minima = minima[conflicts.kept]
+    region_id = region_id[conflicts.kept]
+    windows = calc_windows(minima, region_id, region_starts, region_stops, len(s21_mag),
+                           window_pad_factor=window_pad_factor, fitter_pad_factor=fitter_pad_factor)
+    # spacing conflicts across all regions
+    conflicts = resolve_spacing_conflicts(f_Hz, s21_mag, minima, spacing_threshold_Hz)
+    removed_idx.append(minima[conflicts.removed])
+    removed_by_idx.append(minima[conflicts.removed_by])
+    return {'ilo': np.flatnonzero(s21_mag < -1.0 * peak_threshold_dB), 'region_starts': region_starts,
+            'region_stops': region_stops, 'kid_idx': minima[conflicts.kept], 'windows': windows[conflicts.kept],
+            'removed_idx': np.concatenate(removed_idx), 'removed_by_idx': np.concatenate(removed_by_idx)}
+
+
+def find_resonances(f_Hz, z, smoothing_scale_Hz=5.0e6, peak_threshold_dB=1.5, spacing_threshold_Hz=1.0e5,
+                    window_pad_factor=1.2, fitter_pad_factor=5.0):
+    """
+    non interactive version of find_vna_sweep for running in scripts
+    f is frequencies (Hz)
+    z is complex S21
+    Smoothing scale (Hz)
+    peak threshold (dB) below the filtered baseline
+    spacing threshold (Hz)
+    returns the dictionary of find_windows plus
+        f_Hz, s21_mag: the data (the last point is dropped for odd lengths by the filter)
+        filtermags: the lowpass baseline
+        highpass_mags: s21_mag - filtermags, what the resonators are found in
+    """
+    s21_mag = 20 * np.log10(np.abs(z))
+    filtermags = lowpass_cosine(y=s21_mag,
+                                tau=f_Hz[1] - f_Hz[0],
+                                f_3db=1. / smoothing_scale_Hz,
+                                width=0.1 * (1.0 / smoothing_scale_Hz),
+                                padd_data=True)
+    # the cosine filter drops the last point is the array has an odd number of points
+    s21_mag = s21_mag[:len(filtermags)]
+    f_Hz = f_Hz[:len(filtermags)]
+    highpass_mags = s21_mag - filtermags
+    result = find_windows(f_Hz, highpass_mags, peak_threshold_dB, spacing_threshold_Hz,
+                          window_pad_factor=window_pad_factor, fitter_pad_factor=fitter_pad_factor)
+    result.update({'f_Hz': f_Hz, 's21_mag': s21_mag, 'filtermags': filtermags, 'highpass_mags': highpass_mags})
+    return result
+
+
 def compute_dI_and_dQ(I, Q, freq=None, filterstr='SG', do_deriv=True):
     """
     Given I,Q,freq arrays
@@ -564,12 +573,10 @@ class InteractiveFilterPlot(object):
         self.ax = self.fig.add_subplot(111)
         self.fig.canvas.mpl_connect('key_press_event', self.on_key_press)
 
+        # the fft of the data is taken once, changing the smoothing scale only changes the filter
+        self.spectrum, self.n_fft = lowpass_cosine_spectrum(self.s21_mag, padd_data=True)
         # first plot data and filter function before removing filter function
-        self.filtermags = lowpass_cosine(y=self.s21_mag,
-                                    tau=self.f_Hz[1] - self.f_Hz[0],
-                                    f_3db=1. / self.smoothing_scale_Hz,
-                                    width=0.1 * (1.0 / self.smoothing_scale_Hz),
-                                    padd_data=True)
+        self.filtermags = self.filter_mags()
         # the cosine filter drops the last point is the array has an pdd number of points
         self.len_filtered = len(self.filtermags)
         self.s21_mag = self.s21_mag[:self.len_filtered]
@@ -589,6 +596,13 @@ class InteractiveFilterPlot(object):
         plt.ylabel('Power (dB)')
         plt.show(block=True)
 
+    def filter_mags(self):
+        return lowpass_cosine_apply(self.spectrum, self.n_fft,
+                                    tau=float(self.f_Hz[1] - self.f_Hz[0]),
+                                    f_3db=1. / self.smoothing_scale_Hz,
+                                    width=0.1 * (1.0 / self.smoothing_scale_Hz),
+                                    padd_data=True)
+
     def on_key_press(self, event):
         # print event.key
         # has to be shift and ctrl because remote viewers only forward
@@ -601,21 +615,12 @@ class InteractiveFilterPlot(object):
             self.smoothing_scale_Hz = self.smoothing_scale_Hz*1.4
             self.refresh_plot()
         if event.key == 't':
-            self.smoothing_scale_Hz = np.float(input("What smoothing scale would you like in Hz? "))
+            self.smoothing_scale_Hz = float(input("What smoothing scale would you like in Hz? "))
             self.refresh_plot()
 
     def refresh_plot(self):
         # first plot data and filter function before removing filter function
-        self.filtermags = lowpass_cosine(y=self.s21_mag,
-                                    tau=self.f_Hz[1] - self.f_Hz[0],
-                                    f_3db=1. / self.smoothing_scale_Hz,
-                                    width=0.1 * (1.0 / self.smoothing_scale_Hz),
-                                    padd_data=True)
-        # the cosine filter drops the last point is the array has an odd number of points
-        self.len_filtered = len(self.filtermags)
-        self.s21_mag = self.s21_mag[:self.len_filtered]
-        self.f_Hz = self.f_Hz[:self.len_filtered]
-        self.f_GHz = self.f_Hz * 1.0e-9
+        self.filtermags = self.filter_mags()
         # calculations for peak spacing (rejection based on threshold)
         self.highpass_mags = self.s21_mag - self.filtermags
         self.l1.set_data(self.f_GHz, self.s21_mag)
@@ -641,49 +646,84 @@ def filter_trace(path, bb_freqs, sweep_freqs):
     return chan_freqs, mags
 
 
-def lowpass_cosine(y, tau, f_3db, width, padd_data=True):
-    # padd_data = True means we are going to symmetric copies of the data to the start and stop
-    # to reduce/eliminate the discontinuities at the start and stop of a dataset due to filtering
-    #
-    # False means we're going to have transients at the start and stop of the data
-    # kill the last data point if y has an odd length
-    if np.mod(len(y), 2):
-        y = y[0:-1]
-    # add the weird padd
-    # so, make a backwards copy of the data, then the data, then another backwards copy of the data
-    if padd_data:
-        y = np.append(np.append(np.flipud(y), y), np.flipud(y))
-    # take the FFT
-    ffty = fftpack.fft(y)
-    ffty = fftpack.fftshift(ffty)
+@lru_cache(maxsize=64)
+def cosine_transfer_function(n, tau, f_3db, width):
+    """
+    the transfer function of lowpass_cosine at the rfft frequencies of n (even) points spaced by tau
+    the old full fft filter had its transfer function flipped onto the negative frequencies one bin off,
+    taking the real part of its output averaged neighbouring bins, that is reproduced here so the filtered
+    data (and the thresholds people have tuned on it) does not change
+    cached since the interactive plot and sweeps of many traces reuse the same few filters
+    """
     # make the companion frequency array
-    delta = 1.0 / (len(y) * tau)
+    delta = 1.0 / (n * tau)
     nyquist = 1.0 / (2.0 * tau)
     freq = np.arange(-nyquist, nyquist, delta)
     # turn this into a positive frequency array
-    #print((len(ffty) // 2))
-    pos_freq = freq[(len(ffty) // 2):]
+    pos_freq = freq[(n // 2):]
     # make the transfer function for the first half of the data
     i_f_3db = min(np.where(pos_freq >= f_3db)[0])
     f_min = f_3db - (width / 2.0)
     i_f_min = min(np.where(pos_freq >= f_min)[0])
     f_max = f_3db + (width / 2.0)
     i_f_max = min(np.where(pos_freq >= f_max)[0])
-    transfer_function = np.zeros(len(y) // 2)
-    transfer_function[0:i_f_min] = 1
-    transfer_function[i_f_min:i_f_max] = (1 + np.sin(-np.pi * ((freq[i_f_min:i_f_max] - freq[i_f_3db]) / width))) / 2.0
-    transfer_function[i_f_max:(len(freq) // 2)] = 0
-    # symmetrize this to be [0 0 0 ... .8 .9 1 1 1 1 1 1 1 1 .9 .8 ... 0 0 0] to match the FFT
-    transfer_function = np.append(np.flipud(transfer_function), transfer_function)
-    # apply the filter, undo the fft shift, and invert the fft
-    filtered = np.real(fftpack.ifft(fftpack.ifftshift(ffty * transfer_function)))
+    half = np.zeros(n // 2)
+    half[0:i_f_min] = 1
+    half[i_f_min:i_f_max] = (1 + np.sin(-np.pi * ((freq[i_f_min:i_f_max] - freq[i_f_3db]) / width))) / 2.0
+    # the real part of the old symmetrized filter at the rfft frequencies 0 ... nyquist
+    transfer_function = np.empty(n // 2 + 1)
+    transfer_function[0] = half[0]
+    transfer_function[1:-1] = 0.5 * (half[1:] + half[:-1])
+    transfer_function[-1] = half[-1]
+    transfer_function.setflags(write=False)
+    return transfer_function
+
+
+def lowpass_cosine_spectrum(y, padd_data=True, axis=-1):
+    """
+    the rfft of the (padded) data for lowpass_cosine_apply, y can hold many traces along the other axes
+    returns the spectrum and the number of points it was taken over
+    """
+    y = np.asarray(y, dtype=float)
+    # kill the last data point if y has an odd length
+    if np.mod(y.shape[axis], 2):
+        y = np.take(y, np.arange(y.shape[axis] - 1), axis=axis)
+    # add the weird padd
+    # so, make a backwards copy of the data, then the data, then another backwards copy of the data
+    if padd_data:
+        flipped = np.flip(y, axis=axis)
+        y = np.concatenate((flipped, y, flipped), axis=axis)
+    return sp_fft.rfft(y, axis=axis), y.shape[axis]
+
+
+def lowpass_cosine_apply(spectrum, n, tau, f_3db, width, padd_data=True, axis=-1):
+    """
+    filters the spectrum from lowpass_cosine_spectrum, so the fft of the data can be reused when only the
+    filter changes
+    """
+    transfer_function = cosine_transfer_function(n, tau, f_3db, width)
+    shape = [1] * spectrum.ndim
+    shape[axis] = len(transfer_function)
+    filtered = sp_fft.irfft(spectrum * transfer_function.reshape(shape), n=n, axis=axis)
     # remove the padd, if we applied it
     if padd_data:
-        filtered = filtered[(len(y) // 3):(2 * (len(y) // 3))]
-    # return the filtered data
+        filtered = np.take(filtered, np.arange(n // 3, 2 * (n // 3)), axis=axis)
     return filtered
 
 
+def lowpass_cosine(y, tau, f_3db, width, padd_data=True, axis=-1):
+    """
+    lowpass filter with a cosine transition of the given width (1/Hz units of tau) centered on f_3db
+    padd_data = True means we are going to symmetric copies of the data to the start and stop
+    to reduce/eliminate the discontinuities at the start and stop of a dataset due to filtering
+    False means we're going to have transients at the start and stop of the data
+    y can be many traces, they are filtered together along axis
+    the last data point is dropped if y has an odd length along axis
+    """
+    spectrum, n = lowpass_cosine_spectrum(y, padd_data=padd_data, axis=axis)
+    return lowpass_cosine_apply(spectrum, n, float(tau), float(f_3db), float(width), padd_data=padd_data, axis=axis)
+
+
 def find_vna_sweep(f_Hz, z, smoothing_scale_Hz=5.0e6, spacing_threshold_Hz=1.0e5):
     """
     f is frequencies (Hz)
@@ -711,97 +751,367 @@ def find_vna_sweep(f_Hz, z, smoothing_scale_Hz=5.0e6, spacing_threshold_Hz=1.0e5
     return ip
 
 
-def slice_vna(f, z, kid_index, q_slice=2000):
-    # make f in Hz for fitting
-    # Q = f/(delta f) for fitting is determined by the lowest frequencies assumed to be at index 0
-    # delta f = f/Q
-    df = f[1] - f[0]
-    n_iq_points = int(f[0] / q_slice // df)
-    print(n_iq_points)
-    res_freq_array = np.zeros((len(kid_index), n_iq_points))
-    res_array = np.zeros((len(kid_index), n_iq_points)).astype('complex')
-    print(res_array.dtype)
-    for i in range(0, len(kid_index)):
-        a = kid_index[i] - n_iq_points // 2 - 1
-        b = kid_index[i] + n_iq_points // 2
-
-        res_freq_array[i, :] = f[a:b]
-        res_array[i, :] = z[a:b]
-        # if i == 4:
-        #     plt.plot(res_freq_array[i,:],20*np.log10(np.abs(res_array[i,:])))
-        if i < len(kid_index) - 1:  # dont check last res
-            # print(i)
-            if kid_index[i + 1] - kid_index[i] < n_iq_points:  # collision at higher frequency
-                high_cutoff = int((kid_index[i + 1] + kid_index[i]) / 2)
-                # print(i,a,high_cutoff,b)
-                res_freq_array[i, high_cutoff - a:] = np.nan
-                res_array[i, high_cutoff - a:] = np.nan * (1 + 1j)
-        if i != 0:  # dont check first res
-            # print(i)
-            if kid_index[i] - kid_index[i - 1] < n_iq_points:
-                low_cutoff = int((kid_index[i] + kid_index[i - 1]) / 2)
-                # print(i,a,low_cutoff,b)
-                res_freq_array[i, :low_cutoff - a] = np.nan
-                res_array[i, :low_cutoff - a] = np.nan * (1 + 1j)
-        # if i == 4:
-        #     plt.plot(res_freq_array[i,:],20*np.log10(np.abs(res_array[i,:])),'--')
-        #     plt.show()
+def window_gather(starts, stops, n_data):
+    """
+    indexes for gathering the windows [starts[i], stops[i]) of data with n_data points into one padded
+    (n_windows, max width) array in a single fancy index
+    returns the (clipped) indexes and the mask of the points that are inside their window and inside the data
+    """
+    starts = np.asarray(starts, dtype=int)
+    stops = np.asarray(stops, dtype=int)
+    widths = stops - starts
+    n_points = np.max(widths) if len(widths) > 0 else 0
+    offsets = np.arange(n_points)
+    index = starts[:, np.newaxis] + offsets
+    mask = (offsets < widths[:, np.newaxis]) & (index >= 0) & (index < n_data)
+    return np.clip(index, 0, n_data - 1), mask
+
+
+def slice_vna(f, z, kid_index=None, q_slice=2000, windows=None, edges=('left_fitter_pad', 'right_fitter_pad'),
+              return_mask=False):
+    """
+    cuts the data around every resonator out into (n_kids, n_points) arrays for fitting
+    points that are not valid (past the ends of the data or closer to a neighbouring resonator) are nan
+    f is frequencies (Hz), z is complex S21
+    by default the windows are the same width around each kid_index
+        the width is set by Q = f/(delta f) = q_slice at the lowest frequency (index 0)
+        windows of resonators closer than the width are cut halfway between them
+    or supply windows, a list of SingleWindow or the (n_kids, 9) array from find_windows/find_resonances,
+        to cut out the variable width windows [window.edges[0], window.edges[1])
+        the windows are already split between resonators
+    return_mask = True also returns the (n_kids, n_points) mask of the valid points
+    """
+    n_data = len(f)
+    if windows is not None:
+        windows = np.asarray(windows, dtype=int).reshape(-1, 9)
+        starts = windows[:, SingleWindow._fields.index(edges[0])]
+        stops = windows[:, SingleWindow._fields.index(edges[1])]
+        index, mask = window_gather(starts, stops, n_data)
+    else:
+        # make f in Hz for fitting
+        # Q = f/(delta f) for fitting is determined by the lowest frequencies assumed to be at index 0
+        # delta f = f/Q
+        kid_index = np.asarray(kid_index, dtype=int)
+        df = f[1] - f[0]
+        n_iq_points = int(f[0] / q_slice // df)
+        starts = kid_index - n_iq_points // 2 - 1
+        index, mask = window_gather(starts, starts + n_iq_points, n_data)
+        # collisions, cut the windows halfway between resonators closer than the window width
+        spacing = np.diff(kid_index)
+        halfway = ((kid_index[1:] + kid_index[:-1]) / 2).astype(int)
+        high_cutoff = np.concatenate((np.where(spacing < n_iq_points, halfway, n_data), [n_data]))
+        low_cutoff = np.concatenate(([0], np.where(spacing < n_iq_points, halfway, 0)))
+        mask &= (index < high_cutoff[:, np.newaxis]) & (index >= low_cutoff[:, np.newaxis])
+    res_freq_array = np.where(mask, np.asarray(f)[index], np.nan)
+    res_array = np.where(mask, np.asarray(z, dtype=complex)[index], np.nan * (1 + 1j))
+    if return_mask:
+        return res_freq_array, res_array, mask
     return res_freq_array, res_array
 
 
-def fit_slices(res_freq_array, res_array, do_plots=True, plot_filename='fits'):
-    if do_plots:
-        pdf_pages = PdfPages(plot_filename + ".pdf")
-    fits_dict_mag = {}
+iq_fit_names = ('fr', 'Qr', 'amp', 'phi', 'a', 'i0', 'q0', 'tau', 'f0')
+mag_fit_names = ('fr', 'Qr', 'amp', 'phi', 'a', 'b0', 'b1', 'flin')
+
+
+def fit_table_dtype():
+    """
+    the dtype of the table from fit_slices_parallel, one row per resonator with
+    index, iq_good, iq_<name>, iq_<name>_err for the fit_nonlinear_iq parameters and the same for mag_
+    bad fits are iq_good/mag_good False with nan values
+    """
+    fields = [('index', int)]
+    for prefix, names in (('iq_', iq_fit_names), ('mag_', mag_fit_names)):
+        fields.append((prefix + 'good', bool))
+        for name in names:
+            fields += [(prefix + name, float), (prefix + name + '_err', float)]
+    return np.dtype(fields)
+
+
+def _fit_or_bad(fitter, x, z):
+    try:
+        return fitter(x, z)
+    except Exception as inst:
+        print("could not fit")
+        print(type(inst))    # the exception instance
+        print(inst.args)     # arguments stored in .args
+        return 'bad fit'
+
+
+def _fit_slice(args):
+    # worker for fit_slices_parallel, it has to be at the module level to be sent to the pool
+    i, x, z = args
+    x = x[~np.isnan(x)]
+    z = z[~np.isnan(z)]
+    return i, _fit_or_bad(rf.fit_nonlinear_iq, x, z), _fit_or_bad(rf.fit_nonlinear_mag, x, z)
+
+
+def _fill_fit_row(row, fit, prefix, names):
+    row[prefix + 'good'] = not isinstance(fit, str)
+    if isinstance(fit, str):
+        for name in names:
+            row[prefix + name] = row[prefix + name + '_err'] = np.nan
+        return
+    values, covariance = fit['fit'][0], fit['fit'][1]
+    errors = np.sqrt(np.abs(np.diag(covariance)))
+    # fit_nonlinear_iq can be given a fixed tau, then it is not in the fit values
+    if len(values) < len(names):
+        values = np.insert(values, names.index('tau'), np.nan)
+        errors = np.insert(errors, names.index('tau'), np.nan)
+    for name, value, error in zip(names, values, errors):
+        row[prefix + name] = value
+        row[prefix + name + '_err'] = error
+
+
+def fit_slices_parallel(res_freq_array, res_array, processes=None, chunksize=1, progress=True):
+    """
+    fits every row of the slice_vna arrays with rf.fit_nonlinear_iq and rf.fit_nonlinear_mag
+    in a pool of worker processes (processes None uses all the cores and 1 fits in this process)
+    the results go into the table as the fits complete
+    returns table, fits_dict_iq, fits_dict_mag
+        table: numpy structured array with fit_table_dtype(), one row per resonator
+        fits_dict_iq, fits_dict_mag: the fit dictionaries (or 'bad fit') by resonator index like fit_slices
+    """
+    n_res = res_freq_array.shape[0]
+    table = np.zeros(n_res, dtype=fit_table_dtype())
     fits_dict_iq = {}
-    for i in range(0, res_freq_array.shape[0]):
-        if do_plots:
-            fig = plt.figure(i, figsize=(12, 6))
-        try:
-            fit = rf.fit_nonlinear_iq(res_freq_array[i, :][~np.isnan(res_freq_array[i, :])],
-                                      res_array[i, :][~np.isnan(res_array[i, :])])
-            fits_dict_iq[i] = fit
-            if do_plots:
-                plt.subplot(121)
-                plt.plot(np.real(res_array[i, :]), np.imag(res_array[i, :]), 'o', label='data')
-                plt.plot(np.real(fit['fit_result']), np.imag(fit['fit_result']), label='fit')
-                plt.plot(np.real(fit['x0_result']), np.imag(fit['x0_result']), label='guess')
-                plt.legend()
-        except Exception as inst:
-            print("could not fit")
-            print(type(inst))    # the exception instance
-            print(inst.args)     # arguments stored in .args
-            #print(inst)          # __str__ allows args to be printed directly,
-            fits_dict_iq[i] = 'bad fit'
-        try:
-            fit2 = rf.fit_nonlinear_mag(res_freq_array[i, :][~np.isnan(res_freq_array[i, :])],
-                                        res_array[i, :][~np.isnan(res_array[i, :])])
-            fits_dict_mag[i] = fit2
-            if do_plots:
-                plt.subplot(122)
-                plt.plot(res_freq_array[i, :], 20 * np.log10(np.abs(res_array[i, :])), label='data')
-                plt.plot(res_freq_array[i, :][~np.isnan(res_freq_array[i, :])],
-                         10 * np.log10(np.abs(fit2['fit_result'])), label='fit')
-                plt.plot(res_freq_array[i, :][~np.isnan(res_freq_array[i, :])],
-                         10 * np.log10(np.abs(fit2['x0_result'])), label='guess')
-                plt.legend()
-        except Exception as inst:
-            print("could not fit")
-            print(type(inst))    # the exception instance
-            print(inst.args)     # arguments stored in .args
-            #print(inst)          # __str__ allows args to be printed directly,
-            fits_dict_mag[i] = 'bad fit'
-        if do_plots:
+    fits_dict_mag = {}
+    tasks = ((i, res_freq_array[i, :], res_array[i, :]) for i in range(n_res))
+    if processes is None:
+        processes = mp.cpu_count()
+    report_every = max(1, n_res // 10)
+    if processes == 1:
+        fit_results = map(_fit_slice, tasks)
+        pool = None
+    else:
+        pool = mp.Pool(processes)
+        fit_results = pool.imap_unordered(_fit_slice, tasks, chunksize)
+    try:
+        for n_done, (i, fit_iq, fit_mag) in enumerate(fit_results, start=1):
+            fits_dict_iq[i] = fit_iq
+            fits_dict_mag[i] = fit_mag
+            row = table[i:i + 1]
+            row['index'] = i
+            _fill_fit_row(row, fit_iq, 'iq_', iq_fit_names)
+            _fill_fit_row(row, fit_mag, 'mag_', mag_fit_names)
+            if progress and (n_done % report_every == 0 or n_done == n_res):
+                print("{0}/{1} fit".format(n_done, n_res))
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return table, fits_dict_iq, fits_dict_mag
+
+
+def plot_slice_fit(fig, x, z, fit_iq, fit_mag):
+    """
+    draws the page of fit_slices for one resonator on fig, x and z are the rows of the slice_vna arrays
+    """
+    good = ~np.isnan(x)
+    if not isinstance(fit_iq, str):
+        ax = fig.add_subplot(121)
+        ax.plot(np.real(z), np.imag(z), 'o', label='data')
+        ax.plot(np.real(fit_iq['fit_result']), np.imag(fit_iq['fit_result']), label='fit')
+        ax.plot(np.real(fit_iq['x0_result']), np.imag(fit_iq['x0_result']), label='guess')
+        ax.legend()
+    if not isinstance(fit_mag, str):
+        ax = fig.add_subplot(122)
+        ax.plot(x, 20 * np.log10(np.abs(z)), label='data')
+        ax.plot(x[good], 10 * np.log10(np.abs(fit_mag['fit_result'])), label='fit')
+        ax.plot(x[good], 10 * np.log10(np.abs(fit_mag['x0_result'])), label='guess')
+        ax.legend()
+
+
+def _plot_slice_fits_pdf(args):
+    # worker for plot_slice_fits, writes the pages of a block of resonators to one pdf
+    filename, res_freq_array, res_array, fits_iq, fits_mag = args
+    with PdfPages(filename) as pdf_pages:
+        for x, z, fit_iq, fit_mag in zip(res_freq_array, res_array, fits_iq, fits_mag):
+            fig = Figure(figsize=(12, 6))
+            plot_slice_fit(fig, x, z, fit_iq, fit_mag)
             pdf_pages.savefig(fig)
-            plt.close()
+    return filename
+
+
+def plot_slice_fits(res_freq_array, res_array, fits_dict_iq, fits_dict_mag, plot_filename='fits', processes=1):
+    """
+    renders a pdf page per resonator of the fits from fit_slices_parallel
+    processes = 1 writes plot_filename.pdf
+    processes > 1 (None for all the cores) renders blocks of resonators in parallel to
+    plot_filename_0.pdf, plot_filename_1.pdf ... in resonator order
+    returns the list of pdf filenames
+    """
+    n_res = res_freq_array.shape[0]
+    if processes is None:
+        processes = mp.cpu_count()
+    if processes == 1:
+        blocks = [np.arange(n_res)]
+        filenames = [plot_filename + ".pdf"]
+    else:
+        blocks = [block for block in np.array_split(np.arange(n_res), processes) if len(block) > 0]
+        filenames = [plot_filename + "_{0}.pdf".format(k) for k in range(len(blocks))]
+    tasks = [(filename, res_freq_array[block], res_array[block], [fits_dict_iq[i] for i in block],
+              [fits_dict_mag[i] for i in block]) for filename, block in zip(filenames, blocks)]
+    if processes == 1:
+        return [_plot_slice_fits_pdf(task) for task in tasks]
+    with mp.Pool(min(processes, len(tasks))) as pool:
+        return pool.map(_plot_slice_fits_pdf, tasks)
+
+
+def fit_slices(res_freq_array, res_array, do_plots=True, plot_filename='fits', processes=1):
+    """
+    fits the slice_vna arrays, see fit_slices_parallel, and plots them to plot_filename.pdf if do_plots
+    the fits run in this process by default, pass processes > 1 (or None for all the cores) to fit in
+    a worker pool, scripts doing so need an if __name__ == '__main__': guard where multiprocessing spawns (Darwin)
+    returns fits_dict_iq, fits_dict_mag
+    """
+    table, fits_dict_iq, fits_dict_mag = fit_slices_parallel(res_freq_array, res_array, processes=processes)
     if do_plots:
-        pdf_pages.close()
+        plot_slice_fits(res_freq_array, res_array, fits_dict_iq, fits_dict_mag, plot_filename=plot_filename)
 
     return fits_dict_iq, fits_dict_mag
 
 
+def windowed_minima(data, centers, low, high):
+    """
+    the index of the minimum of data in [centers[i] - low, centers[i] + high) for every center in one gather
+    windows running off the ends of the data are cut at the ends
+    """
+    centers = np.asarray(centers, dtype=int)
+    index, mask = window_gather(centers - low, centers + high, len(data))
+    return index[np.arange(len(centers)), np.argmin(np.where(mask, data[index], np.inf), axis=1)]
+
+
+def highpass_mag(f_Hz, z, smoothing_scale_Hz=5.0e6):
+    """
+    20*log10(abs(z)) minus the lowpass_cosine baseline, what the resonator finders threshold on
+    the same length as z (the last point is repeated for odd lengths)
+    """
+    s21_mag = 20 * np.log10(np.abs(z))
+    filtermags = lowpass_cosine(y=s21_mag,
+                                tau=f_Hz[1] - f_Hz[0],
+                                f_3db=1. / smoothing_scale_Hz,
+                                width=0.1 * (1.0 / smoothing_scale_Hz),
+                                padd_data=True)
+    highpass_mags = s21_mag[:len(filtermags)] - filtermags
+    if len(filtermags) < len(s21_mag):
+        highpass_mags = np.append(highpass_mags, highpass_mags[-1])
+    return highpass_mags
+
+
+def track_resonances(f, z, kid_index, f_old=None, z_old=None, n_points_look_around=10, look_low_high=None,
+                     max_shift_points=None, smoothing_scale_Hz=5.0e6, peak_threshold_dB=1.5, depth_tolerance_dB=3.0,
+                     ambiguity_margin=0.25, verbose=True):
+    """
+    non interactive version of retune_vna, finds the resonators at kid_index in the new sweep f, z
+    kid_index are indexes into f_old, z_old (the sweep they were found in) if supplied otherwise into f
+    1) a global shift is estimated, by cross correlating the dips of the old and new sweeps if z_old is supplied
+       (max_shift_points limits it) or as the median shift of the windowed minima if not
+    2) the candidates are the minima of the windows [predicted - low, predicted + high) around the shifted
+       indexes plus all of the local minima deeper than peak_threshold_dB (highpassed like find_resonances) in them
+       look_low_high = [low, high], defaults to [n_points_look_around, n_points_look_around]
+    3) resonators are assigned to candidates all at once (scipy linear_sum_assignment, the Hungarian method)
+       minimizing the sum of (distance from the prediction / window half width)**2
+       + ((new depth - old depth) / depth_tolerance_dB)**2 (the depth term needs z_old)
+       so two resonators never take the same dip and crossings are followed by depth
+    a resonator is ambiguous if no dip is left for it in its window (it then gets its windowed minimum),
+    if it was assigned the dip that is the windowed minimum of such an unmatched resonator (a collision),
+    or if its second best candidate costs less than ambiguity_margin more than the assigned one
+    only the ambiguous resonators are printed with the reason (verbose)
+    returns a dictionary with
+        kid_idx: the new indexes into f
+        shift_points: the global shift
+        predicted: the shifted old indexes
+        cost: the assignment cost of every resonator (nan if unmatched)
+        matched: whether the resonator was assigned a candidate
+        ambiguous: mask of the ambiguous resonators and ambiguous_idx their positions in kid_index
+    """
+    kid_index = np.asarray(kid_index, dtype=int)
+    if look_low_high is None:
+        look_low_high = [n_points_look_around, n_points_look_around]
+    low, high = int(look_low_high[0]), int(look_low_high[1])
+    new_mags = highpass_mag(f, z, smoothing_scale_Hz)
+    n_kids = len(kid_index)
+    if f_old is None:
+        f_old = f
+    # the old resonators on the new frequency grid
+    start_index = np.clip(np.searchsorted(f, f_old[kid_index]), 0, len(f) - 1)
+    old_depth = None
+    if z_old is not None:
+        old_mags = highpass_mag(f_old, z_old, smoothing_scale_Hz)
+        old_depth = old_mags[kid_index]
+        # only the dips matter, not the ripple of the baseline
+        new_dips = np.minimum(new_mags, 0.)
+        old_dips = np.minimum(np.interp(f, f_old, old_mags), 0.)
+        correlation = signal.correlate(new_dips - np.mean(new_dips), old_dips - np.mean(old_dips), method='fft')
+        lags = signal.correlation_lags(len(new_dips), len(old_dips))
+        if max_shift_points is not None:
+            correlation = np.where(np.abs(lags) <= max_shift_points, correlation, -np.inf)
+        shift_points = int(lags[np.argmax(correlation)])
+    else:
+        shift_points = int(np.median(windowed_minima(new_mags, start_index, low, high) - start_index)) \
+            if n_kids > 0 else 0
+    predicted = np.clip(start_index + shift_points, 0, len(f) - 1)
+
+    # candidates, the windowed minima and the deepest point of every threshold region in the windows
+    index, mask = window_gather(predicted - low, predicted + high, len(f))
+    window_min = windowed_minima(new_mags, predicted, low, high)
+    region_starts, region_stops = threshold_regions(new_mags, peak_threshold_dB)
+    below = np.flatnonzero(new_mags < -peak_threshold_dB)
+    region_id = np.searchsorted(region_starts, below, side='right') - 1
+    order = np.lexsort((new_mags[below], region_id))
+    deepest = np.zeros(len(new_mags), dtype=bool)
+    deepest[below[order][np.searchsorted(region_id[order], np.arange(len(region_starts)))]] = True
+    candidates = np.unique(np.concatenate((window_min, index[mask & deepest[index]])))
+
+    # cost of every resonator candidate pair, infeasible pairs (outside of the window) cost too much to assign
+    offset = candidates[np.newaxis, :] - predicted[:, np.newaxis]
+    half_width = np.where(offset < 0, max(low, 1), max(high, 1))
+    cost = (offset / half_width) ** 2
+    if old_depth is not None:
+        cost = cost + ((new_mags[candidates][np.newaxis, :] - old_depth[:, np.newaxis]) / depth_tolerance_dB) ** 2
+    feasible = (offset >= -low) & (offset < high)
+    infeasible_cost = 1. + 2 * np.max(np.where(feasible, cost, 0.), initial=0.) * n_kids
+    cost = np.where(feasible, cost, infeasible_cost)
+    rows, cols = optimize.linear_sum_assignment(cost)
+    good = cost[rows, cols] < infeasible_cost
+    rows, cols = rows[good], cols[good]
+
+    new_index = window_min.copy()
+    new_index[rows] = candidates[cols]
+    matched = np.zeros(n_kids, dtype=bool)
+    matched[rows] = True
+    assigned_cost = np.full(n_kids, np.nan)
+    assigned_cost[rows] = cost[rows, cols]
+    # the second best candidate of each assigned resonator
+    runner_up = cost[rows].copy()
+    runner_up[np.arange(len(rows)), cols] = np.inf
+    close = np.min(runner_up, axis=1, initial=np.inf) < assigned_cost[rows] + ambiguity_margin
+    near_tie = np.zeros(n_kids, dtype=bool)
+    near_tie[rows[close]] = True
+    # the resonators that took a dip an unmatched resonator wanted (collisions)
+    unmatched_idx = np.where(~matched)[0]
+    collision = matched & np.isin(new_index, new_index[unmatched_idx])
+    ambiguous = ~matched | near_tie | collision
+    ambiguous_idx = np.where(ambiguous)[0]
+    if verbose:
+        print(F"shift of {shift_points} points, {len(ambiguous_idx)} of {n_kids} resonators ambiguous")
+        for i in ambiguous_idx:
+            reasons = []
+            if not matched[i]:
+                reasons.append("no dip left in window")
+            if collision[i]:
+                others = unmatched_idx[new_index[unmatched_idx] == new_index[i]]
+                reasons.append("shares dip with unmatched resonator " + ", ".join(str(j) for j in others))
+            if near_tie[i]:
+                reasons.append("second candidate almost as good")
+            print(F"resonator {i}: {f[predicted[i]] * 1e-9:.6f} GHz predicted, {f[new_index[i]] * 1e-9:.6f} GHz "
+                  F"chosen, {'; '.join(reasons)}")
+    return {'kid_idx': new_index, 'shift_points': shift_points, 'predicted': predicted, 'cost': assigned_cost,
+            'matched': matched, 'ambiguous': ambiguous, 'ambiguous_idx': ambiguous_idx}
+
+
 def retune_vna(f, z, kid_index, n_points_look_around=0, look_low_high=[0, 0], f_old=None, z_old=None,
-               kid_index_old=None):
+               kid_index_old=None, track=False):
     """
     This is a program for when the resonances move and you need to retune the indexes of the resonators
     use n_point_look_around = 10 to look to lower and higher frequencies within 10 data points to find a new min
@@ -809,15 +1119,26 @@ def retune_vna(f, z, kid_index, n_points_look_around=0, look_low_high=[0, 0], f_
 
     if you would like to have the old data and kid indexes displayed in the background suppy
     f_old, z_old, kid_index old
+
+    track = True finds the new indexes with track_resonances (from kid_index_old in z_old if supplied) before
+    the plot is opened and prints the ambiguous resonators to check, track_resonances does this without the plot
     """
-    if n_points_look_around > 0:
-        for i in range(0, len(kid_index)):
-            new_index = np.argmin(
-                20 * np.log10(np.abs(z[kid_index[i] - n_points_look_around:kid_index[i] + n_points_look_around]))) + \
-                        kid_index[i] - n_points_look_around
-            kid_index[i] = new_index
+    kid_index = np.asarray(kid_index, dtype=int)
+    if np.any(look_low_high):
+        low, high = look_low_high
+    else:
+        low, high = n_points_look_around, n_points_look_around
+    if track:
+        if z_old is not None and kid_index_old is not None:
+            result = track_resonances(f, z, kid_index_old, f_old=f_old, z_old=z_old, look_low_high=[low, high])
+        else:
+            result = track_resonances(f, z, kid_index, look_low_high=[low, high])
+        kid_index = result['kid_idx']
+    elif low > 0 or high > 0:
+        kid_index = windowed_minima(np.abs(z), kid_index, low, high)
 
-    ip = InteractivePlot(f, 20 * np.log10(np.abs(z)), kid_index, f_old=f_old, data_old=20 * np.log10(np.abs(z_old)),
+    data_old = 20 * np.log10(np.abs(z_old)) if z_old is not None else None
+    ip = InteractivePlot(f, 20 * np.log10(np.abs(z)), kid_index, f_old=f_old, data_old=data_old,
                           kid_idx_old=kid_index_old)
 
     return ip
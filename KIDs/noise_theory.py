@@ -2,6 +2,10 @@ import numpy as np
 import scipy.special as special
 import scipy.optimize as optimization
 import matplotlib.pyplot as plt
+try:
+    from numba import jit
+except ImportError:
+    jit = None # only needed for responsivity(...,backend = 'numba')
 
 # this is a list of definitions that can be used to predict noise in KIDS
 # right now it just contains the nessasary requirements for perdicting G-R noise in TiN
@@ -12,6 +16,8 @@ import matplotlib.pyplot as plt
 
 #Change log
 # 1/6/2017 added nqp_min as a specified parameter for grnoise 
+# 10/19/2026 added fit_tc_brute_multi
+# 10/19/2026 responsivity works on grids of inputs and returns NEPs
 
 
 
@@ -93,15 +99,21 @@ def grnoise(t,tc,V,tau_qp,N0,f,nqp_min):
     return ef2
 
 
-def responsivity(temp,pabs,tc = 1.,N0 = 4.*10**10,nstar =100.,tau_max = 100.,eta_pb = 0.7,vol = 1.,fr = 100.,alpha_k = 1.,gamma_t = 1.,nu_opt = 250, n_gamma = 0.):
+#Define various constants
+k_B = 1.381e-23 #Boltzmann constant [J K^-1]
+ev_joule = 1.6022e-19 #eV/J ratio [eV J^-1]
+h_p = 6.626e-34 #Planck constant [J s]
+
+_responsivity_outputs = ('nth', 'nqp', 'tau_qp', 's1', 's2', 'xr', 'Qi_inv', 'r_x', 'r_qinv',
+                         'sxx_gr', 'sxx_gr0', 'sxx_gamma', 'nep_gr', 'nep_gamma', 'nep')
+
+
+def _responsivity_chunk(temp,pabs,tc,N0,nstar,tau_max,eta_pb,vol,alpha_k,gamma_t,nu_opt,n_gamma,sxx_amp,xi,kve0,ive0):
     '''
-    Special thanks to Steve Hailey Dunsheath whose made this orginal function in idl 
+    the responsivity arithmetic on 1d arrays of the same length, returns the outputs in the order of _responsivity_outputs
+    special functions are not available in numba so kve0 = kv(0,xi)*exp(xi) and ive0 = iv(0,xi)*exp(-xi)
+    are evaluated with scipy and passed in, sinh(xi)*kv(0,xi) = (1-exp(-2xi))/2*kve0 does not overflow at low T
     '''
-    #Define various constants
-    k_B = 1.381*10**-23 #Boltzmann constant [J K^-1]
-    ev_joule = 1.6022*10**-19 #eV/J ratio [eV J^-1]
-    h_p = 6.626*10**-34 #Planck constant [J s]
-
     #Compute the ratio of Delta_0/k_B [K]
     d0_kB = 1.764*tc
 
@@ -111,23 +123,15 @@ def responsivity(temp,pabs,tc = 1.,N0 = 4.*10**10,nstar =100.,tau_max = 100.,eta
     # Compute nqp
     # This expression has a term of the form [sqrt(1 + eps) - 1], where eps is small when nth and pabs are small.
     # When eps is small this term is not computed accurately, and here we explicitly linearize it.
-    #nqp = nstar*(-1. + sqrt(1. + 2.*nth/nstar + (nth/nstar)^2. + 2.*eta_pb*pabs*1.e-12*tau_max*1.e-6/(nstar*vol*d0_kB*k_B)))
-    eps = 2.*nth/nstar + (nth/nstar)**2. + 2.*eta_pb*pabs*1.*10**-12*tau_max*1.*10**-6/(nstar*vol*d0_kB*k_B)
-    term = np.sqrt(1. + eps) - 1.
-    indx = np.where(eps < 1*10**-8)
-    count = len(indx)
-    if (count != 0):
-        term[indx] = 0.5*eps[indx]
-    nqp = nstar*term
-    
+    eps = 2.*nth/nstar + (nth/nstar)**2 + 2.*eta_pb*pabs*1e-12*tau_max*1e-6/(nstar*vol*d0_kB*k_B)
+    nqp = nstar*np.where(eps < 1e-8, 0.5*eps, np.sqrt(1. + eps) - 1.)
+
     #Compute tau_qp
     tau_qp = tau_max/(1. + nqp/nstar)
 
     # Compute S1 and S2
-    xi = h_p*fr*1*10**6/(2.*k_B*temp)
-    s1 = (2./np.pi)*np.sqrt(2.*d0_kB/(np.pi*temp))*np.sinh(xi)*special.kv(0,xi)
-    s2 = 1. + np.sqrt(2.*d0_kB/(np.pi*temp))*np.exp(-1.*xi)*special.iv(0,xi)
-    #s2 = 3.
+    s1 = (2./np.pi)*np.sqrt(2.*d0_kB/(np.pi*temp))*0.5*(1. - np.exp(-2.*xi))*kve0
+    s2 = 1. + np.sqrt(2.*d0_kB/(np.pi*temp))*ive0
 
     #Compute xr and Qi_inv
     #Note that xr refers to the frequency shift from the nqp = 0 state
@@ -135,38 +139,72 @@ def responsivity(temp,pabs,tc = 1.,N0 = 4.*10**10,nstar =100.,tau_max = 100.,eta
     Qi_inv = -1.*xr*2.*s1/s2
 
     #Compute the frequency and Qinv responsivity
-    r_x = -1.*alpha_k*gamma_t*s2/(4.*N0*d0_kB*k_B/ev_joule)*eta_pb*tau_qp*1*10**-6/(d0_kB*k_B*vol)
+    r_x = -1.*alpha_k*gamma_t*s2/(4.*N0*d0_kB*k_B/ev_joule)*eta_pb*tau_qp*1e-6/(d0_kB*k_B*vol)
     r_qinv = -1.*r_x*2.*s1/s2
 
     #Compute Sxx_gr and Sxx_gr0
     tau_th = tau_max/(1. + nth/nstar) #quasiparticle lifetime for a superconductor in thermal equilibrium at the specified temperature [microsec]
-    gamma_th = nth*vol/2.*(1./tau_max + 1./tau_th)*1*10**6 #quasiparticle generation rate due to thermal fluctuations ;[sec^-1]
-    gamma_r = nqp*vol/2.*(1./tau_max + 1./tau_qp)*1*10**6 #quasiparticle recombination rate ;[sec^-1]
-    sxx_gr = (alpha_k*gamma_t*s2/(4.*N0*d0_kB*k_B/ev_joule))**2.*4.*(tau_qp*1*10**-6)**2./vol**2.*(gamma_th + gamma_r)
-    sxx_gr0 = (alpha_k*gamma_t*s2/(4.*N0*d0_kB*k_B/ev_joule))**2.*4.*nqp/vol*tau_qp*1*10**-6
+    gamma_th = nth*vol/2.*(1./tau_max + 1./tau_th)*1e6 #quasiparticle generation rate due to thermal fluctuations ;[sec^-1]
+    gamma_r = nqp*vol/2.*(1./tau_max + 1./tau_qp)*1e6 #quasiparticle recombination rate ;[sec^-1]
+    sxx_gr = (alpha_k*gamma_t*s2/(4.*N0*d0_kB*k_B/ev_joule))**2*4.*(tau_qp*1e-6)**2/vol**2*(gamma_th + gamma_r)
+    sxx_gr0 = (alpha_k*gamma_t*s2/(4.*N0*d0_kB*k_B/ev_joule))**2*4.*nqp/vol*tau_qp*1e-6
 
     #Compute Sxx_gamma
-    sxx_gamma = (r_x)**2.*2.*h_p*nu_opt*1*10**9*pabs*1*10**-12*(1. + n_gamma)
+    sxx_gamma = r_x**2*2.*h_p*nu_opt*1e9*pabs*1e-12*(1. + n_gamma)
+
+    # noise equivalent powers [W/sqrt(Hz)]
+    nep_gr = np.sqrt(sxx_gr)/np.abs(r_x)
+    nep_gamma = np.sqrt(sxx_gamma)/np.abs(r_x)
+    nep = np.sqrt(sxx_gr + sxx_gamma + sxx_amp)/np.abs(r_x)
+
+    return (nth, nqp, tau_qp, s1, s2, xr, Qi_inv, r_x, r_qinv, sxx_gr, sxx_gr0, sxx_gamma, nep_gr, nep_gamma, nep)
+
+
+if jit is not None:
+    _responsivity_chunk_numba = jit(nopython = True)(_responsivity_chunk)
+
+
+def responsivity(temp,pabs,tc = 1.,N0 = 4.*10**10,nstar =100.,tau_max = 100.,eta_pb = 0.7,vol = 1.,fr = 100.,alpha_k = 1.,gamma_t = 1.,nu_opt = 250, n_gamma = 0.,
+                 sxx_amp = 0.,chunk_size = 2**20,backend = 'numpy'):
+    '''
+    Special thanks to Steve Hailey Dunsheath whose made this orginal function in idl 
+    all of the inputs are broadcast against each other so you can pass i.e. temp[:,None,None], pabs[None,:,None]
+    and vol[None,None,:] to get every output on the temperature x power x volume grid
+    sxx_amp is the amplifier Sxx [1/Hz] that goes into the total nep
+    the grid is evaluated chunk_size points at a time
+    backend = 'numba' evaluates each chunk with a numba compiled version (if it is installed)
+    '''
+    if backend == 'numba' and jit is None:
+        raise ImportError("backend = 'numba' requires numba")
+    if backend not in ('numpy','numba'):
+        raise ValueError("backend must be 'numpy' or 'numba' not "+str(backend))
+    chunk_function = _responsivity_chunk_numba if backend == 'numba' else _responsivity_chunk
+    arrays = np.broadcast_arrays(*[np.asarray(value,dtype = float) for value in
+                                   (temp,pabs,tc,N0,nstar,tau_max,eta_pb,vol,alpha_k,gamma_t,nu_opt,n_gamma,sxx_amp,fr)])
+    shape = arrays[0].shape
+    size = int(np.prod(shape))
 
     #Define the output dictionary and return
-    dict = {'nth':nth, 
-          'nqp':nqp, 
-          'tau_qp':tau_qp, 
-          's1':s1, 
-          's2':s2, 
-          'xr':xr, 
-          'Qi_inv':Qi_inv, 
-          'r_x':r_x, 
-          'r_qinv':r_qinv, 
-          'sxx_gr':sxx_gr, 
-          'sxx_gr0':sxx_gr0, 
-          'sxx_gamma':sxx_gamma}
+    dict = {}
+    for name in _responsivity_outputs:
+        dict[name] = np.empty(size)
+    for start in range(0,max(size,1),chunk_size):
+        stop = min(start+chunk_size,size)
+        # .flat only copies the points in this chunk out of the broadcast views
+        chunk = [array.flat[start:stop] for array in arrays]
+        fr_chunk = chunk.pop()
+        xi = h_p*fr_chunk*1e6/(2.*k_B*chunk[0])
+        outputs = chunk_function(*chunk,xi,special.kve(0,xi),special.ive(0,xi))
+        for name, output in zip(_responsivity_outputs,outputs):
+            dict[name][start:stop] = output
+    for name in _responsivity_outputs:
+        dict[name] = dict[name].reshape(shape)[()]
         
     return dict
 
 def responsivity_help():
-    print("The input variables are temp,pabs,tc = 1.,N0 = 4.*10**10,nstar =100.,tau_max = 100.,eta_pb = 0.7,vol = 1.,fr = 100.,alpha_k = 1.,gamma_t = 1.,nu_opt = 250, n_gamma = 0.")
-    print("The output variables are nth, nqp, tau_qp, s1, s2, xr, Qi_inv, r_x, r_qinv, sxx_gr, sxx_gr0, sxx_gamma")
+    print("The input variables are temp,pabs,tc = 1.,N0 = 4.*10**10,nstar =100.,tau_max = 100.,eta_pb = 0.7,vol = 1.,fr = 100.,alpha_k = 1.,gamma_t = 1.,nu_opt = 250, n_gamma = 0., sxx_amp = 0., chunk_size = 2**20, backend = 'numpy'")
+    print("The output variables are nth, nqp, tau_qp, s1, s2, xr, Qi_inv, r_x, r_qinv, sxx_gr, sxx_gr0, sxx_gamma, nep_gr, nep_gamma, nep")
 
 
 def f0dirshort(T, f00, Fdelta):
@@ -191,6 +229,64 @@ def fit_tls(T,f,sigma = None,**keywords):
         fit = optimization.curve_fit(f0dirshort, T, f, x0)
     return fit
 
+def deltaf_f_grid(t,tc,nu):
+    '''
+    deltaf_f with alpha = gamma = 1 for every combination of t (n_T) and tc (n_tc)
+    returns an (n_T, n_tc) array, nu can also be an array of n_res resonator frequencies in MHz
+    then the result is (n_T, n_tc, n_res)
+    the bessel function only depends on t and nu so it is evaluated n_T (x n_res) times not for every tc
+    '''
+    t = np.asarray(t,dtype = float)[:,np.newaxis]
+    d_0 = 1.762*np.asarray(tc,dtype = float)[np.newaxis,:] #factor of 1.762 is suspect
+    boltzmann = np.exp(-1.*d_0/t)
+    if np.ndim(nu) == 0:
+        xi = 6.626e-34*nu*1.e6/(2.*1.38e-23*t)
+    else:
+        boltzmann = boltzmann[:,:,np.newaxis]
+        d_0 = d_0[:,:,np.newaxis]
+        t = t[:,:,np.newaxis]
+        xi = 6.626e-34*np.asarray(nu)[np.newaxis,np.newaxis,:]*1.e6/(2.*1.38e-23*t)
+    # exp(-xi)*iv(0,xi) = ive(0,xi) without overflowing at low temperatures
+    return -1./2.*boltzmann*((2.*np.pi*t/d_0)**0.5 + 2.*special.ive(0,xi))
+
+
+def brute_chi2(t,df_over_f,nuref,tc_values,alpha_values,error = None,chunk_size = 256):
+    '''
+    chi square of deltaf_f(t,tc,nuref,alpha,1) against every resonator for every (tc, alpha) on the grid
+    df_over_f and error are (n_T, n_res) (or (n_T,) for one resonator), returns (n_tc, n_alpha, n_res)
+    the model is alpha*deltaf_f_grid so
+    chi2 = alpha^2 sum(g^2/err^2) - 2 alpha sum(g d/err^2) + sum(d^2/err^2)
+    which only needs a few weighted sums over temperature per tc and resonator
+    the resonators are done chunk_size at a time to limit the memory of the per resonator model
+    '''
+    df_over_f = np.asarray(df_over_f,dtype = float)
+    if df_over_f.ndim == 1:
+        df_over_f = df_over_f[:,np.newaxis]
+    if error is None:
+        error = np.ones(df_over_f.shape)
+    error = np.broadcast_to(np.reshape(error,(df_over_f.shape[0],-1)),df_over_f.shape)
+    alpha_values = np.asarray(alpha_values,dtype = float)
+    n_res = df_over_f.shape[1]
+    chi2 = np.empty((len(tc_values),len(alpha_values),n_res))
+    if np.ndim(nuref) == 0:
+        g = deltaf_f_grid(t,tc_values,nuref) # shared by all resonators
+    for start in range(0,n_res,chunk_size):
+        stop = min(start+chunk_size,n_res)
+        weights = 1./error[:,start:stop]**2
+        data = df_over_f[:,start:stop]
+        if np.ndim(nuref) == 0:
+            A = np.dot((g*g).T,weights)
+            B = np.dot(g.T,weights*data)
+        else:
+            g = deltaf_f_grid(t,tc_values,np.asarray(nuref)[start:stop])
+            A = np.einsum('tcr,tr->cr',g*g,weights)
+            B = np.einsum('tcr,tr->cr',g,weights*data)
+        C = np.sum(weights*data*data,axis = 0)
+        chi2[:,:,start:stop] = (alpha_values[np.newaxis,:,np.newaxis]**2*A[:,np.newaxis,:]
+                                - 2.*alpha_values[np.newaxis,:,np.newaxis]*B[:,np.newaxis,:] + C[np.newaxis,np.newaxis,:])
+    return chi2
+
+
 def fit_tc_brute(t,df_over_f,nuref,tc_range = (0.5,1.5),alpha_range = (0,1), n_grid_points=100, error=None, plot = True,Verbose = False,**keywords):
     '''
     brute force fitter for fitting Tc and alpha assuming gamma =1
@@ -206,18 +302,7 @@ def fit_tc_brute(t,df_over_f,nuref,tc_range = (0.5,1.5),alpha_range = (0,1), n_g
     alpha_values = np.linspace(alpha_range[0], alpha_range[1], n_grid_points)
     evaluated_ranges = np.vstack((tc_values, alpha_values))
 
-    a, b= np.meshgrid(tc_values, alpha_values, indexing="ij")  # always index ij
-
-    #evaluated = noise_profile_lor_vec(x[index_for_fitting], a, b, c, d)
-    evaluated = deltaf_f_vec(t,a,nuref,b,1)
-    data_values = np.reshape(df_over_f, (df_over_f.shape[0], 1, 1))
-    error = np.reshape(error, (error.shape[0], 1, 1))
-    #print(evaluated.shape)
-    # print(data_values.shape)
-    # print(error.shape)
-    sum_dev = np.sum(((evaluated - data_values) ** 2 / error ** 2),
-                     axis=0)  # comparing in magnitude space rather than magnitude squared
-
+    sum_dev = brute_chi2(t,df_over_f,nuref,tc_values,alpha_values,error)[:,:,0]
 
     min_index = np.where(sum_dev == np.min(sum_dev))
     if Verbose:
@@ -242,3 +327,64 @@ def fit_tc_brute(t,df_over_f,nuref,tc_range = (0.5,1.5),alpha_range = (0,1), n_g
     fit_dict = {'fit_values': fit_values, 'fit_values_names': fit_values_names, 'sum_dev': sum_dev,
                 'fit_result': fit_result,'evaluated_ranges': evaluated_ranges}  #'marginalized_2d':marginalized_2d,'marginalized_1d':marginalized_1d,
     return fit_dict
+
+
+def fit_tc_brute_multi(t,df_over_f,nuref,tc_range = (0.5,1.5),alpha_range = (0,1), n_grid_points=100, error=None,
+                       chunk_size = 256, refine = False, return_grid = False, Verbose = False):
+    '''
+    fit_tc_brute for many resonators at once
+    t is temperature in kelvin (n_T)
+    df_over_f is f-f0/f0 with shape (n_T, n_res), one column per resonator
+    nuref in MHz is either one reference frequency or an array of n_res
+    error is (n_T, n_res) or (n_T,) shared by every resonator
+    the model grid is shared by all of the resonators and the chi square is reduced chunk_size resonators
+    at a time (see brute_chi2)
+    refine = True polishes each grid minimum with curve_fit
+    return_grid = True also returns the (n_tc, n_alpha, n_res) chi square grid as 'sum_dev'
+    '''
+    t = np.asarray(t,dtype = float)
+    df_over_f = np.asarray(df_over_f,dtype = float)
+    if df_over_f.ndim == 1:
+        df_over_f = df_over_f[:,np.newaxis]
+    n_res = df_over_f.shape[1]
+    if error is None:
+        error = np.ones(df_over_f.shape)
+    error = np.broadcast_to(np.reshape(error,(df_over_f.shape[0],-1)),df_over_f.shape)
+    nu = np.broadcast_to(nuref,(n_res,))
+
+    tc_values = np.linspace(tc_range[0], tc_range[1], n_grid_points)
+    alpha_values = np.linspace(alpha_range[0], alpha_range[1], n_grid_points)
+    evaluated_ranges = np.vstack((tc_values, alpha_values))
+
+    sum_dev = brute_chi2(t,df_over_f,nuref,tc_values,alpha_values,error,chunk_size)
+    flat_index = np.argmin(np.reshape(sum_dev,(-1,n_res)),axis = 0)
+    index1, index2 = np.unravel_index(flat_index,sum_dev.shape[0:2])
+    fit_values = np.vstack((tc_values[index1], alpha_values[index2])).T
+    min_chi2 = sum_dev[index1,index2,np.arange(n_res)]
+    if Verbose:
+        print("grid values at minimum are")
+        print(index1,index2)
+
+    if refine:
+        for k in range(0,n_res):
+            fit_fn = lambda t_fit, tc, alpha: deltaf_f(t_fit,tc,nu[k],alpha,1)
+            try:
+                fit = optimization.curve_fit(fit_fn,t,df_over_f[:,k],fit_values[k],sigma = error[:,k],absolute_sigma = True)
+                chi2 = np.sum((fit_fn(t,*fit[0])-df_over_f[:,k])**2/error[:,k]**2)
+                if chi2 < min_chi2[k]:
+                    fit_values[k] = fit[0]
+                    min_chi2[k] = chi2
+            except RuntimeError:
+                if Verbose:
+                    print("refinement failed for resonator "+str(k))
+
+    fit_result = np.empty(df_over_f.shape)
+    for k in range(0,n_res):
+        fit_result[:,k] = deltaf_f(t,fit_values[k,0],nu[k],fit_values[k,1],1)
+
+    fit_values_names = ('tc', 'alpha')
+    fit_dict = {'fit_values': fit_values, 'fit_values_names': fit_values_names, 'min_chi2': min_chi2,
+                'fit_result': fit_result,'evaluated_ranges': evaluated_ranges}
+    if return_grid:
+        fit_dict['sum_dev'] = sum_dev
+    return fit_dict
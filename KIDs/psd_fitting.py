@@ -11,6 +11,9 @@ import matplotlib.pyplot as plt
 
 #Change Log
 #1/9/2017 Added sigma_increase_cutoff and sigma_increase_factor to fit_psd modules
+#10/19/2026 Added psd_mask and fit_psd_lor_multi to fit the psds of all of the channels at once
+#10/19/2026 Added profile keyword to fit_psd_lor_brute to only grid over c and d
+#10/19/2026 Added log_bin_psd and rolling_psd_error to prepare psd matrices for fitting, used by fit_psd_lor
 
 
 # noise profiles
@@ -94,6 +97,73 @@ def std_of_mean(x):
 
     return fit_dict
 
+def log_bin_psd(x, y, n_bins=100, bins=None, mask=None):
+    """
+    log bins the psd like the log keyword of fit_psd_lor, for all of the channels at once
+    x is the psd frequency (n_freq,), y is the psd (n_freq,) or (n_freq, n_channels)
+    bins are the bin edges, by default n_bins logspaced bins from x[0] to x[-1] (bins include their lower edge and
+    the last one its upper edge too, like binned_statistic)
+    mask is the boolean (n_freq,) or (n_freq, n_channels) of the points to use, see psd_mask, nan points are not used
+    the sums are np.add.reduceat over the points sorted by bin, so there is no python loop over bins or channels
+    returns a dictionary with
+        freqs: (n_used_bins,) mean frequency of the points in every bin that has any
+        psd: the mean psd of each bin, same shape as y with n_used_bins rows (nan where a channel has no points)
+        error: the standard error of the mean of each bin (std_of_mean), a bin with one point has an error of its value
+        counts: the number of points in each bin (per channel)
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    is_1d = y.ndim == 1
+    y = y.reshape(len(x), -1)
+    if bins is None:
+        bins = np.logspace(np.log10(x[0]), np.log10(x[-1]), n_bins + 1)
+        # logspace does not reproduce the end points exactly, which would drop the first or last point
+        bins[0], bins[-1] = x[0], x[-1]
+    bins = np.asarray(bins, dtype=float)
+    bin_id = np.searchsorted(bins, x, side='right') - 1
+    bin_id[x == bins[-1]] = len(bins) - 2
+    if mask is None:
+        mask = np.ones(len(x), dtype=bool)
+    mask = np.asarray(mask, dtype=bool).reshape(len(x), -1)
+    use_freq = np.any(mask, axis=1) & (bin_id >= 0) & (bin_id < len(bins) - 1)
+    order = np.flatnonzero(use_freq)[np.argsort(bin_id[use_freq], kind='stable')]
+    bin_id = bin_id[order]
+    if len(order) == 0:
+        # nothing to bin (i.e. everything is masked), reduceat can not take empty starts
+        empty = np.empty((0, y.shape[1]))
+        result = {'freqs': np.empty(0), 'psd': empty, 'error': empty.copy(), 'counts': np.empty((0, y.shape[1]), dtype=int)}
+        if is_1d:
+            result = {key: value[:, 0] if value.ndim == 2 else value for key, value in result.items()}
+        return result
+    starts = np.flatnonzero(np.concatenate(([True], bin_id[1:] != bin_id[:-1])))
+    freqs = np.add.reduceat(x[order], starts) / np.diff(np.append(starts, len(order)))
+
+    use = mask[order] & np.isfinite(y[order])
+    values = np.where(use, y[order], 0.)
+    counts = np.add.reduceat(use, starts, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        psd = np.add.reduceat(values, starts, axis=0) / counts
+        deviation = np.where(use, values - np.repeat(psd, np.diff(np.append(starts, len(order))), axis=0), 0.)
+        error = np.sqrt(np.add.reduceat(deviation ** 2, starts, axis=0) / counts / counts)
+    error = np.where(counts == 1, psd, error)
+    psd = np.where(counts > 0, psd, np.nan)
+    error = np.where(counts > 0, error, np.nan)
+    if is_1d:
+        return {'freqs': freqs, 'psd': psd[:, 0], 'error': error[:, 0], 'counts': counts[:, 0]}
+    return {'freqs': freqs, 'psd': psd, 'error': error, 'counts': counts}
+
+
+def rolling_psd_error(y, std_pts=100):
+    """
+    the error estimate of fit_psd_lor without the log keyword, the standard deviation of each point
+    and the std_pts-1 points after it (wrapping around at the end), along the first axis of y
+    so it works on (n_freq, n_channels) psd matrices
+    """
+    y = np.asarray(y, dtype=float)
+    wrapped = np.take(y, np.arange(y.shape[0] + std_pts - 1) % y.shape[0], axis=0)
+    return np.std(np.lib.stride_tricks.sliding_window_view(wrapped, std_pts, axis=0), axis=-1)
+
+
 def fit_psd_lor(x,y,**keywords):
     '''
     # keywards are
@@ -153,12 +223,10 @@ def fit_psd_lor(x,y,**keywords):
         log = 0
 
     if log == 1:
-        binnedfreq_temp =  binned_statistic(x[index], x[index], bins=bins)[0]
-        binnedvals_temp = binned_statistic(x[index], y[index], bins=bins)[0]
-        binnedvals_std = binned_statistic(x[index], y[index], bins=bins, statistic = std_of_mean)[0]
-        binnedfreq = binnedfreq_temp[~np.isnan(binnedfreq_temp)]
-        binnedvals = binnedvals_temp[~np.isnan(binnedfreq_temp)]
-        binnedstd = binnedvals_std[~np.isnan(binnedfreq_temp)]
+        binned = log_bin_psd(x[index], y[index], bins=bins)
+        binnedfreq = binned['freqs']
+        binnedvals = binned['psd']
+        binnedstd = binned['error']
 
     freqs = x[index]
     vals = y[index]
@@ -167,11 +235,8 @@ def fit_psd_lor(x,y,**keywords):
         # I get an extimate fo the noise by taking the standard deviation of each 10 consective points (will be some error for th last 10 points)
         std_pts = 100 # if this number is to low it seems to bias the fits to the lower side
         low_freq_index = np.where(freqs<sigma_increase_cutoff)
-        temp = np.zeros((vals.shape[0],std_pts))
-        # here I estimate the error by looking at the 100 surronding points and calculated the std      
-        for i in range(0,std_pts):
-            temp[:,i] = np.roll(vals,-i)
-        sigma = np.std(temp,axis = 1)
+        # here I estimate the error by looking at the 100 surronding points and calculated the std
+        sigma = rolling_psd_error(vals, std_pts)
         sigma[low_freq_index] = sigma[low_freq_index]/sigma_increase_factor # artificial pretend the noise at low frequcies is 5 time lower than every where else
         fit = optimization.curve_fit(noise_profile_lor, freqs, vals, x0 , sigma,bounds = bounds)
     else:
@@ -181,7 +246,53 @@ def fit_psd_lor(x,y,**keywords):
     return fit
 
 
-def fit_psd_lor_brute(x, y, n_grid_points=20, error=None, **keywords):
+def profile_psd_lor_grid(x, y, error, ab_ranges, c_values, d_values):
+    """
+    the profiled grid search of fit_psd_lor_brute
+    for noise_profile_lor = a*u + b*v with u = 1/(1+(2 pi x d)^2) and v = x^-c*u, chi squared at every (c, d) is a
+    quadratic in (a, b) and the weighted sums it needs are matrix products of the (n_freq, n_c) and (n_freq, n_d) arrays
+    the best (a, b) in the box ab_ranges = ([a_low, b_low], [a_high, b_high]) is either the unconstrained solution
+    or the best point on one of the 4 edges, all of them are tried on the whole grid at once
+    returns the best (a, b, c, d) and the (n_c, n_d) grid of chi squared
+    """
+    weight = 1. / np.asarray(error, dtype=float) ** 2
+    slope = x[:, np.newaxis] ** -c_values[np.newaxis, :]  # (n_freq, n_c)
+    rolloff = 1. / (1 + (2 * np.pi * x[:, np.newaxis] * d_values[np.newaxis, :]) ** 2.)  # (n_freq, n_d)
+    S_uu = np.dot(weight, rolloff ** 2)[np.newaxis, :]
+    S_uy = np.dot(weight * y, rolloff)[np.newaxis, :]
+    S_uv = np.dot((weight[:, np.newaxis] * slope).T, rolloff ** 2)
+    S_vv = np.dot((weight[:, np.newaxis] * slope ** 2).T, rolloff ** 2)
+    S_vy = np.dot((weight[:, np.newaxis] * y[:, np.newaxis] * slope).T, rolloff)
+    S_yy = np.sum(weight * y ** 2)
+
+    def chi_sq(a, b):
+        return S_yy - 2 * a * S_uy - 2 * b * S_vy + a * a * S_uu + 2 * a * b * S_uv + b * b * S_vv
+
+    (a_low, b_low), (a_high, b_high) = ab_ranges
+    with np.errstate(divide='ignore', invalid='ignore'):
+        det = S_uu * S_vv - S_uv ** 2
+        candidates = [((S_uy * S_vv - S_vy * S_uv) / det, (S_vy * S_uu - S_uy * S_uv) / det)]
+        for a_edge in (a_low, a_high):
+            candidates.append((np.full(det.shape, a_edge), np.clip((S_vy - a_edge * S_uv) / S_vv, b_low, b_high)))
+        for b_edge in (b_low, b_high):
+            candidates.append((np.clip((S_uy - b_edge * S_uv) / S_uu, a_low, a_high), np.full(det.shape, b_edge)))
+    sum_dev = np.full(det.shape, np.inf)
+    best_a = np.zeros(det.shape)
+    best_b = np.zeros(det.shape)
+    for a, b in candidates:
+        inside = (a >= a_low) & (a <= a_high) & (b >= b_low) & (b <= b_high)
+        value = np.where(inside, chi_sq(a, b), np.inf)
+        better = value < sum_dev
+        sum_dev = np.where(better, value, sum_dev)
+        best_a = np.where(better, a, best_a)
+        best_b = np.where(better, b, best_b)
+    i_c, i_d = np.unravel_index(np.argmin(sum_dev), sum_dev.shape)
+    print("grid values at minimum are")
+    print((i_c, i_d))
+    return np.asarray((best_a[i_c, i_d], best_b[i_c, i_d], c_values[i_c], d_values[i_d])), sum_dev
+
+
+def fit_psd_lor_brute(x, y, n_grid_points=20, error=None, profile=False, **keywords):
     """
     brute force fitting (the only way to fit with 4 or less variables)
     x is the psd frequency
@@ -197,6 +308,10 @@ def fit_psd_lor_brute(x, y, n_grid_points=20, error=None, **keywords):
     for example 300points 50^4*(2bytes per float*(2arrays) = 3.5GB of ram
     just watch your resources when you fit if you exceed your ram you will write to disk and the fit will never finish
 
+    profile = True grids only over the nonlinear c and d (n_grid_points^2 cells) and at every cell solves for the best
+    a and b (they enter the model linearly) by weighted linear least squares inside their ranges,
+    so it needs n_grid_points^2 rather than n_grid_points^4 evaluations and memory, sum_dev is then the (c, d) grid
+
     To Do add in marginilaztions for error bars like in the brute force fitter in resonance fitting
     also add in the corner plot for marginalized values
     would be good to add in a nested version of this where it fits again over a smaller paramter space
@@ -211,6 +326,7 @@ def fit_psd_lor_brute(x, y, n_grid_points=20, error=None, **keywords):
 
     if ('ranges' in keywords):
         ranges = keywords['ranges']
+        x0_guess = np.mean(ranges, axis=0)
     else:
         if ('white_freq' in keywords):
             white_freq = keywords['white_freq']
@@ -239,28 +355,32 @@ def fit_psd_lor_brute(x, y, n_grid_points=20, error=None, **keywords):
     d_values = np.linspace(ranges[0][3], ranges[1][3], n_grid_points)
     evaluated_ranges = np.vstack((a_values, b_values, c_values, d_values))
 
-    a, b, c, d = np.meshgrid(a_values, b_values, c_values, d_values, indexing="ij")  # always index ij
-
-    evaluated = noise_profile_lor_vec(x[index_for_fitting], a, b, c, d)
-    data_values = np.reshape(y[index_for_fitting], (y[index_for_fitting].shape[0], 1, 1, 1, 1))
-    error = np.reshape(error, (y[index_for_fitting].shape[0], 1, 1, 1, 1))
-    # print(evaluated.shape)
-    # print(data_values.shape)
-    # print(error.shape)
-    sum_dev = np.sum(((evaluated - data_values) ** 2 / error ** 2),
-                     axis=0)  # comparing in magnitude space rather than magnitude squared
-    # print(sum_dev.shape)
-
-    min_index = np.where(sum_dev == np.min(sum_dev))
-    print("grid values at minimum are")
-    print(min_index)
-    index1 = min_index[0][0]
-    index2 = min_index[1][0]
-    index3 = min_index[2][0]
-    index4 = min_index[3][0]
-    fit_values = np.asarray((a_values[index1], b_values[index2], c_values[index3], d_values[index4]))
+    if profile:
+        fit_values, sum_dev = profile_psd_lor_grid(x[index_for_fitting], y[index_for_fitting], error, np.asarray(ranges)[:, 0:2],
+                                                   c_values, d_values)
+    else:
+        a, b, c, d = np.meshgrid(a_values, b_values, c_values, d_values, indexing="ij")  # always index ij
+
+        evaluated = noise_profile_lor_vec(x[index_for_fitting], a, b, c, d)
+        data_values = np.reshape(y[index_for_fitting], (y[index_for_fitting].shape[0], 1, 1, 1, 1))
+        error = np.reshape(error, (y[index_for_fitting].shape[0], 1, 1, 1, 1))
+        # print(evaluated.shape)
+        # print(data_values.shape)
+        # print(error.shape)
+        sum_dev = np.sum(((evaluated - data_values) ** 2 / error ** 2),
+                         axis=0)  # comparing in magnitude space rather than magnitude squared
+        # print(sum_dev.shape)
+
+        min_index = np.where(sum_dev == np.min(sum_dev))
+        print("grid values at minimum are")
+        print(min_index)
+        index1 = min_index[0][0]
+        index2 = min_index[1][0]
+        index3 = min_index[2][0]
+        index4 = min_index[3][0]
+        fit_values = np.asarray((a_values[index1], b_values[index2], c_values[index3], d_values[index4]))
     fit_values_names = ('a (white)', 'b (1/f)', 'c (1/f exponent)', 'd (tau)')
-    fit_result = noise_profile_lor(x, a_values[index1], b_values[index2], c_values[index3], d_values[index4])
+    fit_result = noise_profile_lor(x, fit_values[0], fit_values[1], fit_values[2], fit_values[3])
     x0_guess_result = noise_profile_lor(x, x0_guess[0], x0_guess[1], x0_guess[2], x0_guess[3])
     noise_slope_result = noise_slope(x, fit_values[1], fit_values[2])
     fine_freqs = np.logspace(np.log10(freq_range[0]), np.log10(freq_range[1]), 10000)
@@ -447,3 +567,164 @@ def fit_psd(x,y,plot = False,**keywords):
 
     return fit
 
+
+def psd_mask(x, use_range=None, harmonic=None, harmonic_width=3.):
+    """
+    boolean mask of the psd frequencies x to fit
+    use_range is an n length tuple of frequencies to use like fit_psd_lor i.e. [[1,57],[63,117],[123,177]]
+    harmonic = 60 (i.e.) Hz masks +-harmonic_width/2 around every multiple of harmonic (mains pickup)
+    """
+    x = np.asarray(x)
+    if use_range is None:
+        mask = np.ones(x.shape, dtype=bool)
+    else:
+        mask = np.zeros(x.shape, dtype=bool)
+        for low, high in use_range:
+            mask |= (x > low) & (x < high)
+    if harmonic is not None:
+        n_harmonic = np.round(x / harmonic)
+        mask &= ~((n_harmonic > 0) & (np.abs(x - n_harmonic * harmonic) <= harmonic_width / 2.))
+    return mask
+
+
+def noise_profile_lor_jac(y, a, b, c, d):
+    """
+    noise_profile_lor and its derivatives with respect to (log(a), log(b), c, log(d))
+    y is (n_freq,) and the parameters are (n_channels,1) to evaluate every channel at once
+    returns the model (n_channels, n_freq) and the jacobian (n_channels, n_freq, 4)
+    """
+    slope = b * y ** -c
+    rolloff = 1 + (2 * np.pi * y * d) ** 2.
+    model = (a + slope) / rolloff
+    jac = np.stack((a / rolloff,
+                    slope / rolloff,
+                    -slope * np.log(y) / rolloff,
+                    -2 * model * (rolloff - 1) / rolloff), axis=-1)
+    return model, jac
+
+
+def guess_psd_lor(x, y, mask, white_freq=None):
+    """
+    initial guesses (n_channels, 4) for fit_psd_lor_multi like the ones of fit_psd_lor_brute
+    white noise near white_freq (the middle of the fit range by default), 1/f at the lowest frequency,
+    an index of 1 and the roll off where the psd drops 3 dB below the white noise
+    """
+    index = np.flatnonzero(np.any(mask, axis=1))
+    if white_freq is None:
+        white_index = index[len(index) // 2]
+    else:
+        white_index = index[np.argmin(np.abs(x[index] - white_freq))]
+    near_white = slice(max(white_index - 5, 0), white_index + 6)
+    white_guess = np.nanmedian(np.where(mask, y, np.nan)[near_white], axis=0)
+    first = np.argmax(mask, axis=0)
+    y_first = y[first, np.arange(y.shape[1])]
+    slope_guess = np.maximum(y_first - white_guess, white_guess * 1e-3) * x[first]
+    # 3dB decrease from white noise guess above the white noise frequency, or well above the data if it never drops
+    below = mask & (y < white_guess / 2.) & (np.arange(len(x)) > white_index)[:, np.newaxis]
+    f_3db = np.where(np.any(below, axis=0), x[np.argmax(below, axis=0)], 10 * x[index[-1]])
+    return np.stack((white_guess, slope_guess, np.ones(y.shape[1]), 1. / 2 / np.pi / f_3db), axis=-1)
+
+
+def fit_psd_lor_multi(x, y, sigma=None, mask=None, x0=None, white_freq=None, c_range=(0., 3.), max_iter=100,
+                      tol=1e-8):
+    """
+    fits noise_profile_lor (white + 1/f^c with a lorentzian roll off) to all of the channels at once
+    x is the psd frequency (n_freq,)
+    y is the psd magnitude (n_freq, n_channels) i.e. the psd matrices from noise_multi
+    sigma is the error of y, a scalar, (n_freq,) or (n_freq, n_channels) like mask, None weights every point
+        equally like curve_fit
+    mask is the boolean (n_freq,) or (n_freq, n_channels) of the points to fit, see psd_mask for 60 Hz harmonics,
+        nan points are always left out
+    x0 is the initial guess (4,) or (n_channels, 4), by default guess_psd_lor
+    the fit is a Levenberg-Marquardt least squares on (log(a), log(b), c, log(d)) with analytic derivatives,
+    every iteration is a single vectorized evaluation for all of the channels and a stack of 4x4 solves,
+    so a, b and d stay positive, c is kept in c_range
+    the errors are from the covariance scaled by the reduced chi squared like curve_fit
+    returns a dictionary with
+        fit_values (n_channels, 4) a, b, c, d and fit_values_names
+        fit_errors (n_channels, 4) and covariance (n_channels, 4, 4)
+        knee (n_channels,) the frequency where the 1/f noise equals the white noise (b/a)**(1/c)
+        chi_sq, red_chi_sq, converged (n_channels,) and fit_result (n_freq, n_channels)
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.atleast_2d(np.asarray(y, dtype=float).T).T
+    n_channels = y.shape[1]
+    if mask is None:
+        mask = np.ones(y.shape, dtype=bool)
+    mask = np.broadcast_to(np.asarray(mask, dtype=bool).reshape(len(x), -1), y.shape)
+    mask = mask & np.isfinite(y) & (x > 0)[:, np.newaxis]
+    if sigma is None:
+        sigma = 1.
+    sigma = np.asarray(sigma, dtype=float)
+    if sigma.ndim > 0:
+        sigma = sigma.reshape(len(x), -1)
+    weights = np.where(mask, 1. / np.broadcast_to(sigma, y.shape) ** 2, 0.).T  # (n_channels, n_freq)
+    data = np.where(mask, y, 0.).T
+    x_fit = np.where(x > 0, x, 1.)
+    # channels without enough points to fit are left as nan
+    n_points = np.sum(mask, axis=0)
+    good = n_points > 4
+    if x0 is None:
+        x0 = np.ones((n_channels, 4))
+        if np.any(good):
+            x0[good] = guess_psd_lor(x, y[:, good], mask[:, good], white_freq)
+    x0 = np.where(good[:, np.newaxis], np.broadcast_to(np.asarray(x0, dtype=float), (n_channels, 4)), 1.)
+    params = np.stack((np.log(x0[:, 0]), np.log(x0[:, 1]), np.clip(x0[:, 2], *c_range), np.log(x0[:, 3])), axis=-1)
+    max_step = np.array([1., 1., 0.5, 1.])
+
+    def evaluate(params):
+        values = np.exp(params)
+        return noise_profile_lor_jac(x_fit, values[:, 0:1], values[:, 1:2], params[:, 2:3], values[:, 3:4])
+
+    model, jac = evaluate(params)
+    chi_sq = np.sum(weights * (data - model) ** 2, axis=1)
+    lam = np.full(n_channels, 1e-3)
+    active = good.copy()
+    converged = np.zeros(n_channels, dtype=bool)
+    for i in range(0, max_iter):
+        if not np.any(active):
+            break
+        w = weights[active]
+        j = jac[active]
+        jtj = np.einsum('cni,cn,cnj->cij', j, w, j)
+        gradient = np.einsum('cni,cn->ci', j, w * (data[active] - model[active]))
+        damped = jtj + lam[active, np.newaxis, np.newaxis] * jtj * np.eye(4)
+        step = np.einsum('cij,cj->ci', np.linalg.pinv(damped), gradient)
+        # at most a factor of e in a, b, d and 0.5 in c per step so a bad start can not run away
+        trial = params[active] + np.clip(step, -max_step, max_step)
+        trial[:, 2] = np.clip(trial[:, 2], *c_range)
+        with np.errstate(over='ignore', invalid='ignore'):
+            trial_model, trial_jac = evaluate(trial)
+            trial_chi_sq = np.sum(w * (data[active] - trial_model) ** 2, axis=1)
+        trial_chi_sq[~np.isfinite(trial_chi_sq)] = np.inf
+        better = trial_chi_sq < chi_sq[active]
+        small = np.abs(chi_sq[active] - trial_chi_sq) <= tol * chi_sq[active]
+        index = np.flatnonzero(active)
+        accept = index[better]
+        params[accept] = trial[better]
+        model[accept] = trial_model[better]
+        jac[accept] = trial_jac[better]
+        chi_sq[accept] = trial_chi_sq[better]
+        lam[index] = np.where(better, lam[index] / 10., lam[index] * 10.)
+        done = index[(better & small) | (lam[index] > 1e10)]
+        converged[done] = True
+        active[done] = False
+
+    values = np.exp(params)
+    values[:, 2] = params[:, 2]
+    values[~good] = np.nan
+    chi_sq[~good] = np.nan
+    red_chi_sq = chi_sq / np.maximum(n_points - 4, 1)
+    jtj = np.einsum('cni,cn,cnj->cij', jac, weights, jac)
+    # back to a, b, c, d from the log parameters
+    scale = values.copy()
+    scale[:, 2] = 1.
+    jtj[~good] = np.eye(4)
+    covariance = np.linalg.pinv(jtj) * scale[:, :, np.newaxis] * scale[:, np.newaxis, :] \
+        * red_chi_sq[:, np.newaxis, np.newaxis]
+    fit_values_names = ('a (white)', 'b (1/f)', 'c (1/f exponent)', 'd (tau)')
+    knee = (values[:, 1] / values[:, 0]) ** (1. / values[:, 2])
+    fit_result = noise_profile_lor(x_fit[:, np.newaxis], values[:, 0], values[:, 1], values[:, 2], values[:, 3])
+    return {'fit_values': values, 'fit_values_names': fit_values_names,
+            'fit_errors': np.sqrt(np.abs(np.diagonal(covariance, axis1=1, axis2=2))), 'covariance': covariance,
+            'knee': knee, 'chi_sq': chi_sq, 'red_chi_sq': red_chi_sq, 'converged': converged, 'fit_result': fit_result}
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+"""Fixed order double exponential (tanh-sinh and exp-sinh) quadrature rules
+for the superconductor models. The nodes and weights are generated once and
+the integrand is evaluated on all of them in a single vectorized call, which
+replaces scipy.integrate.quad and its thousands of scalar Python callbacks.
+Double exponential rules converge quickly even with the inverse square root
+singularities at the gap edge, as long as the singularities are at the ends of
+the intervals, so split the integrals at them.
+"""
+
+import numpy as np
+
+
+def tanh_sinh(a, b, h=1. / 16., t_max=3.5):
+    """Nodes and weights for integrating over the finite interval [a, b]
+
+    the nodes are placed by their distance from the closest end point and the
+    ones that still round onto an end point are dropped, so a singular end point
+    is never evaluated
+    """
+    t = np.arange(-t_max, t_max + 0.5 * h, h)
+    u = 0.5 * np.pi * np.sinh(t)
+    #1 - |x| calculated directly to not lose it to rounding
+    complement = 1. / (np.exp(np.abs(u)) * np.cosh(u))
+    weights = h * 0.5 * np.pi * np.cosh(t) / np.cosh(u)**2
+    half = 0.5 * (b - a)
+    nodes = np.where(t < 0., a + half * complement, b - half * complement)
+    keep = (nodes > a) & (nodes < b) & (weights > 0.)
+    return nodes[keep], half * weights[keep]
+
+
+def exp_sinh(a, h=1. / 16., t_min=-4., t_max=4.):
+    """Nodes and weights for integrating over the semi-infinite interval
+    [a, inf), good for integrands that decay algebraically or faster
+    """
+    t = np.arange(t_min, t_max + 0.5 * h, h)
+    u = np.exp(0.5 * np.pi * np.sinh(t))
+    weights = h * 0.5 * np.pi * np.cosh(t) * u
+    nodes = a + u
+    keep = (nodes > a) & np.isfinite(nodes) & np.isfinite(weights)
+    return nodes[keep], weights[keep]
+
+
+def interval_rule(a, b, breakpoints=(), h=1. / 16.):
+    """Nodes and weights for [a, b] (a can be -np.inf and b np.inf) split at the breakpoints
+    that fall inside the interval, which should be where the integrand is
+    singular or has a kink
+    """
+    edges = [a] + sorted(p for p in breakpoints if a < p < b) + [b]
+    nodes = []
+    weights = []
+    for low, high in zip(edges[:-1], edges[1:]):
+        if np.isinf(low) and np.isinf(high):
+            #only happens without breakpoints, split at 0
+            x, w = interval_rule(low, high, (0.,), h=h)
+        elif np.isinf(low):
+            x, w = exp_sinh(-high, h=h)
+            x = -x
+        elif np.isinf(high):
+            x, w = exp_sinh(low, h=h)
+        else:
+            x, w = tanh_sinh(low, high, h=h)
+        nodes.append(x)
+        weights.append(w)
+    return np.concatenate(nodes), np.concatenate(weights)
+
+
+def integrate(fn, a, b, breakpoints=(), h=1. / 16.):
+    """Integrates fn from a to b with one call of fn on an array of energies
+    like quad, b < a gives minus the integral from b to a
+    """
+    if b < a:
+        return -integrate(fn, b, a, breakpoints, h=h)
+    nodes, weights = interval_rule(a, b, breakpoints, h=h)
+    return np.sum(weights * fn(nodes), axis=-1)
+
+
+def integrate_batch(fn, a, b, breakpoints=None, h=1. / 16.,
+        chunk_size=2**16):
+    """Integrates over a batch of intervals [a[i], b[i]], each with its own
+    breakpoints[i], with as few calls of fn as possible. All of the nodes
+    (up to chunk_size of them per call) are passed together as
+    fn(E, index), where index is the interval each node belongs to, so the
+    integrand can pick out the parameters of that interval with
+    parameter[index]. Returns the array of integrals.
+    """
+    a = np.atleast_1d(np.asarray(a, dtype=float))
+    b = np.atleast_1d(np.asarray(b, dtype=float))
+    if breakpoints is None:
+        a, b = np.broadcast_arrays(a, b)
+        breakpoints = [()] * a.size
+    else:
+        #scalar limits are shared by all of the intervals
+        a, b, _ = np.broadcast_arrays(a, b, np.empty(len(breakpoints)))
+    sign = np.where(b < a, -1., 1.)
+    rules = [interval_rule(low, high, points, h=h) for low, high, points in
+            zip(np.minimum(a, b), np.maximum(a, b), breakpoints)]
+    sizes = np.array([len(nodes) for nodes, weights in rules])
+    results = np.zeros(a.size)
+    start = 0
+    while start < a.size:
+        stop = start + 1
+        N_nodes = sizes[start]
+        while stop < a.size and N_nodes + sizes[stop] <= chunk_size:
+            N_nodes += sizes[stop]
+            stop += 1
+        nodes = np.concatenate([rule[0] for rule in rules[start:stop]])
+        weights = np.concatenate([rule[1] for rule in rules[start:stop]])
+        index = np.repeat(np.arange(start, stop), sizes[start:stop])
+        results[start:stop] = np.bincount(index - start,
+                weights * fn(nodes, index), minlength=stop - start)
+        start = stop
+    return sign * results
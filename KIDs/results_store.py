@@ -0,0 +1,126 @@
+import numpy as np
+import json
+import pickle
+try:
+    import h5py
+except:
+    print("This function requires h5py to run")
+
+# this is code for saving the result dictionaries (cal_dict, psd_dict ...) of the
+# calibration and noise codes so that single arrays or single channels can be loaded
+# back without unpickling everything
+
+# every array in the dictionary becomes its own chunked hdf5 dataset
+# 2d arrays are chunked by column (channel) so store['stream_df_over_f'][:,k] only reads channel k
+# a json index of key -> shape, dtype is kept in the root attributes so you can see
+# what is in the file without touching the data
+
+# Please note the date and details of any changes
+# Change log
+# 2026-10-19 - written to replace pickle.dump of cal.p and psd.p
+
+
+def _chunk_shape(shape, chunk_size=2**17):
+    # chunk_size is the target number of elements in a chunk
+    if len(shape) == 0 or 0 in shape:
+        return None
+    if len(shape) == 1:
+        return (min(shape[0], chunk_size),)
+    rows = min(shape[0], chunk_size)
+    cols = max(1, min(shape[1], chunk_size//rows))
+    return (rows, cols) + tuple(shape[2:])
+
+
+def save_results(filename, dictionary, compression='gzip', compression_opts=4):
+    """saves a dictionary of arrays as an indexed hdf5 results store
+       inputs:
+           char filename: output file i.e. cal.h5
+           dict dictionary: the results dictionary, values can be arrays, lists, scalars, strings or None
+           compression: hdf5 compression filter ('gzip', 'lzf' or None for uncompressed)"""
+    index = {}
+    with h5py.File(filename, 'w') as f:
+        for key, value in dictionary.items():
+            if value is None:
+                index[key] = {'type': 'none'}
+            elif isinstance(value, str) or np.isscalar(value):
+                f.attrs[key] = value
+                index[key] = {'type': 'scalar'}
+            else:
+                data = np.asarray(value)
+                chunks = _chunk_shape(data.shape)
+                if chunks is None:
+                    f.create_dataset(key, data=data)
+                else:
+                    f.create_dataset(key, data=data, chunks=chunks, compression=compression,
+                                     compression_opts=compression_opts if compression == 'gzip' else None,
+                                     shuffle=compression is not None)
+                index[key] = {'type': 'array', 'shape': list(data.shape), 'dtype': data.dtype.str}
+        f.attrs['index'] = json.dumps(index)
+
+
+def save_dict(dictionary, filename, save_format="h5"):
+    # filename without extension, save_format is "h5" (results store) or "pickle" (the old .p files)
+    if save_format == "h5":
+        save_results(filename+".h5", dictionary)
+    elif save_format == "pickle":
+        with open(filename+".p", "wb") as f:
+            pickle.dump(dictionary, f, 2)
+    else:
+        raise ValueError("save_format must be \"h5\" or \"pickle\" not "+str(save_format))
+
+
+class ResultsStore(object):
+    """lazy view of a results store written by save_results
+       store['key'] returns the hdf5 dataset so slicing it only reads what you ask for
+       i.e.
+       with ResultsStore("cal.h5") as store:
+           df_over_f = store['stream_df_over_f'][:,k]"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = h5py.File(filename, 'r')
+        self.index = json.loads(self.file.attrs['index'])
+
+    def keys(self):
+        return self.index.keys()
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __getitem__(self, key):
+        kind = self.index[key]['type']
+        if kind == 'none':
+            return None
+        if kind == 'scalar':
+            return self.file.attrs[key]
+        return self.file[key]
+
+    def load(self, key):
+        # read a whole entry into memory
+        value = self[key]
+        if isinstance(value, h5py.Dataset):
+            return value[()]
+        return value
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def load_results(filename, keys=None):
+    # load (some of) a results store into a dictionary like pickle.load would
+    with ResultsStore(filename) as store:
+        if keys is None:
+            keys = store.keys()
+        return {key: store.load(key) for key in keys}
+
+
+def load_channel(filename, key, k):
+    # load just column k of one of the 2d results i.e. load_channel("cal.h5",'stream_df_over_f',k)
+    with ResultsStore(filename) as store:
+        return store[key][:, k]
@@ -0,0 +1,213 @@
+import numpy as np
+import scipy.optimize as optimization
+from KIDs import disordered_model
+from KIDs import dynes_model
+
+# this is code for fitting resonator frequency and Qi versus bath temperature sweeps
+# with the superconductor models in disordered_model (AG model) and dynes_model
+# the noise_theory fitters (fit_tls, fit_tc_brute) use the simple Mattis-Bardeen approximations
+
+# f0(T) = f00 * (1 + alpha_k/2 * (sigma2(T)/sigma2(T=0) - 1))
+# Qi(T) = 1 / (alpha_k * sigma1(T)/|sigma2(T)| + Qi0_inv)
+# alpha_k is the kinetic inductance fraction and Qi0_inv is the temperature independent loss
+
+# temperatures are in K and Delta0, gamma (dynes) and T_c, alpha (disordered) are in K as well
+# nu is the resonator frequency in Hz that sets h_nu, it only needs to be close
+
+# every model evaluation is a single call of the array versions of the conductivity integrals
+# (calc_sigma1_grid / calc_sigma2_grid) and the jacobian is a single batched call for all of the
+# perturbed parameters, the disordered model uses the cached gap tables (load_delta_table)
+
+# Please note the date and details of any changes
+# Change log
+# 2026-10-19 - written
+# 2026-10-19 - default disordered model bounds keep alpha / T_c inside the delta table
+
+
+def h_nu_kelvin(nu):
+    # photon energy in K for nu in Hz
+    return dynes_model.h * np.asarray(nu) / dynes_model.k_B
+
+
+def f0_curve_dynes(T, Delta0, gamma, nu):
+    # sigma2(T)/sigma2(T=0), Delta0 and gamma can be arrays of shape (n,1) to get n curves
+    kT = np.concatenate(([0.], np.asarray(T, dtype=float)))
+    sigma2 = dynes_model.sigma2_fit_fn(kT, Delta0, h_nu_kelvin(nu), gamma)
+    return sigma2[..., 1:] / sigma2[..., :1]
+
+
+def Qi_curve_dynes(T, Delta0, gamma, nu):
+    # sigma1(T)/|sigma2(T)|
+    return np.abs(1. / dynes_model.thermal_Qi(np.asarray(T, dtype=float), Delta0, h_nu_kelvin(nu), gamma))
+
+
+def f0_curve_disordered(T, T_c, alpha, nu, delta_table=None):
+    T = np.concatenate(([0.], np.asarray(T, dtype=float)))
+    deltas = disordered_model.calc_delta_curve(T, T_c, alpha, delta_table)
+    sigma2 = disordered_model.calc_sigma2_grid(T, deltas, h_nu_kelvin(nu), alpha)
+    return sigma2[..., 1:] / sigma2[..., :1]
+
+
+def Qi_curve_disordered(T, T_c, alpha, nu, delta_table=None):
+    sigma1, sigma2 = disordered_model.calc_sigma_curve(np.asarray(T, dtype=float), T_c, alpha,
+                                                       h_nu_kelvin(nu), delta_table)
+    return sigma1 / np.abs(sigma2)
+
+
+def f0_from_curve(curve, f00, alpha_k):
+    return f00 * (1. + 0.5 * alpha_k * (curve - 1.))
+
+
+def Qi_from_curve(curve, alpha_k, Qi0_inv):
+    return 1. / (alpha_k * curve + Qi0_inv)
+
+
+def fit_sweep(curve_fn, combine_fn, T, y, x0, n_shape, sigma=None, bounds=(-np.inf, np.inf), rel_step=1e-4):
+    '''
+    least squares fit of y(T) = combine_fn(curve_fn(T, *shape_params), *linear_params)
+    the parameters are x0 = shape_params + linear_params where the first n_shape are passed to curve_fn
+    (the expensive physics) and the rest only to combine_fn
+    the jacobian is a forward difference, all of the perturbed shape parameters are evaluated
+    in one call of curve_fn with parameter arrays of shape (n_shape+1,1) and the linear parameters
+    reuse the unperturbed curve
+    returns popt, pcov like curve_fit
+    '''
+    x0 = np.asarray(x0, dtype=float)
+    lower, upper = [np.broadcast_to(np.asarray(b, dtype=float), x0.shape) for b in bounds]
+    last = {}
+
+    def curves(params):
+        # params is (n_sets, n_params), returns (n_sets, n_T)
+        return curve_fn(T, *[params[:, i:i + 1] for i in range(n_shape)])
+
+    def model(T_unused, *p):
+        key = tuple(p)
+        if key not in last:
+            last.clear()
+            last[key] = curves(np.asarray([p]))[0]
+        return combine_fn(last[key], *p[n_shape:])
+
+    def jac(T_unused, *p):
+        p = np.asarray(p)
+        steps = rel_step * np.where(p != 0., np.abs(p), 1.)
+        steps = np.where(p + steps > upper, -steps, steps)  # step down at an upper bound
+        params = p + np.vstack((np.zeros(len(p)), np.diag(steps)[0:n_shape]))
+        curve_vals = curves(params)
+        last.clear()
+        last[tuple(p)] = curve_vals[0]
+        y_center = combine_fn(curve_vals[0], *p[n_shape:])
+        jacobian = np.empty((len(y_center), len(p)))
+        for i in range(len(p)):
+            if i < n_shape:
+                y_step = combine_fn(curve_vals[i + 1], *p[n_shape:])
+            else:
+                linear = p[n_shape:].copy()
+                linear[i - n_shape] += steps[i]
+                y_step = combine_fn(curve_vals[0], *linear)
+            jacobian[:, i] = (y_step - y_center) / steps[i]
+        return jacobian
+
+    return optimization.curve_fit(model, T, y, x0, sigma=sigma, absolute_sigma=sigma is not None,
+                                  bounds=(lower, upper), jac=jac)
+
+
+def _disordered_bounds(T_c0, delta_table, linear_upper):
+    # T_c between 1/10 and 10 times the guess and alpha inside the alpha / T_c range of the
+    # delta table at the guessed T_c (usadel_roots divides by alpha, so alpha > 0)
+    alpha_low = delta_table.alpha_vals[0] * T_c0
+    alpha_high = delta_table.alpha_vals[-1] * T_c0
+    return ((0.1 * T_c0, alpha_low, 0., 0.), (10. * T_c0, alpha_high) + linear_upper)
+
+
+def _fit_dict(popt, pcov, names, fit_result):
+    return {'fit_values': popt, 'fit_values_names': names, 'fit_errors': np.sqrt(np.diag(pcov)),
+            'covariance': pcov, 'fit_result': fit_result}
+
+
+def fit_f0_dynes(T, f, nu=None, sigma=None, x0=None, bounds=None):
+    '''
+    fits f0(T) with the Dynes model
+    T is temperature in K, f is the resonator frequency in any units (f00 is fit in the same units)
+    nu is the resonator frequency in Hz, defaults to f[0] (i.e. f in Hz)
+    x0 = (Delta0, gamma, f00, alpha_k) defaults to (1.764 K, 0.01 K, f at the lowest T, 0.5)
+    Delta0 and gamma are in K
+    '''
+    T = np.asarray(T, dtype=float)
+    f = np.asarray(f, dtype=float)
+    if nu is None:
+        nu = f[0]
+    if x0 is None:
+        x0 = (1.764, 0.01, f[np.argmin(T)], 0.5)
+    if bounds is None:
+        bounds = ((0., 0., 0., 0.), (np.inf, np.inf, np.inf, 1.))
+    curve_fn = lambda T, Delta0, gamma: f0_curve_dynes(T, Delta0, gamma, nu)
+    popt, pcov = fit_sweep(curve_fn, f0_from_curve, T, f, x0, 2, sigma, bounds)
+    fit_result = f0_from_curve(curve_fn(T, *popt[0:2]), *popt[2:])
+    return _fit_dict(popt, pcov, ('Delta0', 'gamma', 'f00', 'alpha_k'), fit_result)
+
+
+def fit_Qi_dynes(T, Qi, nu, sigma=None, x0=None, bounds=None):
+    '''
+    fits Qi(T) with the Dynes model
+    T is temperature in K, nu is the resonator frequency in Hz
+    x0 = (Delta0, gamma, alpha_k, Qi0_inv) defaults to (1.764 K, 0.01 K, 0.5, 1/max(Qi))
+    '''
+    T = np.asarray(T, dtype=float)
+    Qi = np.asarray(Qi, dtype=float)
+    if x0 is None:
+        x0 = (1.764, 0.01, 0.5, 1. / np.max(Qi))
+    if bounds is None:
+        bounds = ((0., 0., 0., 0.), (np.inf, np.inf, 1., np.inf))
+    curve_fn = lambda T, Delta0, gamma: Qi_curve_dynes(T, Delta0, gamma, nu)
+    popt, pcov = fit_sweep(curve_fn, Qi_from_curve, T, Qi, x0, 2, sigma, bounds)
+    fit_result = Qi_from_curve(curve_fn(T, *popt[0:2]), *popt[2:])
+    return _fit_dict(popt, pcov, ('Delta0', 'gamma', 'alpha_k', 'Qi0_inv'), fit_result)
+
+
+def fit_f0_disordered(T, f, nu=None, sigma=None, x0=None, bounds=None, delta_table=None):
+    '''
+    fits f0(T) with the disordered (AG) model
+    T is temperature in K, f is the resonator frequency in any units (f00 is fit in the same units)
+    nu is the resonator frequency in Hz, defaults to f[0] (i.e. f in Hz)
+    x0 = (T_c, alpha, f00, alpha_k) defaults to (1 K, 0.01 K, f at the lowest T, 0.5)
+    bounds default to T_c within a factor of 10 of x0 and alpha / T_c(x0) within the delta table
+    delta_table defaults to disordered_model.load_delta_table(), the first call ever builds
+    that table and the T_c inversion table (many minutes, cached in ~/.cache after that)
+    '''
+    T = np.asarray(T, dtype=float)
+    f = np.asarray(f, dtype=float)
+    if nu is None:
+        nu = f[0]
+    if delta_table is None:
+        delta_table = disordered_model.load_delta_table()
+    if x0 is None:
+        x0 = (1., 0.01, f[np.argmin(T)], 0.5)
+    if bounds is None:
+        bounds = _disordered_bounds(x0[0], delta_table, (np.inf, 1.))
+    curve_fn = lambda T, T_c, alpha: f0_curve_disordered(T, T_c, alpha, nu, delta_table)
+    popt, pcov = fit_sweep(curve_fn, f0_from_curve, T, f, x0, 2, sigma, bounds)
+    fit_result = f0_from_curve(curve_fn(T, *popt[0:2]), *popt[2:])
+    return _fit_dict(popt, pcov, ('T_c', 'alpha', 'f00', 'alpha_k'), fit_result)
+
+
+def fit_Qi_disordered(T, Qi, nu, sigma=None, x0=None, bounds=None, delta_table=None):
+    '''
+    fits Qi(T) with the disordered (AG) model
+    T is temperature in K, nu is the resonator frequency in Hz
+    x0 = (T_c, alpha, alpha_k, Qi0_inv) defaults to (1 K, 0.01 K, 0.5, 1/max(Qi))
+    bounds default to T_c within a factor of 10 of x0 and alpha / T_c(x0) within the delta table
+    delta_table defaults to disordered_model.load_delta_table(), the first call ever builds
+    that table and the T_c inversion table (many minutes, cached in ~/.cache after that)
+    '''
+    T = np.asarray(T, dtype=float)
+    Qi = np.asarray(Qi, dtype=float)
+    if delta_table is None:
+        delta_table = disordered_model.load_delta_table()
+    if x0 is None:
+        x0 = (1., 0.01, 0.5, 1. / np.max(Qi))
+    if bounds is None:
+        bounds = _disordered_bounds(x0[0], delta_table, (1., np.inf))
+    curve_fn = lambda T, T_c, alpha: Qi_curve_disordered(T, T_c, alpha, nu, delta_table)
+    popt, pcov = fit_sweep(curve_fn, Qi_from_curve, T, Qi, x0, 2, sigma, bounds)
+    fit_result = Qi_from_curve(curve_fn(T, *popt[0:2]), *popt[2:])
+    return _fit_dict(popt, pcov, ('T_c', 'alpha', 'alpha_k', 'Qi0_inv'), fit_result)
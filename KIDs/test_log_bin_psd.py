@@ -0,0 +1,22 @@
+import numpy as np
+from KIDs import psd_fitting
+
+
+def test_log_bin_psd_uses_every_point():
+    # the default bin edges have to include the first and last frequency of the psd
+    for n in (1000, 4096, 12345):
+        x = np.fft.rfftfreq(n, 1e-3)[1:]
+        y = np.random.default_rng(n).random((len(x), 3))
+        for n_bins in (10, 37, 100):
+            binned = psd_fitting.log_bin_psd(x, y, n_bins=n_bins)
+            assert np.all(binned['counts'].sum(axis=0) == len(x))
+
+
+def test_log_bin_psd_all_masked():
+    x = np.fft.rfftfreq(1000, 1e-3)[1:]
+    y = np.ones((len(x), 2))
+    binned = psd_fitting.log_bin_psd(x, y, mask=np.zeros(len(x), dtype=bool))
+    assert binned['freqs'].shape == (0,)
+    assert binned['psd'].shape == (0, 2)
+    binned = psd_fitting.log_bin_psd(x, y[:, 0], mask=np.zeros(len(x), dtype=bool))
+    assert binned['psd'].shape == (0,)
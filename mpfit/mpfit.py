@@ -285,9 +285,9 @@ Perform Levenberg-Marquardt least-squares minimization, based on MINPACK-1.
          p[4]*log(x))
    fa = {'x':x, 'y':y, 'err':err}
    m = mpfit('myfunct', p0, functkw=fa)
-   print 'status = ', m.status
-   if (m.status <= 0): print 'error message = ', m.errmsg
-   print 'parameters = ', m.params
+   print('status = ', m.status)
+   if (m.status <= 0): print('error message = ', m.errmsg)
+   print('parameters = ', m.params)
 
    Minimizes sum of squares of MYFUNCT.  MYFUNCT is called with the X,
    Y, and ERR keyword parameters that are given by FUNCTKW.  The
@@ -406,11 +406,13 @@ Perform Levenberg-Marquardt least-squares minimization, based on MINPACK-1.
    Translated from MPFIT (Craig Markwardt's IDL package) to Python,
    August, 2002.  Mark Rivers
    Converted from Numeric to numpy (Sergey Koposov, July 2008)
+   Converted to Python 3, LAPACK factorizations and a batched FDJAC2
+   for vectorized user functions, October 2026
 """
 
 import numpy
-import types
-import scipy.lib.blas
+import scipy.linalg
+import scipy.linalg.blas
 
 #    Original FORTRAN documentation
 #    **********
@@ -596,8 +598,8 @@ import scipy.lib.blas
 
 class mpfit:
 
-    blas_enorm32, = scipy.lib.blas.get_blas_funcs(['nrm2'],numpy.array([0],dtype=numpy.float32))
-    blas_enorm64, = scipy.lib.blas.get_blas_funcs(['nrm2'],numpy.array([0],dtype=numpy.float64))
+    blas_enorm32, = scipy.linalg.blas.get_blas_funcs(['nrm2'],numpy.array([0],dtype=numpy.float32))
+    blas_enorm64, = scipy.linalg.blas.get_blas_funcs(['nrm2'],numpy.array([0],dtype=numpy.float64))
 
 
     def __init__(self, fcn, xall=None, functkw={}, parinfo=None,
@@ -605,7 +607,7 @@ class mpfit:
                  damp=0., maxiter=200, factor=100., nprint=1,
                  iterfunct='default', iterkw={}, nocovar=0,
                  rescale=0, autoderivative=1, quiet=0,
-                 diag=None, epsfcn=None, debug=0):
+                 diag=None, epsfcn=None, debug=0, vectorized=0):
         """
   Inputs:
     fcn:
@@ -749,6 +751,16 @@ class mpfit:
         desired in the approximate solution.
         Default: 1E-10
 
+     vectorized:
+        Set this keyword if fcn can evaluate several parameter sets in one
+        call.  fcn is then also called with p as a 2D array of shape
+        (nsets, npar), one parameter set per row, and should return the
+        status and an (nsets, m) array of deviations.  The finite difference
+        jacobian is computed with a single such call instead of one call per
+        free parameter (two for two-sided derivatives).  Tied parameters are
+        applied to every row.
+        Default: clear (=0)  fcn is only called with 1D parameter arrays
+
    Outputs:
 
      Returns an object of type mpfit.  The results are attributes of this class,
@@ -850,6 +862,7 @@ class mpfit:
         self.errmsg = ''
         self.nfev = 0
         self.damp = damp
+        self.vectorized = vectorized
         self.dof=0
 
         if fcn==None:
@@ -874,11 +887,11 @@ class mpfit:
 
         # Be sure that PARINFO is of the right type
         if parinfo is not None:
-            if type(parinfo) != types.ListType:
+            if not isinstance(parinfo, list):
                 self.errmsg = 'ERROR: PARINFO must be a list of dictionaries.'
                 return
             else:
-                if type(parinfo[0]) != types.DictionaryType:
+                if not isinstance(parinfo[0], dict):
                     self.errmsg = 'ERROR: PARINFO must be a list of dictionaries.'
                     return
             if ((xall is not None) and (len(xall) != len(parinfo))):
@@ -902,7 +915,7 @@ class mpfit:
         # In the case if the xall is not float or if is float but has less 
         # than 64 bits we do convert it into double
         if xall.dtype.kind != 'f' or xall.dtype.itemsize<=4:
-            xall = xall.astype(numpy.float)
+            xall = xall.astype(float)
 
         npar = len(xall)
         self.fnorm  = -1.
@@ -1069,7 +1082,8 @@ class mpfit:
             fjac = self.fdjac2(fcn, x, fvec, step, qulim, ulim, dside,
                           epsfcn=epsfcn,
                           autoderivative=autoderivative, dstep=dstep,
-                          functkw=functkw, ifree=ifree, xall=self.params)
+                          functkw=functkw, ifree=ifree, xall=self.params,
+                          vectorized=self.vectorized)
             if fjac is None:
                 self.errmsg = 'WARNING: premature termination by FDJAC2'
                 return
@@ -1084,19 +1098,25 @@ class mpfit:
                 # See if any "pegged" values should keep their derivatives
                 if nlpeg > 0:
                     # Total derivative of sum wrt lower pegged parameters
-                    for i in range(nlpeg):
-                        sum0 = sum(fvec * fjac[:,whlpeg[i]])
-                        if sum0 > 0:
-                            fjac[:,whlpeg[i]] = 0
+                    sum0 = numpy.dot(fvec, fjac[:,whlpeg])
+                    fjac[:,whlpeg[sum0 > 0]] = 0
                 if nupeg > 0:
                     # Total derivative of sum wrt upper pegged parameters
-                    for i in range(nupeg):
-                        sum0 = sum(fvec * fjac[:,whupeg[i]])
-                        if sum0 < 0:
-                            fjac[:,whupeg[i]] = 0
+                    sum0 = numpy.dot(fvec, fjac[:,whupeg])
+                    fjac[:,whupeg[sum0 < 0]] = 0
+
+            # Check for overflow before handing the jacobian to LAPACK
+            if ~numpy.all(numpy.isfinite(fjac)) or ~numpy.all(numpy.isfinite(fvec)):
+                self.errmsg = ('ERROR: parameter or function value(s) have become '
+                    'infinite; check model function for over- and underflow')
+                self.status = -16
+                return
 
-            # Compute the QR factorization of the jacobian
-            [fjac, ipvt, wa1, wa2] = self.qrfac(fjac, pivot=1)
+            # Compute the QR factorization of the jacobian, along with
+            # (q transpose)*fvec.  From this point on, only the square
+            # matrix R (columns in pivoted order) is needed.
+            [fjac, ipvt, qtf, wa2] = self.qrfac(fjac, fvec)
+            wa1 = numpy.zeros(n, dtype=float)
             
             # On the first iteration if "diag" is unspecified, scale
             # according to the norms of the columns of the initial jacobian
@@ -1114,43 +1134,14 @@ class mpfit:
                 if delta == 0.:
                     delta = factor
 
-            # Form (q transpose)*fvec and store the first n components in qtf
-            catch_msg = 'forming (q transpose)*fvec'
-            wa4 = fvec.copy()
-            for j in range(n):
-                lj = ipvt[j]
-                temp3 = fjac[j,lj]
-                if temp3 != 0:
-                    fj = fjac[j:,lj]
-                    wj = wa4[j:]
-                    # *** optimization wa4(j:*)
-                    wa4[j:] = wj - fj * sum(fj*wj) / temp3
-                fjac[j,lj] = wa1[j]
-                qtf[j] = wa4[j]
-            # From this point on, only the square matrix, consisting of the
-            # triangle of R, is needed.
-            fjac = fjac[0:n, 0:n]
-            fjac.shape = [n, n]
-            temp = fjac.copy()
-            for i in range(n):
-                temp[:,i] = fjac[:, ipvt[i]]
-            fjac = temp.copy()
-
-            # Check for overflow.  This should be a cheap test here since FJAC
-            # has been reduced to a (small) square matrix, and the test is
-            # O(N^2).
-            #wh = where(finite(fjac) EQ 0, ct)
-            #if ct GT 0 then goto, FAIL_OVERFLOW
-
             # Compute the norm of the scaled gradient
             catch_msg = 'computing the scaled gradient'
             gnorm = 0.
             if self.fnorm != 0:
-                for j in range(n):
-                    l = ipvt[j]
-                    if wa2[l] != 0:
-                        sum0 = sum(fjac[0:j+1,j]*qtf[0:j+1])/self.fnorm
-                        gnorm = numpy.max([gnorm,numpy.abs(sum0/wa2[l])])
+                wh = (numpy.nonzero(wa2[ipvt] != 0))[0]
+                if len(wh) > 0:
+                    sum0 = numpy.dot(qtf, fjac[:,wh])/self.fnorm
+                    gnorm = numpy.max(numpy.abs(sum0/wa2[ipvt[wh]]))
 
             # Test for convergence of the gradient norm
             if gnorm <= gtol:
@@ -1249,7 +1240,7 @@ class mpfit:
                 catch_msg = 'calling '+str(fcn)
                 [self.status, wa4] = self.call(fcn, self.params, functkw)
                 if self.status < 0:
-                    self.errmsg = 'WARNING: premature termination by "'+fcn+'"'
+                    self.errmsg = 'WARNING: premature termination by "'+str(fcn)+'"'
                     return
                 fnorm1 = self.enorm(wa4)
 
@@ -1261,9 +1252,7 @@ class mpfit:
 
                 # Compute the scaled predicted reduction and the scaled directional
                 # derivative
-                for j in range(n):
-                    wa3[j] = 0
-                    wa3[0:j+1] = wa3[0:j+1] + fjac[0:j+1,j]*wa1[ipvt[j]]
+                wa3 = numpy.dot(numpy.triu(fjac), wa1[ipvt])
 
                 # Remember, alpha is the fraction of the full LM step actually
                 # taken
@@ -1414,7 +1403,7 @@ class mpfit:
                        format=None, pformat='%.10g', dof=1):
 
         if self.debug:
-            print 'Entering defiter...'
+            print('Entering defiter...')
         if quiet:
             return
         if fnorm is None:
@@ -1423,18 +1412,18 @@ class mpfit:
 
         # Determine which parameters to print
         nprint = len(x)
-        print "Iter ", ('%6i' % iter),"   CHI-SQUARE = ",('%.10g' % fnorm)," DOF = ", ('%i' % dof)
+        print("Iter ", ('%6i' % iter),"   CHI-SQUARE = ",('%.10g' % fnorm)," DOF = ", ('%i' % dof))
         for i in range(nprint):
-            if (parinfo is not None) and (parinfo[i].has_key('parname')):
+            if (parinfo is not None) and ('parname' in parinfo[i]):
                 p = '   ' + parinfo[i]['parname'] + ' = '
             else:
                 p = '   P' + str(i) + ' = '
-            if (parinfo is not None) and (parinfo[i].has_key('mpprint')):
+            if (parinfo is not None) and ('mpprint' in parinfo[i]):
                 iprint = parinfo[i]['mpprint']
             else:
                 iprint = 1
             if iprint:
-                print p + (pformat % x[i]) + '  '
+                print(p + (pformat % x[i]) + '  ')
         return 0
 
 
@@ -1462,7 +1451,7 @@ class mpfit:
     # Procedure to parse the parameter values in PARINFO, which is a list of dictionaries
     def parinfo(self, parinfo=None, key='a', default=None, n=0):
         if self.debug:
-            print 'Entering parinfo...'
+            print('Entering parinfo...')
         if (n == 0) and (parinfo is not None):
             n = len(parinfo)
         if n == 0:
@@ -1471,18 +1460,18 @@ class mpfit:
             return values
         values = []
         for i in range(n):
-            if (parinfo is not None) and (parinfo[i].has_key(key)):
+            if (parinfo is not None) and (key in parinfo[i]):
                 values.append(parinfo[i][key])
             else:
                 values.append(default)
 
         # Convert to numeric arrays if possible
         test = default
-        if type(default) == types.ListType:
+        if isinstance(default, list):
             test=default[0]
-        if isinstance(test, types.IntType):
+        if isinstance(test, int):
             values = numpy.asarray(values, int)
-        elif isinstance(test, types.FloatType):
+        elif isinstance(test, float):
             values = numpy.asarray(values, float)
         return values
     
@@ -1490,9 +1479,13 @@ class mpfit:
     # derivatives or not.
     def call(self, fcn, x, functkw, fjac=None):
         if self.debug:
-            print 'Entering call...'
+            print('Entering call...')
         if self.qanytied:
-            x = self.tie(x, self.ptied)
+            if numpy.ndim(x) == 2:
+                # One parameter set per row
+                x = self.tie(x.T, self.ptied).T
+            else:
+                x = self.tie(x, self.ptied)
         self.nfev = self.nfev + 1
         if fjac is None:
             [status, f] = fcn(x, fjac=fjac, **functkw)
@@ -1513,10 +1506,10 @@ class mpfit:
     
     def fdjac2(self, fcn, x, fvec, step=None, ulimited=None, ulimit=None, dside=None,
                epsfcn=None, autoderivative=1,
-               functkw=None, xall=None, ifree=None, dstep=None):
+               functkw=None, xall=None, ifree=None, dstep=None, vectorized=0):
 
         if self.debug:
-            print 'Entering fdjac2...'
+            print('Entering fdjac2...')
         machep = self.machar.machep
         if epsfcn is None:
             epsfcn = machep
@@ -1540,7 +1533,7 @@ class mpfit:
             [status, fp] = self.call(fcn, xall, functkw, fjac=fjac)
 
             if len(fjac) != m*nall:
-                print 'ERROR: Derivative matrix was not computed properly.'
+                print('ERROR: Derivative matrix was not computed properly.')
                 return None
 
             # This definition is consistent with CURVEFIT
@@ -1587,6 +1580,24 @@ class mpfit:
             wh = (numpy.nonzero(mask))[0]
             if len(wh) > 0:
                 h[wh] = - h[wh]
+        # Evaluate all of the perturbed parameter sets in one call, the
+        # one-sided steps first and then the minus steps of any two-sided
+        # derivatives
+        if vectorized:
+            two = (numpy.nonzero(numpy.abs(dside[ifree]) > 1))[0]
+            cols = numpy.concatenate((numpy.arange(n), two))
+            hs = numpy.concatenate((h, -h[two]))
+            xp = numpy.tile(xall, (len(cols), 1))
+            xp[numpy.arange(len(cols)), ifree[cols]] += hs
+            [status, fp] = self.call(fcn, xp, functkw)
+            if status < 0:
+                return None
+            fp = numpy.asarray(fp)
+            fjac = ((fp[0:n] - fvec) / h[:,None]).T
+            if len(two) > 0:
+                fjac[:,two] = ((fp[two] - fp[n:]) / (2*h[two,None])).T
+            return fjac
+
         # Loop through parameters, computing the derivative for each
         for j in range(n):
             xp = xall.copy()
@@ -1615,213 +1626,30 @@ class mpfit:
     
     
     
-    #    Original FORTRAN documentation
-    #    **********
-    #
-    #    subroutine qrfac
-    #
-    #    this subroutine uses householder transformations with column
-    #    pivoting (optional) to compute a qr factorization of the
-    #    m by n matrix a. that is, qrfac determines an orthogonal
-    #    matrix q, a permutation matrix p, and an upper trapezoidal
-    #    matrix r with diagonal elements of nonincreasing magnitude,
-    #    such that a*p = q*r. the householder transformation for
-    #    column k, k = 1,2,...,min(m,n), is of the form
-    #
-    #                       t
-    #       i - (1/u(k))*u*u
-    #
-    #    where u has zeros in the first k-1 positions. the form of
-    #    this transformation and the method of pivoting first
-    #    appeared in the corresponding linpack subroutine.
-    #
-    #    the subroutine statement is
-    #
-    #   subroutine qrfac(m,n,a,lda,pivot,ipvt,lipvt,rdiag,acnorm,wa)
-    #
-    #    where
-    #
-    #   m is a positive integer input variable set to the number
-    #     of rows of a.
-    #
-    #   n is a positive integer input variable set to the number
-    #     of columns of a.
-    #
-    #   a is an m by n array. on input a contains the matrix for
-    #     which the qr factorization is to be computed. on output
-    #     the strict upper trapezoidal part of a contains the strict
-    #     upper trapezoidal part of r, and the lower trapezoidal
-    #     part of a contains a factored form of q (the non-trivial
-    #     elements of the u vectors described above).
-    #
-    #   lda is a positive integer input variable not less than m
-    #     which specifies the leading dimension of the array a.
-    #
-    #   pivot is a logical input variable. if pivot is set true,
-    #     then column pivoting is enforced. if pivot is set false,
-    #     then no column pivoting is done.
-    #
-    #   ipvt is an integer output array of length lipvt. ipvt
-    #     defines the permutation matrix p such that a*p = q*r.
-    #     column j of p is column ipvt(j) of the identity matrix.
-    #     if pivot is false, ipvt is not referenced.
-    #
-    #   lipvt is a positive integer input variable. if pivot is false,
-    #     then lipvt may be as small as 1. if pivot is true, then
-    #     lipvt must be at least n.
-    #
-    #   rdiag is an output array of length n which contains the
-    #     diagonal elements of r.
-    #
-    #   acnorm is an output array of length n which contains the
-    #     norms of the corresponding columns of the input matrix a.
-    #     if this information is not needed, then acnorm can coincide
-    #     with rdiag.
-    #
-    #   wa is a work array of length n. if pivot is false, then wa
-    #     can coincide with rdiag.
-    #
-    #    subprograms called
-    #
-    #   minpack-supplied ... dpmpar,enorm
-    #
-    #   fortran-supplied ... dmax1,dsqrt,min0
-    #
-    #    argonne national laboratory. minpack project. march 1980.
-    #    burton s. garbow, kenneth e. hillstrom, jorge j. more
-    #
-    #    **********
-    #
-    # PIVOTING / PERMUTING:
-    #
-    # Upon return, A(*,*) is in standard parameter order, A(*,IPVT) is in
-    # permuted order.
-    # 
-    # RDIAG is in permuted order.
-    # ACNORM is in standard parameter order.
-    #
-    #
-    # NOTE: in IDL the factors appear slightly differently than described
-    # above.  The matrix A is still m x n where m >= n.
-    #
-    # The "upper" triangular matrix R is actually stored in the strict
-    # lower left triangle of A under the standard notation of IDL.
+    # QR factorization with column pivoting of the m by n matrix a, done by
+    # LAPACK (xGEQP3) through scipy.linalg, so that
     #
-    # The reflectors that generate Q are in the upper trapezoid of A upon
-    # output.
+    #    a[:,ipvt] = q*r
     #
-    #  EXAMPLE:  decompose the matrix [[9.,2.,6.],[4.,8.,7.]]
-    #   aa = [[9.,2.,6.],[4.,8.,7.]]
-    #   mpfit_qrfac, aa, aapvt, rdiag, aanorm
-    #    IDL> print, aa
-    #         1.81818*   0.181818*   0.545455*
-    #        -8.54545+    1.90160*   0.432573*
-    #    IDL> print, rdiag
-    #        -11.0000+   -7.48166+
+    # Like MINPACK's qrfac, the column of largest remaining norm is brought
+    # into the pivot position at each step, so the diagonal elements of r
+    # have nonincreasing magnitude.
     #
-    # The components marked with a * are the components of the
-    # reflectors, and those marked with a + are components of R.
+    # Unlike MINPACK, a is not overwritten with the householder vectors and
+    # q is never formed, it is only applied to the m-vector b.  Upon return
     #
-    # To reconstruct Q and R we proceed as follows.  First R.
-    #   r = fltarr(m, n)
-    #   for i = 0, n-1 do r(0:i,i) = aa(0:i,i)  # fill in lower diag
-    #   r(lindgen(n)*(m+1)) = rdiag
-    #
-    # Next, Q, which are composed from the reflectors.  Each reflector v
-    # is taken from the upper trapezoid of aa, and converted to a matrix
-    # via (I - 2 vT . v / (v . vT)).
-    #
-    #   hh = ident                                  # identity matrix
-    #   for i = 0, n-1 do begin
-    #   v = aa(*,i) & if i GT 0 then v(0:i-1) = 0   # extract reflector
-    #   hh = hh # (ident - 2*(v # v)/total(v * v))  # generate matrix
-    #   endfor
-    #
-    # Test the result:
-    #   IDL> print, hh # transpose(r)
-    #         9.00000     4.00000
-    #         2.00000     8.00000
-    #         6.00000     7.00000
-    #
-    # Note that it is usually never necessary to form the Q matrix
-    # explicitly, and MPFIT does not.
-    
+    #    r is the n by n upper triangular matrix, columns in permuted order
+    #    ipvt is the permutation
+    #    qtb is the first n components of (q transpose)*b
+    #    acnorm is the norms of the columns of a, in standard parameter order
 
-    def qrfac(self, a, pivot=0):
+    def qrfac(self, a, b):
 
-        if self.debug: print 'Entering qrfac...'
-        machep = self.machar.machep
-        sz = a.shape
-        m = sz[0]
-        n = sz[1]
-
-        # Compute the initial column norms and initialize arrays
-        acnorm = numpy.zeros(n, dtype=float)
-        for j in range(n):
-            acnorm[j] = self.enorm(a[:,j])
-        rdiag = acnorm.copy()
-        wa = rdiag.copy()
-        ipvt = numpy.arange(n)
-
-        # Reduce a to r with householder transformations
-        minmn = numpy.min([m,n])
-        for j in range(minmn):
-            if pivot != 0:
-                # Bring the column of largest norm into the pivot position
-                rmax = numpy.max(rdiag[j:])
-                kmax = (numpy.nonzero(rdiag[j:] == rmax))[0]
-                ct = len(kmax)
-                kmax = kmax + j
-                if ct > 0:
-                    kmax = kmax[0]
-
-                    # Exchange rows via the pivot only.  Avoid actually exchanging
-                    # the rows, in case there is lots of memory transfer.  The
-                    # exchange occurs later, within the body of MPFIT, after the
-                    # extraneous columns of the matrix have been shed.
-                    if kmax != j:
-                        temp = ipvt[j] ; ipvt[j] = ipvt[kmax] ; ipvt[kmax] = temp
-                        rdiag[kmax] = rdiag[j]
-                        wa[kmax] = wa[j]
-
-            # Compute the householder transformation to reduce the jth
-            # column of A to a multiple of the jth unit vector
-            lj = ipvt[j]
-            ajj = a[j:,lj]
-            ajnorm = self.enorm(ajj)
-            if ajnorm == 0:
-                break
-            if a[j,lj] < 0:
-                ajnorm = -ajnorm
-
-            ajj = ajj / ajnorm
-            ajj[0] = ajj[0] + 1
-            # *** Note optimization a(j:*,j)
-            a[j:,lj] = ajj
-
-            # Apply the transformation to the remaining columns
-            # and update the norms
-
-            # NOTE to SELF: tried to optimize this by removing the loop,
-            # but it actually got slower.  Reverted to "for" loop to keep
-            # it simple.
-            if j+1 < n:
-                for k in range(j+1, n):
-                    lk = ipvt[k]
-                    ajk = a[j:,lk]
-                    # *** Note optimization a(j:*,lk)
-                    # (corrected 20 Jul 2000)
-                    if a[j,lj] != 0:
-                        a[j:,lk] = ajk - ajj * sum(ajk*ajj)/a[j,lj]
-                        if (pivot != 0) and (rdiag[k] != 0):
-                            temp = a[j,lk]/rdiag[k]
-                            rdiag[k] = rdiag[k] * numpy.sqrt(numpy.max([(1.-temp**2), 0.]))
-                            temp = rdiag[k]/wa[k]
-                            if (0.05*temp*temp) <= machep:
-                                rdiag[k] = self.enorm(a[j+1:,lk])
-                                wa[k] = rdiag[k]
-            rdiag[j] = -ajnorm
-        return [a, ipvt, rdiag, acnorm]
+        if self.debug: print('Entering qrfac...')
+        acnorm = numpy.sqrt(numpy.sum(a*a, axis=0))
+        [qtb, r, ipvt] = scipy.linalg.qr_multiply(a, b, mode='right',
+                                                  pivoting=True)
+        return [r, ipvt, qtb, acnorm]
 
     
     #    Original FORTRAN documentation
@@ -1904,58 +1732,23 @@ class mpfit:
     
     def qrsolv(self, r, ipvt, diag, qtb, sdiag):
         if self.debug:
-            print 'Entering qrsolv...'
+            print('Entering qrsolv...')
         sz = r.shape
         m = sz[0]
         n = sz[1]
 
-        # copy r and (q transpose)*b to preserve input and initialize s.
-        # in particular, save the diagonal elements of r in x.
+        # Eliminate the diagonal matrix d with a QR factorization of the
+        # 2n by n matrix (r, (p transpose)*d*p), which applied to
+        # ((q transpose)*b, 0) gives (s transpose)*(q transpose)*b in wa.
+        a = numpy.vstack((numpy.triu(r), numpy.diag(diag[ipvt])))
+        b = numpy.concatenate((qtb, numpy.zeros(n)))
+        [wa, s] = scipy.linalg.qr_multiply(a, b, mode='right')
+        sdiag = numpy.diagonal(s).copy()
 
-        for j in range(n):
-            r[j:n,j] = r[j,j:n]
-        x = numpy.diagonal(r)
-        wa = qtb.copy()
-
-        # Eliminate the diagonal matrix d using a givens rotation
-        for j in range(n):
-            l = ipvt[j]
-            if diag[l] == 0:
-                break
-            sdiag[j:] = 0
-            sdiag[j] = diag[l]
-
-            # The transformations to eliminate the row of d modify only a
-            # single element of (q transpose)*b beyond the first n, which
-            # is initially zero.
-
-            qtbpj = 0.
-            for k in range(j,n):
-                if sdiag[k] == 0:
-                    break
-                if numpy.abs(r[k,k]) < numpy.abs(sdiag[k]):
-                    cotan  = r[k,k]/sdiag[k]
-                    sine   = 0.5/numpy.sqrt(.25 + .25*cotan*cotan)
-                    cosine = sine*cotan
-                else:
-                    tang   = sdiag[k]/r[k,k]
-                    cosine = 0.5/numpy.sqrt(.25 + .25*tang*tang)
-                    sine   = cosine*tang
-
-                # Compute the modified diagonal element of r and the
-                # modified element of ((q transpose)*b,0).
-                r[k,k] = cosine*r[k,k] + sine*sdiag[k]
-                temp = cosine*wa[k] + sine*qtbpj
-                qtbpj = -sine*wa[k] + cosine*qtbpj
-                wa[k] = temp
-
-                # Accumulate the transformation in the row of s
-                if n > k+1:
-                    temp = cosine*r[k+1:n,k] + sine*sdiag[k+1:n]
-                    sdiag[k+1:n] = -sine*r[k+1:n,k] + cosine*sdiag[k+1:n]
-                    r[k+1:n,k] = temp
-            sdiag[j] = r[j,j]
-            r[j,j] = x[j]
+        # Store the strict upper triangle of s in the strict lower triangle
+        # of r, the full upper triangle of r is unaltered
+        wh = numpy.tril_indices(n, -1)
+        r[wh] = s.T[wh]
 
         # Solve the triangular system for z.  If the system is singular
         # then obtain a least squares solution
@@ -1966,13 +1759,11 @@ class mpfit:
             wa[nsing:] = 0
 
         if nsing >= 1:
-            wa[nsing-1] = wa[nsing-1]/sdiag[nsing-1] # Degenerate case
-            # *** Reverse loop ***
-            for j in range(nsing-2,-1,-1):
-                sum0 = sum(r[j+1:nsing,j]*wa[j+1:nsing])
-                wa[j] = (wa[j]-sum0)/sdiag[j]
+            wa[0:nsing] = scipy.linalg.solve_triangular(s[0:nsing,0:nsing],
+                              wa[0:nsing], check_finite=False)
 
         # Permute the components of z back to components of x
+        x = numpy.zeros(n, dtype=float)
         x[ipvt] = wa
         return (r, x, sdiag)
 
@@ -2076,7 +1867,7 @@ class mpfit:
     def lmpar(self, r, ipvt, diag, qtb, delta, x, sdiag, par=None):
 
         if self.debug:
-            print 'Entering lmpar...'
+            print('Entering lmpar...')
         dwarf = self.machar.minnum
         machep = self.machar.machep
         sz = r.shape
@@ -2093,11 +1884,8 @@ class mpfit:
             nsing = wh[0]
             wa1[wh[0]:] = 0
         if nsing >= 1:
-            # *** Reverse loop ***
-            for j in range(nsing-1,-1,-1):
-                wa1[j] = wa1[j]/r[j,j]
-                if j-1 >= 0:
-                    wa1[0:j] = wa1[0:j] - r[0:j,j]*wa1[j]
+            wa1[0:nsing] = scipy.linalg.solve_triangular(r[0:nsing,0:nsing],
+                               wa1[0:nsing], check_finite=False)
 
         # Note: ipvt here is a permutation array
         x[ipvt] = wa1
@@ -2118,18 +1906,14 @@ class mpfit:
         parl = 0.
         if nsing >= n:
             wa1 = diag[ipvt] * wa2[ipvt] / dxnorm
-            wa1[0] = wa1[0] / r[0,0] # Degenerate case
-            for j in range(1,n):   # Note "1" here, not zero
-                sum0 = sum(r[0:j,j]*wa1[0:j])
-                wa1[j] = (wa1[j] - sum0)/r[j,j]
+            wa1 = scipy.linalg.solve_triangular(r, wa1, trans='T',
+                                                check_finite=False)
 
             temp = self.enorm(wa1)
             parl = ((fp/delta)/temp)/temp
 
         # Calculate an upper bound, paru, for the zero of the function
-        for j in range(n):
-            sum0 = sum(r[0:j+1,j]*qtb[0:j+1])
-            wa1[j] = sum0/diag[ipvt[j]]
+        wa1 = numpy.dot(qtb, numpy.triu(r))/diag[ipvt]
         gnorm = self.enorm(wa1)
         paru = gnorm/delta
         if paru == 0:
@@ -2164,12 +1948,13 @@ class mpfit:
                break;
 
             # Compute the newton correction
+            # (s transpose) is stored in the strict lower triangle of r
+            # and sdiag
             wa1 = diag[ipvt] * wa2[ipvt] / dxnorm
-
-            for j in range(n-1):
-                wa1[j] = wa1[j]/sdiag[j]
-                wa1[j+1:n] = wa1[j+1:n] - r[j+1:n,j]*wa1[j]
-            wa1[n-1] = wa1[n-1]/sdiag[n-1] # Degenerate case
+            st = numpy.tril(r, -1)
+            st[numpy.diag_indices(n)] = sdiag
+            wa1 = scipy.linalg.solve_triangular(st, wa1, lower=True,
+                                                check_finite=False)
 
             temp = self.enorm(wa1)
             parc = ((fp/delta)/temp)/temp
@@ -2192,7 +1977,7 @@ class mpfit:
     # Procedure to tie one parameter to another.
     def tie(self, p, ptied=None):
         if self.debug:
-            print 'Entering tie...'
+            print('Entering tie...')
         if ptied is None:
             return
         for i in range(len(ptied)):
@@ -2273,65 +2058,39 @@ class mpfit:
     def calc_covar(self, rr, ipvt=None, tol=1.e-14):
 
         if self.debug:
-            print 'Entering calc_covar...'
-        if numpy.rank(rr) != 2:
-            print 'ERROR: r must be a two-dimensional matrix'
+            print('Entering calc_covar...')
+        if numpy.ndim(rr) != 2:
+            print('ERROR: r must be a two-dimensional matrix')
             return -1
         s = rr.shape
         n = s[0]
         if s[0] != s[1]:
-            print 'ERROR: r must be a square matrix'
+            print('ERROR: r must be a square matrix')
             return -1
 
         if ipvt is None:
             ipvt = numpy.arange(n)
-        r = rr.copy()
-        r.shape = [n,n]
+        r = numpy.triu(numpy.reshape(rr, [n,n]))
 
-        # For the inverse of r in the full upper triangle of r
-        l = -1
+        # The numerical rank of r, l is the last column of the leading block
+        # with abs(r[k,k]) > tol*abs(r[0,0])
         tolr = tol * numpy.abs(r[0,0])
-        for k in range(n):
-            if numpy.abs(r[k,k]) <= tolr:
-                break
-            r[k,k] = 1./r[k,k]
-            for j in range(k):
-                temp = r[k,k] * r[j,k]
-                r[j,k] = 0.
-                r[0:j+1,k] = r[0:j+1,k] - temp*r[0:j+1,j]
-            l = k
-
-        # Form the full upper triangle of the inverse of (r transpose)*r
-        # in the full upper triangle of r
+        wh = (numpy.nonzero(numpy.abs(numpy.diagonal(r)) <= tolr))[0]
+        l = n-1
+        if len(wh) > 0:
+            l = wh[0]-1
+
+        # Form inverse((r transpose)*r) of the leading block, the rows and
+        # columns of the remaining (rank deficient) parameters are zero
+        cv = numpy.zeros([n,n], dtype=float)
         if l >= 0:
-            for k in range(l+1):
-                for j in range(k):
-                    temp = r[j,k]
-                    r[0:j+1,j] = r[0:j+1,j] + temp*r[0:j+1,k]
-                temp = r[k,k]
-                r[0:k+1,k] = temp * r[0:k+1,k]
-
-        # For the full lower triangle of the covariance matrix
-        # in the strict lower triangle or and in wa
-        wa = numpy.repeat([r[0,0]], n)
-        for j in range(n):
-            jj = ipvt[j]
-            sing = j > l
-            for i in range(j+1):
-                if sing:
-                    r[i,j] = 0.
-                ii = ipvt[i]
-                if ii > jj:
-                    r[ii,jj] = r[i,j]
-                if ii < jj:
-                    r[jj,ii] = r[i,j]
-            wa[jj] = r[j,j]
-
-        # Symmetrize the covariance matrix in r
-        for j in range(n):
-            r[0:j+1,j] = r[j,0:j+1]
-            r[j,j] = wa[j]
+            rinv = scipy.linalg.solve_triangular(r[0:l+1,0:l+1],
+                       numpy.identity(l+1), check_finite=False)
+            cv[0:l+1,0:l+1] = numpy.dot(rinv, rinv.T)
 
+        # Permute back to standard parameter order
+        r = numpy.zeros([n,n], dtype=float)
+        r[numpy.ix_(ipvt, ipvt)] = cv
         return r
 
 class machar:
@@ -15,7 +15,7 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import mpfit 
+from .mpfit import mpfit
 import re
 import numpy
 import scipy
@@ -70,7 +70,7 @@ def mpfitexpr(func, x, y, err , start_params, check=True, full_output=False,
 		if maxp + 1 != len(start_params):
 			raise Exception("the length of the start_params != the length of the parameter verctor of the function")
 	fa={'x' : x, 'y' : y,'err' : err}
-	res = mpfit.mpfit(myfunc,start_params,functkw=fa,**kw)
+	res = mpfit(myfunc,start_params,functkw=fa,**kw)
 	yfit = eval(func, globals(), {'x':x, 'p': res.params})
 	if full_output:
 		return (res, yfit)
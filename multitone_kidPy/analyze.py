@@ -6,8 +6,8 @@ import numpy as np
 from scipy.stats import binned_statistic
 from scipy import interpolate
 from KIDs import calibrate
-import pickle
 from KIDs import PCA_implementation as PCA
+from KIDs import results_store
 
 
 # this function fits a fine and gain scan combo produced by the ASU multitone system
@@ -564,7 +564,8 @@ def calibrate_list(fine_filename,gain_filename,stream_list,skip_beginning = 0,pl
 
 def calibrate_multi(fine_filename, gain_filename, stream_filename,
         skip_beginning=0, plot_period=10, bin_num=1, outfile_dir="./",
-        sample_rate=488.28125, plot=True, **keywords):
+        sample_rate=488.28125, plot=True, save_format="h5", **keywords):
+    # save_format = "h5" saves cal.h5 (see KIDs.results_store) "pickle" saves cal.p
 
     #read in the scans
     fine_dict = read_multitone.read_iq_sweep(fine_filename)
@@ -682,7 +683,7 @@ def calibrate_multi(fine_filename, gain_filename, stream_filename,
         plot_period, outfile_dir)
 
     #save the dictionary
-    pickle.dump( cal_dict, open(outfile_dir+ "cal.p", "wb" ),2 )
+    results_store.save_dict(cal_dict, outfile_dir+"cal", save_format)
     return cal_dict
 
 
@@ -817,12 +818,17 @@ def fft_noise(z_stream,df_over_f,sample_rate):
     return fft_freqs,Sxx,S_per,S_par
 
 
-def noise_multi(cal_dict, sample_rate = 488.28125,outfile_dir = "./",n_comp_PCA = 0):
+def noise_multi(cal_dict, sample_rate = 488.28125,outfile_dir = "./",n_comp_PCA = 0,save_format = "h5"):
+    # cal_dict can also be the filename of a cal.h5 results store
+    if isinstance(cal_dict, str):
+        with results_store.ResultsStore(cal_dict) as store:
+            return noise_multi(store, sample_rate = sample_rate, outfile_dir = outfile_dir,
+                    n_comp_PCA = n_comp_PCA, save_format = save_format)
 
     if n_comp_PCA >0:
         do_PCA = True
         #do PCA on the data
-        cleaned, removed = PCA.PCA_SVD(cal_dict['stream_df_over_f'],n_comp_PCA,
+        cleaned, removed = PCA.PCA_SVD(np.asarray(cal_dict['stream_df_over_f']),n_comp_PCA,
                 plot=True)
     else:
         do_PCA = False
@@ -887,7 +893,7 @@ def noise_multi(cal_dict, sample_rate = 488.28125,outfile_dir = "./",n_comp_PCA
     #plot the stuff
     plot_noise_multi(psd_dict, N_PCA=n_comp_PCA, outfile_dir=outfile_dir) 
     #save the psd dictionary
-    pickle.dump( psd_dict, open( outfile_dir+"psd.p", "wb" ),2 )
+    results_store.save_dict(psd_dict, outfile_dir+"psd", save_format)
 
     return psd_dict
 
@@ -0,0 +1,223 @@
+import numpy as np
+import os
+try:
+    import h5py
+except:
+    print("This function requires h5py to run")
+
+# this is code to pack the kidpy sweep directories (one .npy per sweep step) and
+# stream dirfiles (plus the time and packet_count side files) into a single
+# chunked, compressed hdf5 container so we only have to open one file per observation
+
+# Please note the date and details of any changes
+# Change log
+# 2026-10-19 - added converter and readers for the consolidated container
+
+# layout of the container
+# every converted sweep or stream directory becomes a group named after the directory
+# sweep groups hold  I, Q, (I_std, Q_std), sweep_freqs, bb_freqs   (I is sweep step x channel)
+# stream groups hold I_stream, Q_stream, time, packet_count        (I_stream is sample x channel)
+# each group has a 'kind' attribute of either 'sweep' or 'stream'
+
+# layout = 'channel' chunks so a single channel (all steps/samples) is one or a few chunks
+#                    good for fitting or calibrating one resonator at a time
+# layout = 'time'    chunks so a block of samples of all channels is one chunk
+#                    good for looking at a piece of a stream for every resonator
+# layout = None      stores the data contiguous and uncompressed so it can be memory mapped
+
+
+def _chunk_shape(shape, layout, chunk_size=2**17):
+    # chunk_size is the target number of elements in a chunk
+    if layout is None:
+        return None
+    if len(shape) == 1:
+        return (max(1, min(shape[0], chunk_size)),)
+    if layout == 'channel':
+        rows = max(1, min(shape[0], chunk_size))
+        cols = max(1, min(shape[1], chunk_size//rows))
+    elif layout == 'time':
+        cols = max(1, shape[1])
+        rows = max(1, min(shape[0], chunk_size//cols))
+    else:
+        raise ValueError("layout must be 'channel', 'time' or None not " + str(layout))
+    return (rows, cols)
+
+
+def _write_dataset(group, name, data, layout, compression, compression_opts):
+    data = np.asarray(data)
+    if layout is None or data.size == 0:
+        return group.create_dataset(name, data=data)
+    return group.create_dataset(name, data=data, chunks=_chunk_shape(data.shape, layout),
+                                compression=compression, compression_opts=compression_opts,
+                                shuffle=compression is not None)
+
+
+def _create_group(f, name, overwrite):
+    if name in f:
+        if not overwrite:
+            raise ValueError(name + " already exists in " + f.filename +
+                             " pass overwrite = True to replace it or name = another group name")
+        del f[name]
+    return f.create_group(name)
+
+
+def _group_name(dirname):
+    return os.path.basename(os.path.normpath(dirname))
+
+
+def write_sweep(outfile, sweep_dir, name=None, layout='channel', compression='gzip', compression_opts=4,
+                overwrite=False):
+    """Copies a kidpy sweep directory into a group of the container outfile
+       inputs:
+           char outfile: the hdf5 container (appended to if it exists)
+           char sweep_dir: the kidpy sweep directory
+           char name: group name, defaults to the directory name
+           layout: 'channel', 'time' or None see top of file
+           bool overwrite: replace an existing group of the same name instead of raising a ValueError
+       outputs:
+           char name: the group the sweep was written to"""
+    from multitone_kidPy import read_multitone
+    if name is None:
+        name = _group_name(sweep_dir)
+    I, Q, I_std, Q_std = read_multitone.openStoredSweep(sweep_dir, load_std=True)
+    with h5py.File(outfile, 'a') as f:
+        group = _create_group(f, name, overwrite)
+        group.attrs['kind'] = 'sweep'
+        group.attrs['source'] = os.path.abspath(sweep_dir)
+        _write_dataset(group, 'I', I, layout, compression, compression_opts)
+        _write_dataset(group, 'Q', Q, layout, compression, compression_opts)
+        if I_std is not None:
+            _write_dataset(group, 'I_std', I_std, layout, compression, compression_opts)
+            _write_dataset(group, 'Q_std', Q_std, layout, compression, compression_opts)
+        group.create_dataset('sweep_freqs', data=np.load(os.path.join(sweep_dir, 'sweep_freqs.npy')))
+        group.create_dataset('bb_freqs', data=np.load(os.path.join(sweep_dir, 'bb_freqs.npy')))
+    return name
+
+
+def write_stream(outfile, stream_dir, name=None, layout='channel', compression='gzip', compression_opts=4,
+                 overwrite=False):
+    """Copies a kidpy stream dirfile (with its time and packet_count files) into a group of the container outfile
+       inputs:
+           char outfile: the hdf5 container (appended to if it exists)
+           char stream_dir: the kidpy stream dirfile
+           char name: group name, defaults to the directory name
+           layout: 'channel', 'time' or None see top of file
+           bool overwrite: replace an existing group of the same name instead of raising a ValueError
+       outputs:
+           char name: the group the stream was written to"""
+    from multitone_kidPy import read_multitone
+    if name is None:
+        name = _group_name(stream_dir)
+    stream = read_multitone.read_stream(stream_dir, plot=False)
+    with h5py.File(outfile, 'a') as f:
+        group = _create_group(f, name, overwrite)
+        group.attrs['kind'] = 'stream'
+        group.attrs['source'] = os.path.abspath(stream_dir)
+        # the dirfile is float32 so storing float32 is lossless, read_stream casts back to float64
+        _write_dataset(group, 'I_stream', stream['I_stream'].astype(np.float32), layout, compression, compression_opts)
+        _write_dataset(group, 'Q_stream', stream['Q_stream'].astype(np.float32), layout, compression, compression_opts)
+        _write_dataset(group, 'time', stream['time'], layout, compression, compression_opts)
+        _write_dataset(group, 'packet_count', stream['packet_count'], layout, compression, compression_opts)
+    return name
+
+
+def convert(outfile, sweep_dirs=(), stream_dirs=(), layout='channel', compression='gzip', compression_opts=4,
+            overwrite=False):
+    """Packs several kidpy sweeps (i.e. fine and gain) and streams into one container
+       converting a directory that is already in the container raises a ValueError unless overwrite = True
+       returns a dictionary mapping each input directory to its group name"""
+    names = {}
+    for sweep_dir in sweep_dirs:
+        names[sweep_dir] = write_sweep(outfile, sweep_dir, layout=layout, compression=compression,
+                                       compression_opts=compression_opts, overwrite=overwrite)
+    for stream_dir in stream_dirs:
+        names[stream_dir] = write_stream(outfile, stream_dir, layout=layout, compression=compression,
+                                         compression_opts=compression_opts, overwrite=overwrite)
+    return names
+
+
+def list_groups(filename, kind=None):
+    # list the sweeps and or streams in a container
+    with h5py.File(filename, 'r') as f:
+        return [name for name in f if kind is None or f[name].attrs['kind'] == kind]
+
+
+def _get_group(f, group, kind):
+    if group is None:
+        names = [name for name in f if f[name].attrs['kind'] == kind]
+        if len(names) != 1:
+            raise ValueError(str(len(names)) + " " + kind + " groups in " + f.filename +
+                             " pass group = one of " + str(names))
+        group = names[0]
+    if f[group].attrs['kind'] != kind:
+        raise ValueError(group + " is a " + f[group].attrs['kind'] + " not a " + kind)
+    return f[group]
+
+
+def _read(dset, rows=slice(None), channels=None, memmap=False):
+    # memmap only works for contiguous uncompressed datasets (layout = None)
+    if memmap and dset.chunks is None and dset.compression is None and dset.id.get_offset() is not None:
+        data = np.memmap(dset.file.filename, mode='r', dtype=dset.dtype, shape=dset.shape,
+                         offset=dset.id.get_offset())
+    else:
+        data = dset
+    if channels is None or dset.ndim == 1:
+        return np.asarray(data[rows])
+    if isinstance(channels, (int, np.integer)):
+        return np.asarray(data[rows, channels])
+    # h5py wants increasing indices for fancy indexing
+    channels = np.asarray(channels)
+    order = np.argsort(channels)
+    out = np.asarray(data[rows, channels[order].tolist()] if data is dset else data[rows][:, channels[order]])
+    return out[:, np.argsort(order)]
+
+
+def read_iq_sweep(filename, group=None, load_std=False, channels=None, memmap=False):
+    """same output as read_multitone.read_iq_sweep but from a container
+       inputs:
+           char filename: the container
+           char group: which sweep to read, can be omitted if there is only one sweep
+           channels: int or list of channel indices to read, None reads all of them
+           bool memmap: memory map contiguous datasets instead of reading them"""
+    with h5py.File(filename, 'r') as f:
+        g = _get_group(f, group, 'sweep')
+        I = _read(g['I'], channels=channels, memmap=memmap)
+        Q = _read(g['Q'], channels=channels, memmap=memmap)
+        sweep_freqs = g['sweep_freqs'][()]
+        bb_freqs = g['bb_freqs'][()]
+        if channels is not None:
+            bb_freqs = bb_freqs[channels]
+        chan_freqs = (sweep_freqs[:, np.newaxis] + np.atleast_1d(bb_freqs)[np.newaxis, :])/1.0e6
+        if np.ndim(I) == 1:
+            chan_freqs = chan_freqs[:, 0]
+        dict = {'I': I, 'Q': Q, 'freqs': chan_freqs}
+        if load_std:
+            dict['I_std'] = _read(g['I_std'], channels=channels, memmap=memmap)
+            dict['Q_std'] = _read(g['Q_std'], channels=channels, memmap=memmap)
+    return dict
+
+
+def read_stream(filename, group=None, channels=None, samples=None, memmap=False):
+    """same output as read_multitone.read_stream but from a container
+       inputs:
+           char filename: the container
+           char group: which stream to read, can be omitted if there is only one stream
+           channels: int or list of channel indices to read, None reads all of them
+           samples: slice of samples to read i.e. slice(0,10000), None reads all of them
+           bool memmap: memory map contiguous datasets instead of reading them
+       I_stream and Q_stream are stored as float32 (the precision of the dirfile) and returned as float64
+       like read_multitone.read_stream, except with memmap = True where the stored float32 is returned"""
+    if samples is None:
+        samples = slice(None)
+    with h5py.File(filename, 'r') as f:
+        g = _get_group(f, group, 'stream')
+        I_stream = _read(g['I_stream'], samples, channels, memmap)
+        Q_stream = _read(g['Q_stream'], samples, channels, memmap)
+        if not memmap:
+            I_stream = I_stream.astype(np.float64)
+            Q_stream = Q_stream.astype(np.float64)
+        dictionary = {'I_stream': I_stream,
+                      'Q_stream': Q_stream,
+                      'time': g['time'][samples],
+                      'packet_count': g['packet_count'][samples]}
+    return dictionary
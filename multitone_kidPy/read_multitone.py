@@ -1,7 +1,6 @@
 import numpy as np
 import os
 import pygetdata as gd
-import struct
 import matplotlib.pyplot as plt
 
 def openStoredSweep(savepath,load_std = False):
@@ -24,6 +23,7 @@ def openStoredSweep(savepath,load_std = False):
             stdQ_list.append(os.path.join(savepath, filename))
     Is = np.array([np.load(filename) for filename in I_list])
     Qs = np.array([np.load(filename) for filename in Q_list])
+    std_Is, std_Qs = None, None
     if len(stdI_list) >0:
             std_Is = np.array([np.load(filename) for filename in stdI_list])
             std_Qs = np.array([np.load(filename) for filename in stdQ_list])
@@ -34,7 +34,11 @@ def openStoredSweep(savepath,load_std = False):
 
 
 # reads in an iq sweep and stors i and q and the frequencies in a dictionary
-def read_iq_sweep(filename,load_std = False):
+# filename can also be a container file made with multitone_kidPy.container
+def read_iq_sweep(filename,load_std = False,group = None):
+    if os.path.isfile(filename):
+        from multitone_kidPy import container
+        return container.read_iq_sweep(filename,group = group,load_std = load_std)
     if load_std:
         I, Q, I_std, Q_std = openStoredSweep(filename,load_std = True)
     else:
@@ -52,7 +56,11 @@ def read_iq_sweep(filename,load_std = False):
         dict = {'I': I, 'Q': Q, 'freqs': chan_freqs}
     return dict
 
-def read_stream(filename):
+# filename can also be a container file made with multitone_kidPy.container
+def read_stream(filename,plot = True,group = None):
+    if os.path.isfile(filename):
+        from multitone_kidPy import container
+        return container.read_stream(filename,group = group)
     firstframe = 0
     firstsample = 0
     d = gd.dirfile(filename, gd.RDWR|gd.UNENCODED)
@@ -77,22 +85,15 @@ def read_stream(filename):
         q_stream[:,n] = qvals[~np.isnan(qvals)]
     d.close()
     #read in the time file
-    with open(filename+"/time",'rb') as content_file:
-        content = content_file.read()
-    time_val = []
-    for i in range(0,len(content)/8):
-        time_val.append(struct.unpack('d',content[0+8*i:8+8*i])[0])
+    time_val = np.fromfile(filename+"/time",dtype = 'd')
 
-
-    #read in the time file
-    with open(filename+"/packet_count",'rb') as content_file:
-        content = content_file.read()
-    packet_val = []
-    for i in range(0,len(content)/8):
-        packet_val.append(struct.unpack('L',content[0+8*i:8+8*i])[0])
+    #read in the packet count file
+    packet_val = np.fromfile(filename+"/packet_count",dtype = 'L')
     packet = np.asarray(packet_val)
-    if ((packet -np.roll(packet,1))[1:]!=1).any():#you dropped packet
+    dropped = ((packet -np.roll(packet,1))[1:]!=1).any()
+    if dropped:#you dropped packet
         print("!!!!WARNING!!!!! you dropped some packets during your measurement consider increasing your system buffer size")
+    if dropped and plot:
         plt.figure(1)
         plt.title("Delta t between packets")
         plt.plot((time_val-np.roll(time_val,1))[1:])
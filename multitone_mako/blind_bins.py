@@ -0,0 +1,48 @@
+import numpy as np
+import os
+from collections import OrderedDict
+
+# code for separating the blind tones from the resonator tones of the mako multitone
+# shared by read_multitone (fits files) and read_multitone_sav (idl sav files)
+
+
+# Please note the date and details of any changes
+# Change log
+# 2026-10-19 - replaced the nested bins x blindbins loops in the readers with np.isin
+#              and cache the result per calibration file
+
+
+def blind_index(bins, blind_bins):
+    """finds which bins are blind bins
+       inputs:
+           numpy array bins: the bin of every tone
+           numpy array blind_bins: the bins of the blind tones
+       outputs:
+           numpy array blind_index: index of the blind tones in bins
+           numpy array non_blind_index: index of the resonator tones in bins"""
+    isblind = np.isin(np.asarray(bins), np.asarray(blind_bins))
+    return np.flatnonzero(isblind), np.flatnonzero(~isblind)
+
+
+_cache = OrderedDict()
+
+
+def cached_blind_index(filename, read_bins, maxsize=128):
+    """blind_index for the calibration file filename, only recomputed if the file changes
+       inputs:
+           char filename: the calibration file the bins come from
+           read_bins: function with no arguments returning (bins, blind_bins)
+                      only called if filename is not already in the cache
+       outputs:
+           same as blind_index, the arrays are shared between calls so they are read only"""
+    key = (os.path.abspath(filename), os.path.getmtime(filename))
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+    index = blind_index(*read_bins())
+    for array in index:
+        array.setflags(write=False)
+    _cache[key] = index
+    if len(_cache) > maxsize:
+        _cache.popitem(last=False)
+    return index
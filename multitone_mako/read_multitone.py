@@ -1,4 +1,7 @@
 import numpy as np
+import os
+from functools import lru_cache
+from multitone_mako.blind_bins import cached_blind_index
 try:
     from astropy.io import fits
 except:
@@ -12,6 +15,9 @@ except:
 #Change log
 # 3/17/2017 -Jordan added functionality to read stream fits files
 # and added scaling the data by the scaling factor and averages
+# 10/19/2026 blind bins are found with np.isin (multitone_mako.blind_bins) and cached per cal file
+# 10/19/2026 readsearch converts each sweep with array operations instead of a triple loop
+# 10/19/2026 the calfile headers needed by readstream are cached (read_cal_header)
 
 
 
@@ -30,16 +36,9 @@ def readcal(infile,hdu = False):
     I_Q_freqs = hdulist[2].header['bininHz']*hdulist[2].data['tones']
 
     # we want to know which bins are blind bins so that we can appropriatly ignore them
-    # nested for loop is bad (slow in python) see if we can do better when bored
-    isblind = np.ones(bins.shape[0])
-    for k in range(0,blind_bins.size):
-        for j in range(0,blind_bins.size):
-            if bins[k] == blind_bins[j]:
-                isblind[k] = -1
+    blind_index, non_blind_index = cached_blind_index(infile, lambda: (bins, blind_bins))
 
     #lets seperate the blind bins from the real bins
-    blind_index = np.where(isblind<0)[0]
-    non_blind_index = np.where(isblind>0)[0]
 
     I_blind = I[:,blind_index]
     Q_blind = Q[:,blind_index]
@@ -63,11 +62,8 @@ def readcal(infile,hdu = False):
          return hdulist  
 
 
-def readstream(infile,hdu = False):
-
-    hdulist = fits.open(infile)
-    
-    cal_file = hdulist[0].header['calfile']
+@lru_cache(maxsize=32)
+def _read_cal_header(cal_file,mtime):
     hdulist_cal = fits.open(cal_file)
     scaling = hdulist_cal[2].header['scaling']
     averages = hdulist_cal[2].header['averages']
@@ -75,36 +71,56 @@ def readstream(infile,hdu = False):
     bins = hdulist_cal[1].data['bins'][1::] #first data point is useless and dumb
     blind_bins = hdulist_cal[1].data['Blindbin'][0:-1] #the last data point is useless and dumb
     hdulist_cal.close()
+    blind_index, non_blind_index = cached_blind_index(cal_file, lambda: (bins, blind_bins))
+    cal_header = {'scaling':scaling,'averages':averages,'freqs':np.array(freqs),'bins':np.array(bins),
+                      'blind_bins':np.array(blind_bins),'blind_index':blind_index,'non_blind_index':non_blind_index}
+    for value in cal_header.values():
+        if isinstance(value,np.ndarray):
+            value.setflags(write = False)
+    return cal_header
 
-    # we want to know which bins are blind bins so that we can appropriatly ignore them
-    # nested for loop is bad (slow in python) see if we can do better when bored
-    isblind = np.ones(bins.shape[0])
-    for k in range(0,blind_bins.size):
-        for j in range(0,blind_bins.size):
-            if bins[k] == blind_bins[j]:
-                isblind[k] = -1
-
-    blind_index = np.where(isblind<0)[0]
-    non_blind_index = np.where(isblind>0)[0]
-
-    #we have to find out how many hdulist entrys there are
-    i = -1
-    test = False
-    while test == False:
-        try:
-            i = i+1
-            k = hdulist[i]
-        except:
-            test = True
-    hdulist_length = i
-
-    tones = hdulist[1].data['tones'][0,:]
+
+# the parts of a calibration file that are needed to read the stream files that point to it
+# cached by file path and modification time so reading many stream files only opens the calfile once
+# the arrays are shared between calls so they are read only
+def read_cal_header(cal_file):
+    cal_file = os.path.abspath(cal_file)
+    return dict(_read_cal_header(cal_file,os.path.getmtime(cal_file)))
+
+
+def clear_cal_header_cache():
+    _read_cal_header.cache_clear()
+
+
+# read in a stream file, the calfile it points to is read for the scaling and the blind bins
+# hdus is a list of the data hdus to read i.e. range(1,3) for a quick look, defaults to all of them
+def readstream(infile,hdu = False,hdus = None,memmap = True):
+
+    hdulist = fits.open(infile,memmap = memmap)
     
-    I = hdulist[1].data['I']*scaling/averages
-    Q = hdulist[1].data['Q']*scaling/averages
-    for i in range(2,hdulist_length):
-        I = np.vstack((I,hdulist[i].data['I']*scaling/averages))
-        Q = np.vstack((Q,hdulist[i].data['Q']*scaling/averages))
+    cal_header = read_cal_header(hdulist[0].header['calfile'])
+    scaling = cal_header['scaling']
+    averages = cal_header['averages']
+    blind_index = cal_header['blind_index']
+    non_blind_index = cal_header['non_blind_index']
+
+    # size the output from the hdu headers so we only allocate once
+    if hdus is None:
+        hdus = range(1,len(hdulist))
+    rows = [hdulist[i].header['naxis2'] for i in hdus]
+    first = hdulist[hdus[0]].data['I']
+    dtype = np.result_type(first,scaling,averages,np.float32) #float so the in place division always works
+    I = np.empty((np.sum(rows),first.shape[1]),dtype = dtype)
+    Q = np.empty((np.sum(rows),first.shape[1]),dtype = dtype)
+    start = 0
+    for i, n in zip(hdus,rows):
+        I[start:start+n] = hdulist[i].data['I']
+        Q[start:start+n] = hdulist[i].data['Q']
+        start = start + n
+    I *= scaling
+    I /= averages
+    Q *= scaling
+    Q /= averages
 
     I_blind = I[:,blind_index]
     Q_blind = Q[:,blind_index]
@@ -124,32 +140,25 @@ def readstream(infile,hdu = False):
 
 def readsearch(filename,hdu = False):
     data  = fits.open(filename)
-    #some stuff to figure howmany hdulist there are
-    test = 0
-    i = 0
-    while test == 0:
-        try:
-            data[i].header[0]
-            i = i +1
-        except IndexError:
-            test = 1
-
-    num_rows = i 
-    sweeps = (num_rows - 1)/2
+    # the search file is a primary hdu followed by a setup hdu and a data hdu for each sweep
+    sweeps = (len(data) - 1)//2
     freqs = []
-    S21 = []
     I = []
     Q = []
 
+    # each sweep is converted with whole array operations then everything is concatenated once
+    # the data is taken column (tone) by column so it is flattened in the same order as the old loops
+    for j in range(0,sweeps):
+        setup = data[1+j*2]
+        sweep = data[2+j*2]
+        n_tones = setup.data.shape[0]-1
+        freqs.append((sweep.data['tones'][:,0:n_tones]*sweep.header['bininHz']).T.ravel())
+        I.append((sweep.data['I'][:,0:n_tones]*sweep.header['scaling']).T.ravel())
+        Q.append((sweep.data['Q'][:,0:n_tones]*sweep.header['scaling']).T.ravel())
+    freqs = np.concatenate(freqs)
+    I = np.concatenate(I)
+    Q = np.concatenate(Q)
 
-    for j in range(0,sweeps):# This is triple nested for loop So it is super slow becuase python sucks at nested for loops should fix with numba
-        for i in range(0,data[1+j*2].data.shape[0]-1):
-            for k in range(0,data[2+j*2].header['naxis2']):
-                freqs = np.append(freqs,data[2+j*2].data['tones'][k,i]*data[2+j*2].header['bininHz'])
-                I = np.append(I,data[2+j*2].data['I'][k,i]*data[2+j*2].header['scaling'])
-                Q = np.append(Q,data[2+j*2].data['Q'][k,i]*data[2+j*2].header['scaling'])
-                #S21 = np.append(S21,np.mean(data[2+j*2].data['I'][k,i]**2+data[2+j*2].data['Q'][k,i]**2)*data[2+j*2].header['scaling']**2)#Have to multiply by weird scaling factor
-    #print I[0]
     sorted_data = np.vstack((freqs,I,Q))
     sorted_data = np.transpose(sorted_data)
     sorted_data = sorted_data[sorted_data[:,0].argsort()]
@@ -1,5 +1,7 @@
 import numpy as np
+from typing import NamedTuple
 from scipy.io.idl import readsav as readsav
+from multitone_mako.blind_bins import cached_blind_index
 
 # this is code to read in the mako multitone data sav files generated by Steve's idl code and store it in something useful for python
 
@@ -11,11 +13,36 @@ from scipy.io.idl import readsav as readsav
 #To Do
 #Would it be nicer to have these spit out a dictionary? or have another code that spits out everything as a python dictionary
 #that would probably be better so that we don't have a backwards combatibiltiy problem whenever we add new output. 
+#read_raw and read_cal now return RawData and CalData named tuples (access by name, still unpack like the old tuples)
 
 #Change log
 #2017-06-02-jdw added catch for if there are no blind tone sin read_raw
 #2017-06-21-jdw changed file prefix so that it doesn't have to be in current directory
 #2017-06-21-jdw add keyword to allow loading of nonlinear fit extrapolated f0 calculated values 
+#2026-10-19 blind bins are found with np.isin (multitone_mako.blind_bins) and cached per rawdata.sav file
+#2026-10-19 read_raw converts the fine calibration with one array conversion and returns a RawData named tuple
+#2026-10-19 read_cal returns a CalData named tuple
+
+class RawData(NamedTuple):
+    non_blind_raw_i: np.ndarray  # stream data (time x resonator)
+    non_blind_raw_q: np.ndarray
+    blind_raw_i: np.ndarray
+    blind_raw_q: np.ndarray
+    f_res: np.ndarray  # resonator frequencies
+    f_res_blind: np.ndarray
+    non_blind_fine_i: np.ndarray  # fine calibration sweep (resonator x frequency step)
+    non_blind_fine_q: np.ndarray
+    blind_fine_i: np.ndarray
+    blind_fine_q: np.ndarray
+
+
+class CalData(NamedTuple):
+    non_blind_S21_tan: np.ndarray  # calibrated stream (time x resonator)
+    non_blind_S21_norm: np.ndarray
+    blind_S21_tan: np.ndarray
+    blind_S21_norm: np.ndarray
+    f0_calc: np.ndarray  # calculated resonator frequency stream (time x non blind resonator)
+
 
 def read_raw(filename): #filename is just the date/time code
 
@@ -25,17 +52,7 @@ def read_raw(filename): #filename is just the date/time code
     raw = readsav(filename +"/rawdata.sav",verbose = False)
     bins = raw['multitone_data_raw']['bins'][0] 
     blindbins = raw['multitone_data_raw']['blindbin'][0]
-    if len(blindbins) == 0: #there are no blind bins
-        isblind = np.ones(bins.size)
-    else:
-        isblind = np.ones(bins.size)
-        for i in range(0,bins.size):
-            for j in range(0,blindbins.size):
-                if bins[i] == blindbins[j]:
-                    isblind[i] = 0
-
-    blind_index = np.where(isblind<0.5)[0]
-    non_blind_index = np.where(isblind>0)[0]
+    blind_index, non_blind_index = cached_blind_index(filename +"/rawdata.sav", lambda: (bins, blindbins))
 
     f_res_all = raw['multitone_data_raw']['frlist'][0]
     # reads the data in 
@@ -44,7 +61,6 @@ def read_raw(filename): #filename is just the date/time code
 
     raw_i = raw['multitone_data_raw'][0]['streamdata']['stream_data_concat'][0]['s21i'][0]
     raw_q = raw['multitone_data_raw'][0]['streamdata']['stream_data_concat'][0]['s21q'][0]
-    print raw_i.shape
     non_blind_raw_i = raw_i[:,non_blind_index]
     non_blind_raw_q = raw_q[:,non_blind_index]
 
@@ -53,18 +69,14 @@ def read_raw(filename): #filename is just the date/time code
 
 
     # get the fine calibration data
-    fine_i = np.zeros((bins.shape[0],raw['multitone_data_raw']['fine_caldata'][0]['data_calibration'][0]['i'].shape[0]))
-    fine_q = np.zeros((bins.shape[0],raw['multitone_data_raw']['fine_caldata'][0]['data_calibration'][0]['q'].shape[0]))
-    for b in range(0,raw['multitone_data_raw']['fine_caldata'][0]['data_calibration'][0]['i'].shape[0]):
-        fine_i[:,b] = raw['multitone_data_raw']['fine_caldata'][0]['data_calibration'][0]['i'][b]
-        fine_q[:,b] = raw['multitone_data_raw']['fine_caldata'][0]['data_calibration'][0]['q'][b]
+    # the idl structure holds one array of all the bins per frequency step so stack them in one go
+    # and transpose (a view) to get bins x frequency steps
+    data_calibration = raw['multitone_data_raw']['fine_caldata'][0]['data_calibration'][0]
+    fine_i = np.array(list(data_calibration['i']),dtype = np.float64).T
+    fine_q = np.array(list(data_calibration['q']),dtype = np.float64).T
 
-    non_blind_fine_i = fine_i[non_blind_index,:]
-    non_blind_fine_q = fine_q[non_blind_index,:]
-    blind_fine_i = fine_i[blind_index,:]
-    blind_fine_q = fine_q[blind_index,:]
-
-    return non_blind_raw_i,non_blind_raw_q,blind_raw_i,blind_raw_q,f_res,f_res_blind,non_blind_fine_i,non_blind_fine_q,blind_fine_i,blind_fine_q
+    return RawData(non_blind_raw_i,non_blind_raw_q,blind_raw_i,blind_raw_q,f_res,f_res_blind,
+                   fine_i[non_blind_index,:],fine_q[non_blind_index,:],fine_i[blind_index,:],fine_q[blind_index,:])
 
 def read_cal(filename,**keywords): #reading the calibrated file requires the raw file as well
     if ('model' in keywords):
@@ -80,15 +92,7 @@ def read_cal(filename,**keywords): #reading the calibrated file requires the raw
     # have to find out which bins are blind again
     bins = raw['multitone_data_raw']['bins'][0]
     blindbins = raw['multitone_data_raw']['blindbin'][0]
-    isblind = np.ones(bins.size)
-
-    for i in range(0,bins.size):
-        for j in range(0,blindbins.size):
-            if bins[i] == blindbins[j]:
-                isblind[i] = 0
-
-    blind_index = np.where(isblind<0.5)[0]
-    non_blind_index = np.where(isblind>0)[0]
+    blind_index, non_blind_index = cached_blind_index(filename +"/rawdata.sav", lambda: (bins, blindbins))
     
     S21_tan = np.imag(cal['multitone_data_calibrated'][0]['master_s21_stream_corr_rot_resampled']).astype('float64')[:,0,:]
     S21_norm = np.real(cal['multitone_data_calibrated'][0]['master_s21_stream_corr_rot_resampled']).astype('float64')[:,0,:]
@@ -113,7 +117,7 @@ def read_cal(filename,**keywords): #reading the calibrated file requires the raw
     f0_calc = f0_calc[:,non_blind_index]
 
 
-    return non_blind_S21_tan,non_blind_S21_norm,blind_S21_tan,blind_S21_norm,f0_calc
+    return CalData(non_blind_S21_tan,non_blind_S21_norm,blind_S21_tan,blind_S21_norm,f0_calc)
 
     
 